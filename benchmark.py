@@ -0,0 +1,264 @@
+"""
+Benchmark of PixelFactory operations on synthetic images and markings
+
+    python benchmark.py --sizes 1 10 50 --shapes 1 100 5000 --save base.json
+    python benchmark.py --sizes 1 10 50 --shapes 1 100 5000 --compare base.json
+
+Every case (op, image size, number of shapes) runs in its own process, so
+peak RSS belongs to that case only. Time is the median of `--repeat` runs,
+allocation is measured by tracemalloc on one extra run, which sees numpy
+and python objects but not PIL image buffers. With `--compare`, the exit
+code is 1 if any case is slower than baseline by more than `--tolerance`.
+
+    python benchmark.py --startup
+
+measures import time of entry modules instead, each in a fresh interpreter,
+against `STARTUP` budgets, and fails if a module is over its budget or
+loads a module it must not, e.g. shapely for an import alone.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Tuple
+from PIL import Image
+from pixelFactory import PixelFactory
+
+OPS = ['copyRegion', 'pasteRegion', 'rotate', 'rotateMany', 'noise', 'masking', 'parseToCsts',
+    'constrainsCheck', 'constrainsCheckPrepared']
+
+# import budget in seconds of entry modules, numpy and PIL take most of it
+STARTUP = {'main': 0.05, 'pixelFactory': 0.3, 'pixelPipeline': 0.35, 'pixelPlan': 0.35,
+    'pixelAsync': 0.4}
+# modules that an import alone must not load
+HEAVY = ['shapely', 'matplotlib', 'concurrent.futures.process']
+
+
+def synthImage(mp: float, seed=0) -> Image.Image:
+    """
+    RGBA image of about `mp` mega pixels in 4:3
+    """
+    w = int(math.sqrt(mp * 1e6 * 4 / 3))
+    h = int(mp * 1e6 / w)
+    rng = numpy.random.default_rng(seed)
+    # smooth random pattern, cheaper than full random and jpeg friendly
+    small = rng.integers(0, 255, (max(1, h // 16), max(1, w // 16), 4), dtype=numpy.uint8)
+    small[:, :, 3] = 255
+    return Image.fromarray(small, 'RGBA').resize((w, h))
+
+
+def synthMarkings(size: Tuple, n: int, seed=0) -> List[Dict]:
+    """
+    `n` random hexagon-like polygons spread over an image of `size`
+    """
+    rng = numpy.random.default_rng(seed)
+    r = max(4.0, 0.5 * math.sqrt(size[0] * size[1] / max(n, 1)) / 2)
+    mk = []
+    for i in range(n):
+        t = numpy.sort(rng.uniform(0, 2 * math.pi, 6))
+        c = rng.uniform([r, r], [size[0] - r, size[1] - r])
+        rr = r * rng.uniform(0.5, 1.0)
+        mk.append({'param': numpy.c_[c[0] + rr * numpy.cos(t), c[1] + rr * numpy.sin(t)],
+            'type': 'polygon', 'label': 'WeiLong{}'.format(i)})
+    return mk
+
+
+def _setup(op: str, mp: float, n: int):
+    # return a function doing one op, and number of pixels it touches
+    pf = PixelFactory()
+    px = synthImage(mp)
+    mk = synthMarkings(px.size, n)
+    frame = (0, 0, px.size[0], px.size[1])
+    cut, cutMk = pf.copyRegion(px, mk[0])
+    pos = (px.size[0] // 3, px.size[1] // 3)
+
+    if op == 'copyRegion':
+        return (lambda: pf.copyRegion(px, mk[0]), cut.size[0] * cut.size[1])
+    elif op == 'pasteRegion':
+        return (lambda: pf.pasteRegion(px, mk, cut, cutMk, pos), px.size[0] * px.size[1])
+    elif op == 'rotate':
+        return (lambda: pf.rotate(cut, cutMk, 30), cut.size[0] * cut.size[1])
+    elif op == 'rotateMany':
+        # 36 angles of one cutout, every variant read
+        return (lambda: list(pf.rotateMany([(cut, cutMk)], range(0, 360, 10))),
+            36 * cut.size[0] * cut.size[1])
+    elif op == 'noise':
+        return (lambda: pf.noise(px, 0.95, rng=0), px.size[0] * px.size[1])
+    elif op == 'masking':
+        return (lambda: pf.masking(px, mk), px.size[0] * px.size[1])
+    elif op == 'parseToCsts':
+        return (lambda: pf.parseToCsts(mk, frame), 0)
+    elif op == 'constrainsCheck':
+        csts = pf.parseToCsts(mk, frame)
+        new = dict(cutMk, param=cutMk['param'] + pos)
+        return (lambda: pf.constrainsCheck(new, csts, overlap=0.5, within=0.5), 0)
+    elif op == 'constrainsCheckPrepared':
+        csts = pf.prepareCsts(mk, frame)
+        new = dict(cutMk, param=cutMk['param'] + pos)
+        return (lambda: pf.constrainsCheck(new, csts, overlap=0.5, within=0.5), 0)
+    raise Exception('Op {} not supported'.format(op))
+
+
+def runCase(op: str, mp: float, n: int, repeat: int) -> Dict:
+    """
+    measure one case in this process
+    """
+    fn, pixels = _setup(op, mp, n)
+    fn()  # warm up
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+
+    tracemalloc.start()
+    snap = tracemalloc.take_snapshot()
+    fn()
+    blocks = sum(max(0, st.count_diff) for st in tracemalloc.take_snapshot().compare_to(snap, 'lineno'))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    sec = statistics.median(times)
+    return {
+        'op': op, 'mp': mp, 'shapes': n,
+        'sec': sec,
+        'ops_per_sec': 1.0 / sec if sec > 0 else float('inf'),
+        'mpx_per_sec': pixels / 1e6 / sec if pixels and sec > 0 else None,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        'peak_alloc_mb': peak / 2.0 ** 20,
+        'alloc_blocks': blocks,
+    }
+
+
+def run(ops: List[str], sizes: List[float], shapes: List[int], repeat=3, isolate=True) -> List[Dict]:
+    res = []
+    cases = [(op, mp, n) for mp in sizes for n in shapes for op in ops]
+    if not isolate:
+        return [runCase(op, mp, n, repeat) for op, mp, n in cases]
+    ctx = multiprocessing.get_context('spawn')
+    for op, mp, n in cases:
+        # fresh process of every case, so ru_maxrss is its own
+        with ProcessPoolExecutor(1, mp_context=ctx) as ex:
+            res.append(ex.submit(runCase, op, mp, n, repeat).result())
+    return res
+
+
+def compare(res: List[Dict], base: List[Dict], tolerance: float) -> List[Tuple]:
+    """
+    return (case, base sec, sec, ratio) of cases slower than baseline by more
+    than `tolerance`
+    """
+    key = lambda r: (r['op'], r['mp'], r['shapes'])
+    base = {key(r): r for r in base}
+    slow = []
+    for r in res:
+        b = base.get(key(r))
+        if b is None:
+            continue
+        ratio = r['sec'] / b['sec'] if b['sec'] > 0 else 1.0
+        r['ratio'] = ratio
+        if ratio > 1 + tolerance:
+            slow.append((key(r), b['sec'], r['sec'], ratio))
+    return slow
+
+
+def importTime(module: str, repeat=5) -> Dict:
+    """
+    median import time of `module` in fresh interpreters, and the modules of
+    `HEAVY` it loads
+    """
+    code = ('import sys, time\nt = time.perf_counter()\nimport {}\n'
+        'print(time.perf_counter() - t)\nprint(*[m for m in {!r} if m in sys.modules])'
+        ).format(module, HEAVY)
+    here = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], cwd=here, check=True,
+            stdout=subprocess.PIPE, universal_newlines=True).stdout.split('\n')
+        times.append(float(out[0]))
+    return {'module': module, 'sec': statistics.median(times), 'heavy': out[1].split()}
+
+
+def startup(budget: Dict = None, repeat=5) -> List[Dict]:
+    """
+    `importTime` of every module of `budget`, default to `STARTUP`. Every
+    result has `over`, True if it is over budget or loads a heavy module
+    """
+    res = []
+    for module, limit in (budget or STARTUP).items():
+        r = importTime(module, repeat)
+        r['budget'] = limit
+        r['over'] = r['sec'] > limit or bool(r['heavy'])
+        res.append(r)
+    return res
+
+
+def report(res: List[Dict], out=sys.stdout):
+    head = '{:<24}{:>7}{:>8}{:>12}{:>11}{:>10}{:>10}{:>10}{:>8}'
+    print(head.format('op', 'MP', 'shapes', 'ms', 'ops/s', 'MPx/s', 'rss MB', 'alloc MB',
+        'ratio'), file=out)
+    for r in res:
+        print(head.format(
+            r['op'], r['mp'], r['shapes'], '{:.3f}'.format(r['sec'] * 1e3),
+            '{:.1f}'.format(r['ops_per_sec']),
+            '-' if r['mpx_per_sec'] is None else '{:.1f}'.format(r['mpx_per_sec']),
+            '{:.0f}'.format(r['peak_rss_mb']), '{:.1f}'.format(r['peak_alloc_mb']),
+            '{:.2f}'.format(r['ratio']) if 'ratio' in r else '-'), file=out)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='benchmark PixelFactory operations')
+    parser.add_argument('--ops', nargs='+', default=OPS, choices=OPS)
+    parser.add_argument('--sizes', nargs='+', type=float, default=[1, 4],
+        help='image sizes in mega pixels')
+    parser.add_argument('--shapes', nargs='+', type=int, default=[1, 100, 1000],
+        help='numbers of markings')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-isolate', action='store_true',
+        help='run all cases in this process, peak RSS is then cumulative')
+    parser.add_argument('--save', help='save results as baseline json')
+    parser.add_argument('--compare', help='baseline json to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+        help='allowed slowdown against baseline, 0.25 is 25%%')
+    parser.add_argument('--startup', action='store_true',
+        help='measure import time of entry modules against their budgets instead')
+    parser.add_argument('--budget', nargs='+', default=None, metavar='MODULE=SEC',
+        help='import budgets replacing the default ones, with --startup')
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        budget = None
+        if args.budget:
+            budget = {k: float(v) for k, v in (b.split('=') for b in args.budget)}
+        res = startup(budget, args.repeat)
+        for r in res:
+            print('{:<16}{:>9.1f}ms  budget {:.0f}ms  {}{}'.format(r['module'], r['sec'] * 1e3,
+                r['budget'] * 1e3, 'OVER ' if r['over'] else '',
+                'loads ' + ' '.join(r['heavy']) if r['heavy'] else ''))
+        return 1 if any(r['over'] for r in res) else 0
+
+    res = run(args.ops, args.sizes, args.shapes, args.repeat, not args.no_isolate)
+    slow = []
+    if args.compare:
+        with open(args.compare) as f:
+            slow = compare(res, json.load(f), args.tolerance)
+    report(res)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(res, f, indent=2)
+    for case, b, s, ratio in slow:
+        print('REGRESSION {} {:.3f}ms -> {:.3f}ms ({:.2f}x)'.format(case, b * 1e3, s * 1e3, ratio))
+    return 1 if slow else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,29 @@
-from pixelFactory import PixelFactory
-import base64
-import json
-import os
-import shutil
-import io
-import random
-import numpy
-import copy
-from PIL import Image
-from matplotlib import pyplot
+"""
+Command line entry of labelEnhancer
+
+    python main.py pipeline src dst --ops ops.json
+    python main.py async src dst --ops ops.json
+    python main.py plan plan src --ops ops.json -o plans.jsonl
+    python main.py index build src --db shapes.db
+    python main.py bench --startup
+    python main.py demo
+
+Only the module of the selected command is imported, so e.g. `noise` and
+`masking` ops never load shapely, and `--help` loads neither numpy nor PIL
+"""
+import argparse
+import importlib
+import sys
+
+# command -> (module, description)
+COMMANDS = {
+    'pipeline': ('pixelPipeline', 'augment a directory with worker processes'),
+    'async': ('pixelAsync', 'augment a directory in one process, stages overlapped'),
+    'plan': ('pixelPlan', 'make or run augmentation plans'),
+    'index': ('pixelIndex', 'index shapes of LabelMe files, or select from the index'),
+    'bench': ('benchmark', 'benchmark operations, or import time with --startup'),
+    'demo': (None, 'paste a marking of imgs/ ten times into tmp/'),
+}
 
 
 # from PIL import Image, ExifTags
@@ -232,9 +247,13 @@ from matplotlib import pyplot
 #
 #         return not_import
 
-if __name__ == '__main__':
-    # create a tmp folder, or empty it
-    # use to keep tmp files or data
+def demo():
+    import base64
+    import io
+    import json
+    import numpy
+    from PIL import Image
+    from pixelFactory import PixelFactory
 
     pixFac = PixelFactory()
 
@@ -269,10 +288,32 @@ if __name__ == '__main__':
 
     buf = io.BytesIO()
     res_px = res_px.convert('RGB')
-    res_px.save(buf, format='JPEG')  # save as byte data
-    jData['imageData'] = base64.b64encode(buf.getvalue()).decode('ascii')
+    res_px.save(buf, format='JPEG')  # save as byte data, encode only once
+    jData['imageData'] = base64.b64encode(buf.getbuffer()).decode('ascii')
     jData['imageHeight'] = res_px.size[1]
     jData['imageWidth'] = res_px.size[0]
 
-    res_px.save('tmp/Image_20200613150453211.jpg')
+    with open('tmp/Image_20200613150453211.jpg', 'wb') as f:
+        f.write(buf.getbuffer())
     json.dump(jData, open('tmp/Image_20200613150453211.json', 'w+'), indent=2)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='labelEnhancer',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='\n'.join('  {:<10}{}'.format(k, v[1]) for k, v in COMMANDS.items()))
+    parser.add_argument('cmd', choices=list(COMMANDS), metavar='command')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='arguments of the command')
+    args = parser.parse_args(argv)
+
+    module = COMMANDS[args.cmd][0]
+    if module is None:
+        demo()
+        return 0
+    res = importlib.import_module(module).main(args.args)
+    # exit code of commands returning one, e.g. bench
+    return res if args.cmd == 'bench' else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
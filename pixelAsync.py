@@ -0,0 +1,197 @@
+"""
+Augment a directory of LabelMe pairs in one process, with reading,
+decoding, augmenting and encoding of different pairs overlapped
+
+Pairs flow through four stages connected by bounded queues
+
+    read       raw bytes of the image
+    decode     image to RGBA, json to markings
+    compute    chain of ops, see `pixelPipeline`
+    encode     jpg and json, or shards with `fmt='shard'`
+
+Every stage runs its own number of workers in a thread pool. PIL decode,
+encode and most numpy and shapely calls release the GIL, so disk and CPU
+are kept busy together. A full queue blocks the stage before it, so no
+more than `queueSize` pairs wait between two stages
+
+    async for name in AsyncPipeline(ops).run(src, dst):
+        print(name)
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import threading
+import numpy
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple
+from PIL import Image
+from pixelFactory import PixelFactory
+from pixelShard import ShardWriter
+from pixelPipeline import augment
+import pixelIO
+
+_END = object()  # end of a queue
+
+
+class AsyncPipeline:
+    def __init__(self, ops: List[Dict], readers=2, decoders=2, computers=1, encoders=2,
+        queueSize=4, seed=None, embed=True, fmt='labelme'):
+        """
+        Parameter
+        ---------
+        ops
+            list of ops, see `pixelPipeline`
+        readers, decoders, computers, encoders
+            number of concurrent workers of every stage
+        queueSize
+            maximum pairs waiting between two stages
+        seed, embed, fmt
+            same as `pixelPipeline.Pipeline`
+        """
+        if fmt not in ('labelme', 'shard'):
+            raise Exception('Format {} not supported'.format(fmt))
+        self.ops = ops
+        self.workers = (readers, decoders, computers, encoders)
+        self.queueSize = queueSize
+        self.seed = seed
+        self.embed = embed
+        self.fmt = fmt
+        self._local = threading.local()  # PixelFactory of every thread
+        self._lock = threading.Lock()    # ShardWriter is not thread safe
+        self._writer = None
+
+    def _read(self, job: Tuple) -> Tuple:
+        name, pxPath, mkPath, dstDir, seed = job
+        with open(pxPath, 'rb') as f:
+            raw = f.read()
+        return (name, raw, pxPath, mkPath, dstDir, seed)
+
+    def _decode(self, job: Tuple) -> Tuple:
+        name, raw, pxPath, mkPath, dstDir, seed = job
+        lf = pixelIO.LabelMeFile(mkPath, pxPath)
+        px = pixelIO.exifTranspose(Image.open(io.BytesIO(raw))).convert('RGBA')
+        return (name, px, lf.data, lf.markings(), dstDir, seed)
+
+    def _compute(self, job: Tuple) -> Tuple:
+        name, px, jData, mk, dstDir, seed = job
+        pf = getattr(self._local, 'pf', None)
+        if pf is None:
+            # occlusion engine of PixelFactory keeps state between pastes
+            pf = self._local.pf = PixelFactory()
+        px, mk = augment(px, mk, self.ops, seed, pf)
+        return (name, px, jData, mk, dstDir)
+
+    def _encode(self, job: Tuple) -> str:
+        name, px, jData, mk, dstDir = job
+        if self.fmt == 'shard':
+            arr = numpy.asarray(px)
+            with self._lock:
+                if self._writer is None or self._writer.dstDir != dstDir:
+                    self._writer = ShardWriter(dstDir)
+                self._writer.add(name, arr, mk)
+        else:
+            pixelIO.dumpLabelMe(px, jData, mk, dstDir, name, embed=self.embed)
+        return name
+
+    async def _stage(self, fn, qin: asyncio.Queue, qout: asyncio.Queue, n: int, nOut: int,
+        ex: ThreadPoolExecutor):
+        # run `n` workers applying `fn` from `qin` to `qout`, then end `qout`
+        # for each of its `nOut` consumers
+        loop = asyncio.get_running_loop()
+
+        async def worker():
+            while True:
+                item = await qin.get()
+                if item is _END:
+                    return
+                await qout.put(await loop.run_in_executor(ex, fn, item))
+
+        await asyncio.gather(*[worker() for _ in range(n)])
+        for _ in range(nOut):
+            await qout.put(_END)
+
+    async def _feed(self, jobs, qout: asyncio.Queue, nOut: int):
+        for job in jobs:
+            await qout.put(job)
+        for _ in range(nOut):
+            await qout.put(_END)
+
+    async def run(self, srcDir: str, dstDir: str, pxExt=('jpg', 'jpeg', 'png', 'bmp'),
+        mkExt=('json', )):
+        """
+            asynchronous generator operation
+            process every pair in `srcDir` and write result to `dstDir`,
+            yield name of every finished pair
+        """
+        os.makedirs(dstDir, exist_ok=True)
+        seeds = numpy.random.SeedSequence(self.seed)
+        jobs = ((name, pxPath, mkPath, dstDir, seeds.spawn(1)[0])
+            for name, pxPath, mkPath in pixelIO.scanPairs(srcDir, pxExt, mkExt))
+
+        qs = [asyncio.Queue(self.queueSize) for _ in range(5)]
+        fns = (self._read, self._decode, self._compute, self._encode)
+        nOut = self.workers[1:] + (1, )
+        with ThreadPoolExecutor(sum(self.workers)) as ex:
+            tasks = [asyncio.ensure_future(self._feed(jobs, qs[0], self.workers[0]))] + [
+                asyncio.ensure_future(self._stage(fns[i], qs[i], qs[i + 1], self.workers[i],
+                    nOut[i], ex)) for i in range(4)]
+            allDone = asyncio.gather(*tasks)
+            try:
+                while True:
+                    get = asyncio.ensure_future(qs[-1].get())
+                    await asyncio.wait({get, allDone}, return_when=asyncio.FIRST_COMPLETED)
+                    if not get.done():
+                        # a stage failed, or every stage finished
+                        get.cancel()
+                        allDone.result()
+                        get = asyncio.ensure_future(qs[-1].get())
+                    name = await get
+                    if name is _END:
+                        break
+                    yield name
+                await allDone
+            finally:
+                for task in tasks:
+                    task.cancel()
+                if self._writer is not None:
+                    self._writer.close()
+                    self._writer = None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description='augment a directory of LabelMe files in one process, stages overlapped')
+    parser.add_argument('src', help='source folder')
+    parser.add_argument('dst', help='output folder')
+    parser.add_argument('--ops', required=True, help='json file of op list')
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--decoders', type=int, default=2)
+    parser.add_argument('--computers', type=int, default=1)
+    parser.add_argument('--encoders', type=int, default=2)
+    parser.add_argument('--queue', type=int, default=4, help='pairs waiting between stages')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--sidecar', action='store_true',
+        help='do not embed image into json, refer to the jpg instead')
+    parser.add_argument('--format', default='labelme', choices=['labelme', 'shard'])
+    args = parser.parse_args(argv)
+
+    with open(args.ops) as f:
+        ops = json.load(f)
+
+    async def count():
+        cnt = 0
+        async for _ in AsyncPipeline(ops, args.readers, args.decoders, args.computers,
+                args.encoders, args.queue, args.seed, not args.sidecar,
+                args.format).run(args.src, args.dst):
+            cnt += 1
+        return cnt
+
+    cnt = asyncio.run(count())
+    print('{} pairs processed'.format(cnt))
+    return cnt
+
+
+if __name__ == '__main__':
+    main()
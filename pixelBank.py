@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy
+from collections import OrderedDict
+from typing import List, Dict, Tuple
+from PIL import Image
+from pixelFactory import PixelFactory
+import pixelIO
+
+
+class ObjectBank:
+    """
+    labelled objects cut out of LabelMe files, as RGBA images whose alpha
+    is the mask of the marking, with the marking in the coordinate of the
+    cutout. Every file is cut only once, cutouts are kept in a size bounded
+    LRU and, if `cacheDir` is given, on disk keyed by hash of the file, of
+    its image unless embedded, and index of the shape, so later runs do not
+    cut again
+
+    Usage
+    -----
+        bank = ObjectBank('cache')
+        for mkPath, idx, label in bank.index('imgs'):
+            px, mk = bank.get(mkPath, idx)
+    """
+    def __init__(self, cacheDir: str = None, maxBytes=256 << 20, pf: PixelFactory = None):
+        """
+        Parameter
+        ---------
+        cacheDir
+            folder of on-disk cache, no disk cache if None
+        maxBytes
+            maximum bytes of cutout pixels kept in memory
+        """
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self._pf = pf or PixelFactory()
+        self._lru = OrderedDict()  # key -> (px, mk, nbytes)
+        self._bytes = 0
+        self._hash = {}   # path -> (mtime, size, hash)
+        self._image = {}  # (mkPath, pxPath) -> (hash of json, image file or None)
+        self._index = {}  # folder -> list of (mkPath, idx, label)
+        if cacheDir is not None:
+            os.makedirs(cacheDir, exist_ok=True)
+
+    def fileHash(self, path: str) -> str:
+        """
+        sha1 of the file, only computed again if the file changed
+        """
+        st = os.stat(path)
+        old = self._hash.get(path)
+        if old is not None and old[:2] == (st.st_mtime_ns, st.st_size):
+            return old[2]
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for blk in iter(lambda: f.read(1 << 20), b''):
+                h.update(blk)
+        self._hash[path] = (st.st_mtime_ns, st.st_size, h.hexdigest())
+        return h.hexdigest()
+
+    def cacheKey(self, mkPath: str, pxPath: str = None) -> str:
+        """
+        hash of the json, and of the image unless it is embedded in the
+        json, so cutouts of a replaced image are cut again
+        """
+        h = self.fileHash(mkPath)
+        src = self._image.get((mkPath, pxPath))
+        if src is None or src[0] != h:
+            # the json changed, its image may have changed as well
+            src = (h, pixelIO.LabelMeFile(mkPath, pxPath).imageFile)
+            self._image[(mkPath, pxPath)] = src
+        if src[1] is None:
+            return h
+        return hashlib.sha1((h + self.fileHash(src[1])).encode('ascii')).hexdigest()
+
+    def index(self, srcDir: str, pxExt=('jpg', 'jpeg', 'png', 'bmp'), mkExt=('json', )) -> List[Tuple]:
+        """
+        return (marking path, shape index, label) of every polygon in `srcDir`
+        """
+        if srcDir not in self._index:
+            res = []
+            for _, pxPath, mkPath in pixelIO.scanPairs(srcDir, pxExt, mkExt):
+                for idx, sh in enumerate(pixelIO.LabelMeFile(mkPath).shapes):
+                    if (sh.get('shape_type') or 'polygon') == 'polygon' and len(sh['points']) > 2:
+                        res.append((mkPath, idx, sh.get('label', '')))
+            self._index[srcDir] = res
+        return self._index[srcDir]
+
+    def get(self, mkPath: str, idx: int, pxPath: str = None) -> Tuple:
+        """
+        return a tuple contains cutout in RGBA mode and its marking, of the
+        `idx`-th shape of `mkPath`. Returned objects are shared, do not
+        modify them in place
+
+        Parameter
+        ---------
+        pxPath
+            path to the image, default to `imagePath` of the json
+        """
+        key = (self.cacheKey(mkPath, pxPath), idx)
+        hit = self._lru.get(key)
+        if hit is not None:
+            self._lru.move_to_end(key)
+            return hit[:2]
+
+        hit = self._load(key)
+        if hit is None:
+            # cut every object of the file, the image is decoded only once
+            for sub, obj in self._cut(mkPath, pxPath).items():
+                self._save((key[0], sub), obj)
+                if sub == idx:
+                    hit = obj
+                else:
+                    self._put((key[0], sub), obj)
+        if hit is None:
+            raise Exception('Shape {} of {} can not be cut'.format(idx, mkPath))
+        self._put(key, hit)
+        return hit
+
+    def marking(self, mkPath: str, idx: int) -> Dict:
+        """
+        marking of the cutout of `get`, from the json only, the image is
+        not cut
+        """
+        key = (self.cacheKey(mkPath), idx)
+        hit = self._lru.get(key)
+        if hit is not None:
+            return hit[1]
+        mk = pixelIO.LabelMeFile(mkPath).markings()[idx]
+        shf = numpy.floor(numpy.min(numpy.reshape(mk['param'], (-1, 2)), axis=0))
+        return dict(mk, param=mk['param'] - shf)
+
+    def _cut(self, mkPath: str, pxPath: str) -> Dict:
+        lf = pixelIO.LabelMeFile(mkPath, pxPath)
+        px = lf.image()
+        res = {}
+        for idx, mk in enumerate(lf.markings()):
+            if mk['type'] != 'polygon' or len(mk['param']) < 3:
+                continue
+            cutPx, cutMk = self._pf.copyRegion(px, mk)
+            res[idx] = (self._pf.masking(cutPx, [cutMk]), cutMk)
+        return res
+
+    def _put(self, key: Tuple, obj: Tuple):
+        nbytes = obj[0].size[0] * obj[0].size[1] * 4
+        if key in self._lru:
+            self._bytes -= self._lru.pop(key)[2]
+        self._lru[key] = (obj[0], obj[1], nbytes)
+        self._bytes += nbytes
+        while self._bytes > self.maxBytes and len(self._lru) > 1:
+            self._bytes -= self._lru.popitem(last=False)[1][2]
+
+    def _path(self, key: Tuple) -> str:
+        return os.path.join(self.cacheDir, '{}_{}'.format(*key))
+
+    def _load(self, key: Tuple) -> Tuple:
+        if self.cacheDir is None or not os.path.exists(self._path(key) + '.json'):
+            return None
+        px = Image.open(self._path(key) + '.png')
+        px.load()
+        with open(self._path(key) + '.json') as f:
+            mk = pixelIO.toMarkings([json.load(f)])[0]
+        return (px, mk)
+
+    def _save(self, key: Tuple, obj: Tuple):
+        if self.cacheDir is None:
+            return
+        # workers, processes or threads, may save the same entry, write to
+        # own file then rename. json is written last, it marks a complete
+        # entry
+        data = json.dumps(pixelIO.toShapes([obj[1]])[0]).encode()
+        for ext, write in (('.png', lambda f: obj[0].save(f, format='PNG')),
+                ('.json', lambda f: f.write(data))):
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.cacheDir)
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp, self._path(key) + ext)
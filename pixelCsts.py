@@ -0,0 +1,301 @@
+import numpy
+import shapely
+from shapely import STRtree
+from shapely.geometry import Polygon, LineString, Point
+from typing import Dict, Tuple
+import pixelEllipse
+import pixelMetrics
+
+
+class PreparedCsts:
+    """
+    constrains prepared for repeated `PixelFactory.constrainsCheck` calls.
+    All polygons, lines and points are kept in one STRtree, so a check only
+    visits the shapes whose bounding box meets the new marking, and exact
+    overlap is only computed for shapes that really intersect it.
+
+    Constrains can be added, removed and replaced as objects are pasted.
+    Added ones are kept out of the tree and checked by their bounding box,
+    removed ones are skipped, the tree is only built again when those
+    changes reach a fraction of all constrains, so an update costs
+    O(log n) amortized instead of a rebuild
+
+    Ellipses and circles are kept as polygons, see `pixelEllipse`. A new
+    ellipse is first checked analytically against points and ellipses
+    near it, its polygon is only made when that does not decide
+
+    Usage
+    -----
+        csts = PreparedCsts(pf.parseToCsts(mk, (0, 0, w, h)))
+        for pos in candidates:
+            ok = pf.constrainsCheck(newMk, csts, overlap=0.1)
+        key = csts.add(pastedMk)
+        key = csts.replace(key, occludedMk)
+    """
+    POLY, LINE, POIN = 0, 1, 2
+    KINDS = {'polygon': POLY, 'line': LINE, 'point': POIN, 'ellipse': POLY, 'circle': POLY}
+    _REBUILD = 64  # changes always allowed before the tree is built again
+
+    def __init__(self, csts: Tuple, ellipses: Dict = None):
+        """
+        Parameter
+        ---------
+        csts
+            output of `PixelFactory.parseToCsts`,
+            [[Polygon(), ], [LineString(), ], [Point(), ], Polygon()]
+            the key of a constrain is its index in polygons, lines and
+            points, in that order
+        ellipses
+            (c, u, v) of polygons that are ellipses, by key, see
+            `ellipseAxes`
+        """
+        poly, line, poin, fram = csts
+        self.fram = fram
+        self._n = len(poly) + len(line) + len(poin)  # slots in use
+        self._geoms = numpy.array(list(poly) + list(line) + list(poin), dtype=object)
+        self._kind = numpy.repeat(
+            [self.POLY, self.LINE, self.POIN], [len(poly), len(line), len(poin)])
+        shapely.prepare(self._geoms)
+        shapely.prepare(self.fram)
+        # bounding box of every constrain, [x_min, y_min, x_max, y_max]
+        self._bounds = shapely.bounds(self._geoms).reshape(-1, 4)
+        # area of polygons, length of lines, used as overlap reference
+        self._area = shapely.area(self._geoms)
+        self._length = shapely.length(self._geoms)
+        self._alive = numpy.ones(self._n, dtype=bool)
+        self._axes = dict(ellipses or {})
+        self._build()
+
+    def _build(self):
+        # tree of living constrains, slots after `_treeN` are checked by box
+        self._treeIdx = numpy.flatnonzero(self._alive[: self._n])
+        self._tree = STRtree(self._geoms[self._treeIdx])
+        self._treeN = self._n
+        self._changes = 0
+
+    def __len__(self):
+        return int(self._alive[: self._n].sum())
+
+    @property
+    def bounds(self) -> numpy.ndarray:
+        """
+        (n, 4) bounding box of every living constrain
+        """
+        if self._alive[: self._n].all():
+            return self._bounds[: self._n]
+        return self._bounds[: self._n][self._alive[: self._n]]
+
+    def geometries(self) -> Tuple:
+        """
+        kinds and shapely objects of every living constrain
+        """
+        alive = numpy.flatnonzero(self._alive[: self._n])
+        return (self._kind[alive], self._geoms[alive])
+
+    def candidates(self, new) -> numpy.ndarray:
+        """
+        indices of constrains that intersect shapely object `new`
+        """
+        pixelMetrics.count('shapely.query')
+        idx = self._treeIdx[self._tree.query(new, predicate='intersects')]
+        if self._changes:
+            idx = idx[self._alive[idx]]
+        if self._treeN < self._n:
+            x0, y0, x1, y1 = new.bounds
+            bd = self._bounds[self._treeN: self._n]
+            near = self._treeN + numpy.flatnonzero(self._alive[self._treeN: self._n]
+                & (bd[:, 0] <= x1) & (bd[:, 2] >= x0) & (bd[:, 1] <= y1) & (bd[:, 3] >= y0))
+            if len(near):
+                pixelMetrics.count('shapely.intersects', len(near))
+                idx = numpy.concatenate([idx, near[shapely.intersects(self._geoms[near], new)]])
+        return idx
+
+    def check(self, mk: Dict, overlap=0.0, within=1.0) -> bool:
+        """
+        same as `PixelFactory.constrainsCheck`, return true if `mk` passes
+        """
+        mkType = mk['type']
+        if mkType in pixelEllipse.ELLIPSES:
+            res = self._checkEllipse(pixelEllipse.axes(mk), overlap)
+            if res is not None:
+                return res
+            mkType = 'polygon'
+        new = toGeometry(mk)
+        return checkGeometry(
+            new, mkType, self._geoms, self._kind, self.candidates(new),
+            self._area, self._length, self.fram, overlap, within)
+
+    def _checkEllipse(self, ax: Tuple, overlap=0.0):
+        # check of a new ellipse without shapely, None if not decided
+        x0, y0, x1, y1 = pixelEllipse.bounds(ax)
+        fx0, fy0, fx1, fy1 = self.fram.bounds
+        if x0 < fx0 or y0 < fy0 or x1 > fx1 or y1 > fy1:
+            return None
+        pixelMetrics.count('shapely.query')
+        idx = self._treeIdx[self._tree.query(shapely.box(x0, y0, x1, y1))]
+        if self._treeN < self._n:
+            bd = self._bounds[self._treeN: self._n]
+            idx = numpy.concatenate([idx, self._treeN + numpy.flatnonzero(
+                (bd[:, 0] <= x1) & (bd[:, 2] >= x0) & (bd[:, 1] <= y1) & (bd[:, 3] >= y0))])
+        for i in idx[self._alive[idx]]:
+            if self._kind[i] == self.POIN:
+                if not overlap and pixelEllipse.contains(ax, self._bounds[i, :2])[0]:
+                    return False
+                continue
+            rel = pixelEllipse.relation(ax, self._axes[i]) if i in self._axes else 0
+            if rel > 0 and not overlap:
+                return False
+            if rel >= 0:
+                # share of area or line length needs shapely
+                return None
+        return True
+
+    def add(self, mk: Dict) -> int:
+        """
+        add a marking as constrain. Return its key
+        """
+        geo = toGeometry(mk)
+        shapely.prepare(geo)
+        if self._n == len(self._geoms):
+            # grow storage by doubling
+            cap = max(16, 2 * self._n)
+            self._geoms = numpy.concatenate([self._geoms, numpy.full(cap - self._n, None)])
+            self._kind = numpy.concatenate([self._kind, numpy.zeros(cap - self._n, dtype=self._kind.dtype)])
+            self._bounds = numpy.concatenate([self._bounds, numpy.zeros((cap - self._n, 4))])
+            self._area = numpy.concatenate([self._area, numpy.zeros(cap - self._n)])
+            self._length = numpy.concatenate([self._length, numpy.zeros(cap - self._n)])
+            self._alive = numpy.concatenate([self._alive, numpy.zeros(cap - self._n, dtype=bool)])
+        key = self._n
+        self._geoms[key] = geo
+        self._kind[key] = self.KINDS[mk['type']]
+        self._bounds[key] = geo.bounds
+        self._area[key] = geo.area
+        self._length[key] = geo.length
+        self._alive[key] = True
+        if mk['type'] in pixelEllipse.ELLIPSES:
+            self._axes[key] = pixelEllipse.axes(mk)
+        self._n += 1
+        self._changed()
+        return key
+
+    def remove(self, key: int):
+        """
+        remove the constrain of `key`
+        """
+        if not (0 <= key < self._n and self._alive[key]):
+            raise KeyError(key)
+        self._alive[key] = False
+        self._geoms[key] = None
+        self._axes.pop(key, None)
+        self._changed()
+
+    def replace(self, key: int, mk: Dict) -> int:
+        """
+        replace the constrain of `key` by a marking. Return its new key
+        """
+        self.remove(key)
+        return self.add(mk)
+
+    def _changed(self):
+        self._changes += 1
+        if self._changes > max(self._REBUILD, len(self._treeIdx) // 8):
+            self._build()
+
+
+def toGeometry(mk: Dict):
+    """
+    convert a marking to the shapely object used as constrain
+    """
+    if mk['type'] == 'polygon':
+        return Polygon(mk['param'])
+    elif mk['type'] in pixelEllipse.ELLIPSES:
+        return Polygon(pixelEllipse.polygon(mk))
+    elif mk['type'] == 'line':
+        return LineString(mk['param'])
+    elif mk['type'] == 'point':
+        return Point(numpy.reshape(mk['param'], -1)[:2])
+    raise Exception('Not implemented')
+
+
+def ellipseAxes(mk) -> Dict:
+    """
+    (c, u, v) of every ellipse and circle of markings accepted by
+    `PixelFactory.parseToCsts`, keyed by its index in polygons of the
+    constrains
+    """
+    if isinstance(mk, dict):
+        mk = [mk]
+    res, i = {}, 0
+    for item in mk:
+        for sub in [item] if isinstance(item, dict) else item:
+            if sub['type'] in pixelEllipse.ELLIPSES:
+                res[i] = pixelEllipse.axes(sub)
+            if PreparedCsts.KINDS.get(sub['type']) == PreparedCsts.POLY:
+                i += 1
+    return res
+
+
+def checkGeometry(new, mkType: str, geoms, kind, idx, area, length, fram,
+    overlap=0.0, within=1.0) -> bool:
+    """
+    check shapely object `new` against the constrains `geoms[idx]`, which
+    are all the constrains that intersect `new`. Return true if it passes
+
+    Parameter
+    ---------
+    kind
+        array of constrain kinds, `PreparedCsts.POLY`, `LINE` or `POIN`
+    area, length
+        area and length of every constrain
+    """
+    kd = kind[idx]
+    pol, lin, poi = idx[kd == PreparedCsts.POLY], idx[kd == PreparedCsts.LINE], \
+        idx[kd == PreparedCsts.POIN]
+
+    if mkType == 'polygon':
+        # check out of frame, cheapest when completely inside
+        if not fram.contains(new) and \
+                fram.intersection(new).area < within * new.area:
+            return False
+        # check polygon-point intersection
+        if len(poi) and not overlap:
+            return False
+        # check polygon-polygon intersection, polygons only touching each
+        # other share no area
+        if len(pol):
+            pixelMetrics.count('shapely.touches' if not overlap else 'shapely.intersection',
+                len(pol))
+            if not overlap:
+                if not shapely.touches(geoms[pol], new).all():
+                    return False
+            elif (shapely.area(shapely.intersection(geoms[pol], new))
+                    > area[pol] * overlap).any():
+                return False
+        # check polygon-line intersection
+        pixelMetrics.count('shapely.intersection', len(lin))
+        if len(lin) and (shapely.length(shapely.intersection(geoms[lin], new))
+                > length[lin] * overlap).any():
+            return False
+        return True
+
+    elif mkType == 'line':
+        pixelMetrics.count('shapely.intersection')
+        if fram.intersection(new).length < within * new.length:
+            return False
+        # check line-line and line-point intersection
+        if (len(lin) or len(poi)) and not overlap:
+            return False
+        # check line-ploygon intersection
+        pixelMetrics.count('shapely.intersection', len(pol))
+        if len(pol) and (shapely.length(shapely.intersection(geoms[pol], new))
+                > length[pol] * overlap).any():
+            return False
+        return True
+
+    elif mkType == 'point':
+        # NOT ALLOW keypoint out of frame, unless `within` is 0
+        if within and not fram.intersects(new):
+            return False
+        return not (len(idx) and not overlap)
+
+    raise Exception('Not implemented')
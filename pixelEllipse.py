@@ -0,0 +1,142 @@
+"""
+Ellipse and circle markings, handled analytically
+
+An ellipse is given by three vertices, its center and the ends of its two
+semi-axes, the points c + u * cos(t) + v * sin(t). A circle is given by
+its center and a point on it, same as LabelMe. Both are affine images of
+the unit circle, so translating and rotating their vertices, as done to
+every marking, gives the transformed shape exactly
+
+Bounding box, area, point containment and a test of overlap between two
+ellipses are computed from (c, u, v) without vertices of the outline. A
+polygon is only made when shapely has to be used, with as few vertices as
+keep it within `TOLERANCE` pixels of the outline
+
+    ax = axes({'type': 'ellipse', 'param': [(50, 50), (80, 50), (50, 60)]})
+    bounds(ax)     # (20.0, 40.0, 80.0, 60.0)
+    polygon(ax)    # (n, 2) vertices, n grows with the size of the ellipse
+"""
+import math
+import numpy
+from typing import Dict, Tuple, Union
+
+ELLIPSES = ('ellipse', 'circle')
+TOLERANCE = 0.25  # largest distance in pixels between outline and polygon
+_MAX_SEGMENTS = 4096
+
+
+def axes(mk: Dict) -> Tuple:
+    """
+    (c, u, v) of an ellipse or circle marking, center and the two semi-axes
+    """
+    pts = numpy.reshape(numpy.asarray(mk['param'], dtype=float), (-1, 2))
+    if mk['type'] == 'circle' and len(pts) >= 2:
+        u = pts[1] - pts[0]
+        return (pts[0], u, numpy.array([-u[1], u[0]]))
+    elif mk['type'] == 'ellipse' and len(pts) >= 3:
+        return (pts[0], pts[1] - pts[0], pts[2] - pts[0])
+    raise Exception('{} needs its center and ends of its axes'.format(mk['type']))
+
+
+def _axes(e: Union[Dict, Tuple]) -> Tuple:
+    return axes(e) if isinstance(e, dict) else e
+
+
+def _radii(u: numpy.ndarray, v: numpy.ndarray) -> Tuple:
+    # largest and smallest semi-axis, singular values of [u v]
+    t = u.dot(u) + v.dot(v)
+    d = u[0] * v[1] - u[1] * v[0]
+    q = math.sqrt(max(t * t - 4 * d * d, 0.0))
+    return (math.sqrt((t + q) / 2), math.sqrt(max(t - q, 0.0) / 2))
+
+
+def bounds(e: Union[Dict, Tuple]) -> Tuple:
+    """
+    (x_min, y_min, x_max, y_max) of an ellipse, marking or (c, u, v)
+    """
+    c, u, v = _axes(e)
+    hx, hy = math.hypot(u[0], v[0]), math.hypot(u[1], v[1])
+    return (c[0] - hx, c[1] - hy, c[0] + hx, c[1] + hy)
+
+
+def area(e: Union[Dict, Tuple]) -> float:
+    c, u, v = _axes(e)
+    return math.pi * abs(u[0] * v[1] - u[1] * v[0])
+
+
+def contains(e: Union[Dict, Tuple], pts) -> numpy.ndarray:
+    """
+    true for every point of (n, 2) `pts` inside or on the ellipse
+    """
+    c, u, v = _axes(e)
+    pts = numpy.reshape(numpy.asarray(pts, dtype=float), (-1, 2))
+    d = u[0] * v[1] - u[1] * v[0]
+    if d == 0:
+        return numpy.zeros(len(pts), dtype=bool)
+    # coordinates in the frame of the unit circle
+    p = pts - c
+    a = (p[:, 0] * v[1] - p[:, 1] * v[0]) / d
+    b = (p[:, 1] * u[0] - p[:, 0] * u[1]) / d
+    return a * a + b * b <= 1.0
+
+
+def _relate(e1: Tuple, e2: Tuple) -> int:
+    # relation seen from the unit circle of `e1`, where `e2` is an ellipse
+    # centered at c and overlap is tested against a circle of radius 1
+    c1, u1, v1 = e1
+    c2, u2, v2 = e2
+    d = u1[0] * v1[1] - u1[1] * v1[0]
+    if d == 0:
+        return 0
+    inv = numpy.array([[v1[1], -v1[0]], [-u1[1], u1[0]]]) / d
+    c = inv.dot(c2 - c1)
+    u, v = inv.dot(u2), inv.dot(v2)
+    dist = math.hypot(c[0], c[1])
+    if dist == 0:
+        return 1
+    n = c / dist
+    # `e2` is on one side of the tangent line of the circle at n, they
+    # are apart. The largest circle in `e2` meets the unit circle, they
+    # share area
+    if dist - math.hypot(u.dot(n), v.dot(n)) > 1:
+        return -1
+    if dist < 1 + _radii(u, v)[1]:
+        return 1
+    return 0
+
+
+def relation(e1: Union[Dict, Tuple], e2: Union[Dict, Tuple]) -> int:
+    """
+    -1 if two ellipses are surely apart, 1 if they surely share area, 0 if
+    it is not clear, which is only left for ellipses that nearly touch
+    """
+    e1, e2 = _axes(e1), _axes(e2)
+    a, b = bounds(e1), bounds(e2)
+    if a[0] > b[2] or b[0] > a[2] or a[1] > b[3] or b[1] > a[3]:
+        return -1
+    res = _relate(e1, e2)
+    return res if res else _relate(e2, e1)
+
+
+def segments(e: Union[Dict, Tuple], tol=TOLERANCE) -> int:
+    """
+    number of polygon vertices that keep the outline within `tol` pixels
+    """
+    c, u, v = _axes(e)
+    r = _radii(u, v)[0]
+    if r <= tol:
+        return 8
+    # sagitta of an edge of a circle of radius r is r * (1 - cos(pi / n))
+    return min(max(8, math.ceil(math.pi / math.acos(1 - tol / r))), _MAX_SEGMENTS)
+
+
+def polygon(e: Union[Dict, Tuple], tol=TOLERANCE, outer=False) -> numpy.ndarray:
+    """
+    (n, 2) vertices of a polygon of the ellipse, vertices are on the outline,
+    or edges touch it if `outer`, so the polygon covers the ellipse
+    """
+    c, u, v = _axes(e)
+    n = segments((c, u, v), tol)
+    t = numpy.linspace(0, 2 * math.pi, n, endpoint=False)
+    k = 1 / math.cos(math.pi / n) if outer else 1.0
+    return c + k * (numpy.cos(t)[:, None] * u + numpy.sin(t)[:, None] * v)
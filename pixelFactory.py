@@ -1,85 +1,347 @@
 import math
 import random
 import copy
+import sys
 import numpy
-from shapely.geometry import Polygon, LineString, Point, box, MultiPolygon
 from PIL import Image, ImageDraw
+from collections import OrderedDict
 from typing import Union, List, Dict, Tuple, Any
+from pixelMarking import MarkingSet
+from pixelTile import TiledImage
+import pixelEllipse
+import pixelPlace
+import pixelMetrics
+from pixelMetrics import instrument
+
+# shapely, and modules built on it, are imported by methods that use them,
+# so ops on pixels only, e.g. noise, do not pay for loading shapely
+
+
+def _prepared(csts) -> bool:
+    # true if `csts` is a `PreparedCsts`, which only exists once pixelCsts
+    # is imported
+    mod = sys.modules.get('pixelCsts')
+    return mod is not None and isinstance(csts, mod.PreparedCsts)
+
+
+def _view(px):
+    # a (h, w, 4) uint8 array, e.g. over shared memory, is processed as a
+    # `TiledImage` of it, without copy
+    return TiledImage.fromArray(px) if isinstance(px, numpy.ndarray) else px
+
 
 class PixelAlgo:
+    _NOISE_BLOCK = 1 << 20  # pixels of noise generated at once
+    _RTM_CACHE = 64         # sets of angles whose matrices are kept
+
     def __init__(self):
         self._2DRTM = lambda theta, x, y, dx, dy: (
             (x - dx) * math.cos(theta) + (y - dy) * math.sin(theta) + dx,
             (y - dy) * math.cos(theta) - (x - dx) * math.sin(theta) + dy,
         )
+        self._rtmCache = OrderedDict()  # angles -> (cos, sin, matrices)
 
-    def rotate(self, px: Image.Image, mk: Dict, degree: float, expand=True) -> Tuple:
+    def rotate(self, px: Image.Image, mk, degree: float, expand=True) -> Tuple:
         """
+        only the region bounded by markings is rotated, into an image that
+        exactly fits the rotated markings
+
         Parameter
         ---------
         mk
-            a list of markings
+            one or a list of markings, or a `MarkingSet`
         """
         if expand:
-            # expand img, make sure img does not suffer losses after
-            # rotates
-            x_min, y_min, x_max, y_max = self.getBound(mk)
-            side = math.ceil(math.sqrt((x_max - x_min) ** 2 + (y_max - y_min) ** 2))
-            shf = numpy.array([(side - x_max + x_min) >> 1, (side - y_max + y_min) >> 1])
-            px2 = Image.new("RGBA", (side, side), color=(0, 0, 0, 0))
-            px2.paste(px, box=(shf[0], shf[1]))
-
-            # rotate image and markings
-            px = px2.rotate(degree)
-            r = math.radians(degree)
-            c, s = math.cos(r), math.sin(r)
-            rtm2D = numpy.array([[c, -s], [s, c]])
-            mk = copy.deepcopy(mk)
-
-            # shfit from center of the image to (0, 0), then
-            # use rotational matrix
-            shf2 = numpy.array([side // 2, side // 2])
-            for item in mk:
-                item['param'] = numpy.dot(item['param'] + shf - shf2, rtm2D) + shf2
-            bound = self.getBound(mk)
-
-            # remove extra paddings
-            px = px.crop(bound)
-            shf[0], shf[1] = bound[0], bound[1]
-            for item in mk:
-                item['param'] -= shf
+            crop, size, coef, mk = self.rotateMarkings(mk, degree)
+            px = px.crop(crop).transform(size, Image.AFFINE, coef)
             return (px, mk)
         else:
             raise Exception("Not implemented")
 
-    def noise(self, px: Image, snr: float, n_type='bw') -> Image.Image:
+    def rotateMarkings(self, mk, degree: float) -> Tuple:
+        """
+        geometry of `rotate`, no pixel is touched. Return a tuple contains
+        the region of image to rotate, size of rotated image, coefficients
+        of inverse affine transform for `Image.transform`, and rotated
+        markings
+        """
+        pts, off = self._groupVertices(mk)
+        bd, allPts, size, coef = self._rotateGeometry([pts], [degree])
+        return (tuple(int(v) for v in bd[0]), tuple(int(v) for v in size[0, 0]),
+            tuple(coef[0, 0]), self._withVertices(mk, allPts[0], off))
+
+    def rotateMany(self, items: List[Tuple], degrees: List[float]) -> 'Rotations':
+        """
+        rotate every (px, mk) of `items` by every angle of `degrees`, same as
+        `rotate`. Markings of all variants are rotated at once, pixels of a
+        variant are only rotated when it is read from the result
+        """
+        grp = [self._groupVertices(mk) for _, mk in items]
+        bd, allPts, size, coef = self._rotateGeometry([g[0] for g in grp], degrees)
+        return Rotations(items, grp, bd, allPts, size, coef, list(degrees))
+
+    @staticmethod
+    def _groupVertices(mk) -> Tuple:
+        # (n, 2) vertices of one or a list of markings, or a `MarkingSet`,
+        # and offsets of every marking. Vertices of holes of polygons
+        # follow, then vertices of polygons covering ellipses, so bounds
+        # take their outline into account
+        if isinstance(mk, dict):
+            pts, off, items = numpy.reshape(mk['param'], (-1, 2)), None, [mk]
+            holes = list(mk.get('holes', ()))
+        elif isinstance(mk, MarkingSet):
+            pts, off, holes = mk.vertices, None, mk.holes
+            items = mk if set(mk.types).intersection(pixelEllipse.ELLIPSES) else []
+        else:
+            pts = [numpy.reshape(item['param'], (-1, 2)) for item in mk]
+            pts, off, items = numpy.concatenate(pts), numpy.cumsum([0] + [len(p) for p in pts]), mk
+            holes = [hole for item in mk for hole in item.get('holes', ())]
+        hull = [pixelEllipse.polygon(item, outer=True) for item in items
+            if item['type'] in pixelEllipse.ELLIPSES]
+        if holes or hull:
+            pts = numpy.concatenate([pts] + [numpy.reshape(hole, (-1, 2)) for hole in holes] + hull)
+        return (pts, off)
+
+    @staticmethod
+    def _withVertices(mk, pts: numpy.ndarray, off):
+        # markings of same type as `mk` with vertices `pts`, vertices of
+        # holes follow those of the markings, the rest are dropped
+        if isinstance(mk, MarkingSet):
+            n = mk.offsets[-1]
+            k = sum(len(hole) for hole in mk.holes)
+            return mk.withVertices(pts[: n], pts[n: n + k] if k else None)
+        items = [mk] if isinstance(mk, dict) else mk
+        if off is None:
+            off = [0, numpy.size(mk['param']) // 2]
+        res, beg = [], off[-1]
+        for i, item in enumerate(items):
+            item = dict(item, param=pts[off[i]: off[i + 1]].reshape(numpy.shape(item['param'])))
+            if 'holes' in item:
+                item['holes'], beg = PixelAlgo._rings(item['holes'], pts, beg)
+            res.append(item)
+        return res[0] if isinstance(mk, dict) else res
+
+    @staticmethod
+    def _rings(holes: List, pts: numpy.ndarray, beg: int) -> Tuple:
+        # rings of as many vertices as `holes`, from row `beg` of `pts`, and
+        # the row after them
+        res = []
+        for hole in holes:
+            n = len(numpy.reshape(hole, (-1, 2)))
+            res.append(pts[beg: beg + n])
+            beg += n
+        return (res, beg)
+
+    @staticmethod
+    def translate(mk, shf):
+        """
+        one or a list of markings, or a `MarkingSet`, moved by `shf`.
+        Holes of polygons move along
+        """
+        if isinstance(mk, MarkingSet):
+            return mk.translate(shf[0], shf[1])
+        if not isinstance(mk, dict):
+            return [PixelAlgo.translate(item, shf) for item in mk]
+        shf = numpy.asarray(shf)
+        item = dict(mk, param=mk['param'] + shf)
+        if 'holes' in mk:
+            item['holes'] = [numpy.asarray(hole) + shf for hole in mk['holes']]
+        return item
+
+    def _rtm(self, degrees) -> Tuple:
+        # cos, sin and (a, 2, 2) rotational matrices of angles, cached
+        key = tuple(float(d) for d in degrees)
+        hit = self._rtmCache.get(key)
+        if hit is not None:
+            self._rtmCache.move_to_end(key)
+            return hit
+        r = numpy.radians(key)
+        c, s = numpy.cos(r), numpy.sin(r)
+        hit = (c, s, numpy.stack([numpy.stack([c, -s], 1), numpy.stack([s, c], 1)], 1))
+        self._rtmCache[key] = hit
+        if len(self._rtmCache) > self._RTM_CACHE:
+            self._rtmCache.popitem(last=False)
+        return hit
+
+    def _rotateGeometry(self, pts: List[numpy.ndarray], degrees) -> Tuple:
         """
+        rotate every group of vertices around center of its bound by every
+        angle. Return a tuple contains (m, 4) integer bound of every group,
+        (a, n, 2) vertices in rotated images, (a, m, 2) sizes of rotated
+        images, and (a, m, 6) coefficients of `Image.transform`
         """
+        cnt = numpy.array([len(p) for p in pts])
+        off = numpy.concatenate([[0], numpy.cumsum(cnt)[:-1]])
+        rep = numpy.repeat(numpy.arange(len(pts)), cnt)
+        allPts = numpy.concatenate(pts).astype(float)
+        bd = numpy.concatenate([
+            numpy.floor(numpy.minimum.reduceat(allPts, off, axis=0)),
+            numpy.ceil(numpy.maximum.reduceat(allPts, off, axis=0))], axis=1)
+        ctr = (bd[:, 2:] - bd[:, :2]) / 2.0
+
+        # shfit from center of the crop to (0, 0), then use rotational
+        # matrices on vertices of all groups for all angles at once
+        c, s, rtm = self._rtm(degrees)
+        out = numpy.einsum('nk,akj->anj', allPts - bd[rep, :2] - ctr[rep], rtm)
+        out += ctr[rep]
+        # ignore float error of trigonometric, e.g. cos(90) != 0
+        lo = numpy.floor(numpy.minimum.reduceat(out, off, axis=1) + 1e-6)
+        hi = numpy.ceil(numpy.maximum.reduceat(out, off, axis=1) - 1e-6)
+        res = out - lo[:, rep]
+
+        # inverse mapping, from rotated image back to the crop
+        dx, dy = lo[..., 0] - ctr[:, 0], lo[..., 1] - ctr[:, 1]
+        c, s = c[:, None], s[:, None]
+        coef = numpy.stack([numpy.broadcast_to(c, dx.shape), numpy.broadcast_to(-s, dx.shape),
+            c * dx - s * dy + ctr[:, 0], numpy.broadcast_to(s, dx.shape),
+            numpy.broadcast_to(c, dx.shape), s * dx + c * dy + ctr[:, 1]], axis=-1)
+        return (bd.astype(int), res, (hi - lo).astype(int), coef)
+
+    def noise(self, px: Image, snr: float, n_type='bw', rng=None) -> Image.Image:
+        """
+        noise is generated block by block of rows and written in place into
+        a single copy of the image, alpha channel is untouched
+        """
+        assert 0 <= snr <= 1, "snr should between 0 and 1"
+        rng = numpy.random.default_rng(rng)
+        if isinstance(px, (TiledImage, numpy.ndarray)):
+            # rows of the mapped file or of the array are written in place
+            arr = px.array if isinstance(px, TiledImage) else px
+            if snr < 1:
+                self._noiseRows(arr[:, :, :3], snr, n_type, rng)
+            return px
+        px = numpy.array(px)
+        if snr < 1:
+            self._noiseRows(px[:, :, :3], snr, n_type, rng)
+        return Image.fromarray(px)
+
+    def _noiseRows(self, rgb: numpy.ndarray, snr: float, n_type: str, rng):
+        # add noise to (h, w, 3) `rgb` in place, block by block of rows
+        rows = max(1, self._NOISE_BLOCK // max(1, rgb.shape[1]))
         if n_type == 'bw':
-            px = numpy.array(px)
-            ms = numpy.random.choice([0, 1, 2], size=(px.shape[0], px.shape[1]),
-                p=[(1 - snr)/2.0, (1 - snr)/2.0, snr])
-            r, g, b = px[:,:,0], px[:,:,1], px[:,:,2]
-            r[ms == 0] = 0; r[ms == 1] = 255
-            g[ms == 0] = 0; g[ms == 1] = 255
-            b[ms == 0] = 0; b[ms == 1] = 255
+            buf = numpy.empty((rows, rgb.shape[1]), dtype=numpy.float32)
+        elif n_type in ('gaussian', 'speckle', 'poisson'):
+            buf = numpy.empty((rows, rgb.shape[1], 3), dtype=numpy.float32)
+        else:
+            raise Exception("Not implemented")
+
+        for y in range(0, rgb.shape[0], rows):
+            blk = rgb[y: y + rows]
+            u = buf[: blk.shape[0]]
+            if n_type == 'bw':
+                # pepper below (1 - snr) / 2, salt below 1 - snr
+                rng.random(dtype=numpy.float32, out=u)
+                val = (u >= (1 - snr) / 2.0).view(numpy.uint8) * numpy.uint8(255)
+                numpy.copyto(blk, val[:, :, None], where=(u < 1 - snr)[:, :, None])
+            elif n_type == 'gaussian':
+                # additive, standard deviation of (1 - snr) * 255
+                rng.standard_normal(dtype=numpy.float32, out=u)
+                u *= (1 - snr) * 255.0
+                u += blk
+                numpy.rint(u, out=u)
+                numpy.clip(u, 0, 255, out=blk, casting='unsafe')
+            elif n_type == 'speckle':
+                # multiplicative, standard deviation of (1 - snr)
+                rng.standard_normal(dtype=numpy.float32, out=u)
+                u *= (1 - snr)
+                u += 1
+                u *= blk
+                numpy.rint(u, out=u)
+                numpy.clip(u, 0, 255, out=blk, casting='unsafe')
+            elif n_type == 'poisson':
+                # shot noise, brightest pixel collects 255 * snr / (1 - snr) photons
+                peak = 255.0 * snr / (1 - snr)
+                if peak == 0:
+                    # no photon at all
+                    blk[...] = 0
+                    continue
+                numpy.multiply(blk, peak / 255.0, out=u)
+                u[...] = rng.poisson(u)
+                u *= 255.0 / peak
+                numpy.rint(u, out=u)
+                numpy.clip(u, 0, 255, out=blk, casting='unsafe')
+
+    def getBound(self, mk) -> Tuple:
+        """
+        return pixel bound (x_min, y_min, x_max, y_max) of one or a list of
+        markings, ellipses and circles are bounded by their outline
+        """
+        if isinstance(mk, dict):
+            mk = [mk]
+        if isinstance(mk, MarkingSet):
+            pts = mk.bounds().reshape(-1, 2)
+        else:
+            pts = numpy.concatenate([
+                numpy.reshape(pixelEllipse.bounds(item), (2, 2))
+                if item['type'] in pixelEllipse.ELLIPSES else numpy.reshape(item['param'], (-1, 2))
+                for item in mk])
+        x_min, y_min = numpy.floor(numpy.min(pts, axis=0)).astype(int)
+        x_max, y_max = numpy.ceil(numpy.max(pts, axis=0)).astype(int)
+        return (int(x_min), int(y_min), int(x_max), int(y_max))
+
+class Rotations:
+    """
+    rotated variants of `PixelAlgo.rotateMany`. Markings of every variant
+    are ready, pixels of a variant are rotated each time it is read
+
+    Usage
+    -----
+        rot = pf.rotateMany([(px, mk), (px2, mk2)], range(0, 360, 15))
+        mk = rot.markings(1, 3)     # no pixel is touched
+        px, mk = rot[1, 3]          # second item rotated by 45 degrees
+    """
+    def __init__(self, items, grp, bd, allPts, size, coef, degrees):
+        self.degrees = degrees
+        self._items = items
+        self._grp = grp
+        self._bd = bd
+        self._pts = allPts
+        self._size = size
+        self._coef = coef
+        self._beg = numpy.cumsum([0] + [len(g[0]) for g in grp])
+        self._crop = [None] * len(items)  # region of every item to rotate
+
+    def __len__(self):
+        return len(self._items) * len(self.degrees)
+
+    def markings(self, i: int, j: int):
+        """
+        markings of item i rotated by the j-th angle
+        """
+        pts = self._pts[j, self._beg[i]: self._beg[i + 1]]
+        return PixelAlgo._withVertices(self._items[i][1], pts, self._grp[i][1])
 
-        img = Image.fromarray(px)
-        return img
+    def __getitem__(self, key: Tuple) -> Tuple:
+        """
+        (px, mk) of item i rotated by the j-th angle, `key` is (i, j)
+        """
+        i, j = key
+        if self._crop[i] is None:
+            self._crop[i] = self._items[i][0].crop(tuple(int(v) for v in self._bd[i]))
+        px = self._crop[i].transform(tuple(int(v) for v in self._size[j, i]),
+            Image.AFFINE, tuple(self._coef[j, i]))
+        return (px, self.markings(i, j))
+
+    def __iter__(self):
+        """
+        (i, j, px, mk) of every variant, item by item
+        """
+        for i in range(len(self._items)):
+            for j in range(len(self.degrees)):
+                yield (i, j) + self[i, j]
 
-    def getBound(self, mk: Dict):
-        x_min, y_min = numpy.min(mk['param'], axis=1)
-        x_max, y_max = numpy.max(mk['param'], axis=1)
 
 class PixelFactory:
-    supportedType = ['point', 'line', 'polygon', 'ellipse']
+    supportedType = ['point', 'line', 'polygon', 'ellipse', 'circle']
 
     def __init__(self):
         """
         https://blog.csdn.net/maitianpt/article/details/84983599
         """
         self._algo = PixelAlgo()  # pixel processor
+        self._occ = None          # occlusion engine of last paste
 
+    @instrument('rotate')
     def rotate(self, px: Image.Image, mk: Dict, degree: float, expand=True) -> ():
         """
         roate image
@@ -87,15 +349,35 @@ class PixelFactory:
         Parameter
         ---------
         shapes:
-            a group of markings
+            a group of markings, vertices of ellipses and circles are
+            rotated as well, which rotates the shapes exactly
         expand:
             if true, will make sure object will not suffer losses on edge
         """
-        return self._algo.rotate(px, mk, degree, expand)
+        return self._algo.rotate(_view(px), mk, degree, expand)
+
+    @instrument('rotateMany')
+    def rotateMany(self, items: List[Tuple], degrees: List[float]) -> Rotations:
+        """
+        rotate every cutout by every angle. Return a `Rotations`, whose
+        markings are computed for all variants at once, and whose pixels are
+        only rotated for variants that are read
+
+        Parameter
+        ---------
+        items
+            a list of (px, mk), arguments of `rotate`
+        degrees
+            angles of rotation
+        """
+        return self._algo.rotateMany([(_view(px), mk) for px, mk in items], degrees)
 
-    def noise(self, px: Image, snr: float, n_type='bw') -> Image:
+    @instrument('noise')
+    def noise(self, px: Image, snr: float, n_type='bw', rng=None) -> Image:
         """
-        add noise to the image. Return a copy of img with noise
+        add noise to the image. Return a copy of img with noise, or `px`
+        itself if it is a `TiledImage` or a (h, w, 4) uint8 numpy array,
+        which is written in place
 
         Parameter
         ---------
@@ -103,10 +385,17 @@ class PixelFactory:
             signal-noise ratio, float between 0 and 1
         n_type:
             type of noise
-            `bw`, black and white aka. salt & pepper
+            `bw`, black and white aka. salt & pepper, 1 - snr of pixels
+            `gaussian`, additive, standard deviation of (1 - snr) * 255
+            `poisson`, shot noise, brightest pixel has 255 * snr / (1 - snr)
+                photons, all black if snr is 0
+            `speckle`, multiplicative, standard deviation of (1 - snr)
+        rng:
+            a numpy.random.Generator, or a seed
         """
-        return self._algo.noise(px, snr, n_type)
+        return self._algo.noise(px, snr, n_type, rng)
 
+    @instrument('pasteRegion')
     def pasteRegion(self, bg: Image.Image, bgMk: List[Dict],
         fg: Image.Image, fgMk: Dict, pos: Tuple) -> Tuple:
         """
@@ -125,15 +414,73 @@ class PixelFactory:
             foreground marking
         pos
             a tulpes of corrdinate
+
+        A `TiledImage` background, or a (h, w, 4) uint8 numpy array, is
+        pasted in place, tile by tile
         """
-        resPx = bg.copy()
+        if isinstance(bg, (TiledImage, numpy.ndarray)):
+            resPx = bg
+            bg = _view(bg)
+            bg.paste(fg, pos)
+        else:
+            resPx = bg.copy()
+            resPx.paste(fg, pos, fg.getchannel(3))
         resMk = []
-        resPx.paste(fg, pos, fg.getchannel(3))
 
-        if fgMk is not None:
-            resPa = fgMk['param'].copy() + numpy.asarray(pos) # fg points
-            return (resPx, resMk)
+        if fgMk is None:
+            return (resPx, copy.deepcopy(bgMk))
+        if isinstance(fgMk, dict):
+            fgMk = [fgMk]
+        resMk = bgMk
+        for item in fgMk:
+            # fg points
+            resMk = self._occlusion(resMk, bg.size).paste(self._algo.translate(item, pos))
+        return (resPx, resMk)
+
+    @instrument('pasteMany')
+    def pasteMany(self, bg: Image.Image, bgMk: List[Dict], items: List[Tuple]) -> Tuple:
+        """
+        paste every foreground of `items` in `bg`, in order, on one copy of
+        `bg`. Return a tuple contains final image and markings
+
+        Markings are occluded once for the whole batch, a marking only
+        keeps the part that is not covered by foregrounds pasted after it.
+        Background markings are followed by foreground markings in order
 
+        Parameter
+        ---------
+        bg
+            background, PIL Image in RGBA mode
+        bgMk
+            background markings
+        items
+            a list of (fg, fgMk, pos), same as arguments of `pasteRegion`.
+            Markings are None if `bgMk` and every `fgMk` are None
+
+        A `TiledImage` background, or a (h, w, 4) uint8 numpy array, is
+        pasted in place, tile by tile
+        """
+        tiled = isinstance(bg, (TiledImage, numpy.ndarray))
+        resPx = bg if tiled else bg.copy()
+        bg = _view(bg)
+        fgMk = []  # translated foreground markings of every item
+        for fg, mk, pos in items:
+            # RGBA image as mask uses its own alpha channel
+            if tiled:
+                bg.paste(fg, pos)
+            else:
+                resPx.paste(fg, pos, fg)
+            if mk is None:
+                continue
+            if isinstance(mk, dict):
+                mk = [mk]
+            fgMk.append(self._algo.translate(mk, pos))
+        if bgMk is None and not fgMk:
+            # pixels only, e.g. markings are already known
+            return (resPx, None)
+        return (resPx, self._pasteManyPolys(bgMk or [], fgMk, bg.size))
+
+    @instrument('copyRegion')
     def copyRegion(self, px: Image, mk) -> []:
         """
         return a tuple contains cuted image, and final markings.
@@ -141,30 +488,28 @@ class PixelFactory:
         Parameter
         ---------
         px
-            a PIL image in RGBA mode
+            a PIL image in RGBA mode, a `TiledImage`, or a (h, w, 4) uint8
+            numpy array
         mk
-            one or a list of markings
+            one or a list of markings, or a `MarkingSet`
         """
-        final_mk = copy.deepcopy(mk)
-        if isinstance(mk, dict):
-            px, shf = self._copy(px, [mk])
-            final_mk['param'] -= shf
-        else:
-            px, shf = self._copy(px, mk)
-            for tmp in final_mk:
-                tmp['param'] -= shf
-        return (px, final_mk)
+        px = _view(px)
+        px, shf = self._copy(px, [mk] if isinstance(mk, dict) else mk)
+        return (px, self._algo.translate(mk, -shf))
 
+    @instrument('parseToCsts')
     def parseToCsts(self, mk, imgSize) -> Tuple:
         """
         return a list of constrains in the format of
         [[Polygon(), ], [LineString(), ], [Point()], Polygon()]
-        the last polygon object is the bounding box of image
+        the last polygon object is the bounding box of image. Ellipses and
+        circles are polygons within `pixelEllipse.TOLERANCE` of the outline
         Parameter
         ---------
         mk:
             markings, accept a map, a list of map, a list of list of map
         """
+        from shapely.geometry import Polygon, LineString, Point, box
         assert isinstance(imgSize, tuple), "Image size should be a tuple"
         if isinstance(mk, dict):
             mk = [mk]
@@ -179,13 +524,34 @@ class PixelFactory:
                     csts[1].append(LineString(sub['param']))
                 elif sub['type'] == 'point':
                     csts[2].append(Point(sub['param']))
-                elif sub['type'] == 'ellipse':
-                    # TODO: for furture use
-                    raise Exception("Not implemented")
+                elif sub['type'] in pixelEllipse.ELLIPSES:
+                    csts[0].append(Polygon(pixelEllipse.polygon(sub)))
         fram = box(imgSize[0], imgSize[1], imgSize[2], imgSize[3])
 
         return (csts[0], csts[1], csts[2], fram)
 
+    @instrument('prepareCsts')
+    def prepareCsts(self, csts, imgSize=None) -> 'PreparedCsts':
+        """
+        return a `PreparedCsts` that can be passed to `constrainsCheck` as
+        `csts`. Prefer it when checking many markings against same constrains
+
+        Parameter
+        ---------
+        csts:
+            markings accepted by `parseToCsts`, or the output of it
+        imgSize:
+            size of the image. It will be omited if `csts` is output of
+            `parseToCsts`
+        """
+        from shapely.geometry import Polygon
+        from pixelCsts import PreparedCsts, ellipseAxes
+        if isinstance(csts, tuple) and len(csts) == 4 and type(csts[-1]) is Polygon:
+            return PreparedCsts(csts)
+        # ellipses of markings are also checked analytically
+        return PreparedCsts(self.parseToCsts(csts, imgSize), ellipseAxes(csts))
+
+    @instrument('constrainsCheck')
     def constrainsCheck(
         self, mk: dict, csts, imgSize=None, overlap=0.0, within=1.0
     ) -> bool:
@@ -200,7 +566,8 @@ class PixelFactory:
         csts:
             points of constrains or a list of iteratable of predefine shapely object
             [numpy.ndarray, ] or [[Polygon(), ], [LineString(), ], [Point(), ], Polygon()]
-            the last object in predefine shapely is boundary of image
+            the last object in predefine shapely is boundary of image, or
+            a `PreparedCsts`
         imgSize:
             size of the image. It will be omited if `csts` is a list of iteratable of
             predefine shapely object
@@ -210,6 +577,13 @@ class PixelFactory:
             percentage of area that `pts will be inside the image, float between 0 and 1
 
         """
+        if _prepared(csts):
+            return csts.check(mk, overlap, within)
+
+        from shapely.geometry import Polygon
+
+        if mk['type'] in pixelEllipse.ELLIPSES:
+            mk = dict(mk, param=pixelEllipse.polygon(mk), type='polygon')
         poly, line, poin, fram = None, None, None, None
         if type(csts[-1]) is Polygon:
             poly, line, poin, fram = csts[0], csts[1], csts[2], csts[3]
@@ -230,35 +604,43 @@ class PixelFactory:
                 or fram.intersection(new).area < (within * new.area)
             )
 
-        elif mk['type'] == 'line':
-            new = LineString(pts)
-            return not (
-                # check line-ploygon intersection
-                any(filter(lambda pol: pol.intersection(
-                    new).length > pol.length * overlap, poly))
-                # check line-line intersection
-                or any(filter(lambda lin: lin.intersects(new) and (not overlap), line))
-                # check line-point intersection
-                or any(filter(lambda poi: poi.intersects(new) and (not overlap), poin))
-                or fram.intersects(new).length < within * new.length
-            )
-
-        elif mk['type'] == 'point':
-            new = Point(pts[0])
-            return not (
-                # check point-ploygon intersection
-                any(filter(lambda pol: pol.intersects(new) and (not overlap), poly))
-                # check point-line intersection
-                or any(filter(lambda lin: lin.intersects(new) and (not overlap), line))
-                # check point-point intersection
-                or any(filter(lambda poi: poi.intersects(new) and (not overlap), poin))
-                or (fram.intersects(new) and (not within))
-                # ??? NOT ALLOW keypoint out of frame
-            )
+        elif mk['type'] in ('line', 'point'):
+            # same rules as a `PreparedCsts`, which checks every type
+            from pixelCsts import PreparedCsts
+            return PreparedCsts((poly, line, poin, fram)).check(mk, overlap, within)
         else:
             raise Exception('Not implemented')
 
 
+    @instrument('findPlacements')
+    def findPlacements(self, fgMk, csts, imgSize, n: int, overlap=0.0, within=1.0,
+        rng=None, exclusive=False, sampler='random') -> List[Tuple]:
+        """
+        return up to `n` positions where `fgMk` can be pasted by `pasteRegion`
+        and pass `constrainsCheck`
+
+        Parameter
+        ---------
+        fgMk:
+            one or a list of foreground markings
+        csts:
+            constrains accepted by `constrainsCheck`
+        imgSize:
+            size of the image. It will be omited if `csts` is prepared
+        rng:
+            a numpy.random.Generator, or a seed
+        exclusive:
+            if true, positions do not break constrains of one another. A
+            `PreparedCsts` given as `csts` gets markings of every position
+        sampler:
+            `random` or `raster`, see `pixelPlace.findPlacements`. `raster`
+            stays fast when most of the image is taken
+        """
+        if not _prepared(csts):
+            csts = self.prepareCsts(csts, imgSize)
+        return pixelPlace.findPlacements(fgMk, csts, n, overlap, within, rng,
+            exclusive=exclusive, sampler=sampler)
+
     def _copy(self, px: Image, mk) -> []:
         """
         copy the region that bounded by `pts`
@@ -272,9 +654,12 @@ class PixelFactory:
             makrings, should be a iterable of dicts
         """
         # find the boundary of cut region
-        x_min, y_min, x_max, y_max = self._util.getBound(mk)
+        x_min, y_min, x_max, y_max = self._algo.getBound(mk)
         # point and line don't have any area
-        tmp = filter(lambda tmp: tmp["type"] in supportedType[2:] , mk)
+        if isinstance(mk, MarkingSet):
+            tmp = any(filter(lambda tmp: tmp in self.supportedType[2:], mk.types))
+        else:
+            tmp = any(filter(lambda tmp: tmp["type"] in self.supportedType[2:] , mk))
         assert tmp, "Such shape is not unsupported for copy"
 
         px = px.crop((x_min, y_min, x_max, y_max))
@@ -291,67 +676,204 @@ class PixelFactory:
         frSize
             frame size of the image
         """
-        fgPol = Polygon(fgMk['param'])            # foreground polygon
-        frPol = box(0, 0, frSize[0], frSize[1])   # image frame polygon
-        resMk = []
+        from pixelOcclusion import OcclusionEngine
+        return OcclusionEngine(bgMk, frSize).paste(fgMk)
 
-        # ignore any foreground that is out side of image frame or
-        # background makring that is empty
-        ## NOTE: a.difference(b) is slower compare to binary predicates
-        if not (frPol.disjoint(fgPol) or frPol.touches(fgPol) or bgMk is None):
-            if frPol.overlaps(fgPol):
-                # partial of foreground is outside of frame
-                fgPol = frPol.intersection(fgPol)
-            for mk in bgMk:
-                bgPol = Polygon(mk['param'])
-                obj_cp = None # object that needs copy
-                if fgPol.disjoint(bgPol) or fgPol.touches(bgPol):
-                    # completely isolate or outer_cut
-                    obj_cp = bgPol
-                elif fgPol.contains(bgPol):
-                    # foreground cover background completely
-                    obj_cp = fgPol
-                else:
-                    obj_cp = bgPol.difference(fgPol)
-
-                if isinstance(obj_cp, Polygon):
-                    obj_cp = [obj_cp]
-                for geo in obj_cp:
-                    param = numpy.array(geo.exterior.coords)
-                    if len(geo.interiors) > 0:
-                        param = numpy.append([param], geo.interiors)
-                    resMk.append({'param': param, 'type': 'polygon'})
-            resMk.append({
-                'param': fgMk['param'], 'type': 'polygon'
-            })
-        elif bgMk is not None:
-            return copy.deepcopy(bgMk)
+    def _occlusion(self, bgMk: List[Dict], frSize: Tuple) -> 'OcclusionEngine':
+        """
+        occlusion engine of `bgMk`. The engine of last paste is reused if
+        `bgMk` is the unchanged result of it, which keeps shapely objects
+        between successive pastes on the same image
+        """
+        occ = self._occ
+        if occ is None or occ.frSize != tuple(frSize) or not occ.matches(bgMk):
+            from pixelOcclusion import OcclusionEngine
+            occ = self._occ = OcclusionEngine(bgMk, frSize)
+        return occ
+
+    @instrument('occlusion')
+    def _pasteManyPolys(self, bgMk: List[Dict], fgMk: List[List[Dict]], frSize: Tuple) -> List[Dict]:
+        """
+        occlude markings of a batch of pastes at once
 
-        return resMk
+        Parameter
+        ---------
+        fgMk
+            markings of every pasted foreground, in pasting order
+        frSize
+            frame size of the image
+        """
+        import shapely
+        from shapely import STRtree
+        from shapely.geometry import Polygon, box
+        from pixelOcclusion import _polygon, occluder
+        frPol = box(0, 0, frSize[0], frSize[1])   # image frame polygon
+        geoms, layer = [], []  # foreground polygons inside frame, occluders
+        fgGeo = []  # whole polygon of every foreground
+        out = object()  # foreground out of frame
+        for z, gp in enumerate(fgMk):
+            sub = []
+            for mk in gp:
+                geo = occluder(mk)
+                if geo is not None:
+                    if frPol.disjoint(geo) or frPol.touches(geo):
+                        # ignore any foreground that is out side of image frame
+                        sub.append(out)
+                        continue
+                    # only the part inside frame covers, same as `pasteRegion`,
+                    # the foreground itself is kept whole
+                    geoms.append(frPol.intersection(geo) if frPol.overlaps(geo) else geo)
+                    layer.append(z)
+                sub.append(geo)
+            fgGeo.append(sub)
+        geoms = numpy.array(geoms, dtype=object)
+        layer = numpy.array(layer, dtype=int)
+        tree = STRtree(geoms)
+
+        def visible(mk: Dict, geo, z: int) -> List[Dict]:
+            # part of `mk` not covered by foregrounds above layer `z`. They
+            # are cut in pasting order, piece by piece, same shapes as
+            # `pasteRegion` gives
+            idx = tree.query(geo, predicate='intersects')
+            idx = numpy.sort(idx[layer[idx] > z])
+            pixelMetrics.count('shapely.query')
+            pixelMetrics.count('shapely.touches', len(idx))
+            idx = idx[~shapely.touches(geoms[idx], geo)]
+            if not len(idx):
+                return [mk]
+            parts = [geo]
+            for cover in geoms[idx]:
+                rest = []
+                for part in parts:
+                    if cover.disjoint(part) or cover.touches(part):
+                        rest.append(part)
+                        continue
+                    pixelMetrics.count('shapely.difference')
+                    cut = part.difference(cover)
+                    rest.extend(sub for sub in getattr(cut, 'geoms', [cut])
+                        if isinstance(sub, Polygon) and not sub.is_empty)
+                parts = rest
+            return [_polygon(mk, part) for part in parts]
 
+        resMk = []
+        for mk in bgMk:
+            if mk['type'] != 'polygon':
+                # only polygon can be covered
+                resMk.append(mk)
+            else:
+                resMk.extend(visible(mk, Polygon(mk['param'], mk.get('holes')), -1))
+        for z, gp in enumerate(fgMk):
+            for mk, geo in zip(gp, fgGeo[z]):
+                if geo is out:
+                    continue
+                # ellipses cover markings below but are kept whole
+                resMk.extend(visible(mk, geo, z) if mk['type'] == 'polygon' else [mk])
+        return resMk
 
-    def masking(self, px: Image, gp: list, alpha=0):
+    @instrument('masking')
+    def masking(self, px: Image, gp: list, alpha=0, bounded=True):
         """
         create mask from pts, pixels' alpha bound by points is set to
-        `alpha`, otherwise set to 255
+        255, otherwise set to `alpha`. Return a new image, or `px` itself
+        if it is a numpy array or a `TiledImage`, whose alpha channel is
+        written in place
 
         Parameter
         ---------
+        px
+            a PIL image in RGBA mode, a (h, w, 4) uint8 numpy array, or a
+            `TiledImage`
         gp
-            group of markings of px
+            group of markings of px, `holes` of a polygon are excluded
         alpha
             tansparency of pixel that outside of mask region,
             range from 0 to 255 inclusively
+        bounded
+            if true, only rasterize within bounding box of the group
         """
-        # create a blank mask in L mode, then draw the polygon according to
-        # points, pixel within or along the polygon is visable
-        mask = Image.new("L", px.size, color=alpha)
+        inplace = isinstance(px, numpy.ndarray)
+        w, h = (px.shape[1], px.shape[0]) if inplace else px.size
+        gp = [mk for mk in gp if mk['type'] not in self.supportedType[: 2]]
+
+        # bounding box of the group inside the image
+        x0, y0, x1, y1 = 0, 0, w, h
+        if bounded and gp:
+            x0, y0, x1, y1 = self._algo.getBound(gp)
+            x0, y0 = min(max(x0, 0), w), min(max(y0, 0), h)
+            x1, y1 = min(max(x1 + 1, x0), w), min(max(y1 + 1, y0), h)
+        if isinstance(px, TiledImage):
+            return self._maskTiles(px, gp, alpha, (x0, y0, x1, y1))
+
+        # draw all polygons on one mask in L mode, pixel within or along
+        # the polygon is visable, pixel in its holes is not
+        mask = Image.new("L", (x1 - x0, y1 - y0), color=alpha)
+        draw = ImageDraw.Draw(mask)
+        shf = numpy.array([x0, y0])
         for mk in gp:
-            if mk['type'] in supportedType[: 2]:
-                continue
-            ImageDraw.Draw(mask).polygon(mk['param'].flatten().tolist(), outline=255, fill=255)
+            param = pixelEllipse.polygon(mk) if mk['type'] in pixelEllipse.ELLIPSES else mk['param']
+            draw.polygon((param - shf).flatten().tolist(), outline=255, fill=255)
+            for hole in mk.get('holes', ()):
+                draw.polygon((numpy.asarray(hole) - shf).flatten().tolist(), fill=alpha)
+
+        if inplace:
+            a = px[:, :, 3]
+            if (x0, y0, x1, y1) != (0, 0, w, h):
+                a[...] = alpha
+            a[y0: y1, x0: x1] = numpy.asarray(mask)
+            return px
+
+        # only the bounding box is merged with its mask, PIL image can not
+        # be written through a numpy view
+        px = px.copy()
+        if (x0, y0, x1, y1) != (0, 0, w, h):
+            px.putalpha(alpha)
+        region = px.crop((x0, y0, x1, y1))
+        region.putalpha(mask)
+        px.paste(region, (x0, y0))
+        return px
+
+    def _maskTiles(self, px: TiledImage, gp: list, alpha=0, bound: Tuple = None) -> TiledImage:
+        """
+        `masking` of a tiled image, one row of tiles at a time. A row only
+        draws the markings whose bounding box meets it, on a band with the
+        same left edge as the mask `masking` draws on the whole image. PIL
+        then computes every edge in the same coordinates, so pixels are
+        the same as those of a whole image
 
-        # get indidual channel, merge then together
-        r, g, b, _ = px.split()
-        a = mask.getchannel(0)  # similar to .split()
-        return Image.merge("RGBA", [r, g, b, a])
+        Parameter
+        ---------
+        bound
+            (x0, y0, x1, y1) of the mask of the whole image
+        """
+        w, h = px.size
+        x0, y0, x1, y1 = bound if bound is not None else (0, 0, w, h)
+        bd = numpy.array([self._algo.getBound(mk) for mk in gp]).reshape(-1, 4)
+        org = numpy.array([x0, y0])
+
+        def pixel(pts) -> numpy.ndarray:
+            # PIL truncates vertices towards 0, draw the integer vertices
+            # of the mask of the whole image
+            return numpy.trunc(numpy.asarray(pts, dtype=float) - org) + org
+
+        for ty0 in range(0, h, px.tile):
+            ty1 = min(ty0 + px.tile, h)
+            a = px.array[ty0: ty1, :, 3]
+            a[...] = alpha
+            ry0, ry1 = max(ty0, y0), min(ty1, y1)
+            if ry0 >= ry1 or x0 >= x1:
+                continue
+            near = numpy.flatnonzero((bd[:, 1] < ry1) & (bd[:, 3] >= ry0))
+            if not len(near):
+                continue
+            mask = Image.new("L", (x1 - x0, ry1 - ry0), color=alpha)
+            draw = ImageDraw.Draw(mask)
+            shf = numpy.array([x0, ry0])
+            for i in near:
+                param = gp[i]['param']
+                if gp[i]['type'] in pixelEllipse.ELLIPSES:
+                    param = pixelEllipse.polygon(gp[i])
+                draw.polygon((pixel(param) - shf).flatten().tolist(), outline=255, fill=255)
+                for hole in gp[i].get('holes', ()):
+                    draw.polygon((pixel(hole) - shf).flatten().tolist(), fill=alpha)
+            a[ry0 - ty0: ry1 - ty0, x0: x1] = numpy.asarray(mask)
+        return px
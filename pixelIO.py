@@ -0,0 +1,281 @@
+import base64
+import io
+import json
+import mmap
+import os
+import numpy
+from PIL import Image
+from typing import List, Dict, Tuple
+from pixelMetrics import instrument
+
+
+def scanPairs(srcDir: str, pxExt=('jpg', 'jpeg', 'png', 'bmp'), mkExt=('json', )):
+    """
+        generator operation
+        yield (name, image path, marking path) of every image that has a
+        marking file with the same name in `srcDir`, sorted by name
+    """
+    pxExt = set(map(lambda x: x.upper(), pxExt))
+    mkExt = set(map(lambda x: x.upper(), mkExt))
+
+    fName = {}
+    with os.scandir(srcDir) as it:
+        for entry in it:
+            name, ext = os.path.splitext(entry.name)
+            ext = ext[1:].upper()
+            if ext in pxExt:
+                fName.setdefault(name, [None, None])[0] = entry.name
+            elif ext in mkExt:
+                fName.setdefault(name, [None, None])[1] = entry.name
+
+    for name in sorted(fName):
+        px, mk = fName[name]
+        if px is not None and mk is not None:
+            yield (name, os.path.join(srcDir, px), os.path.join(srcDir, mk))
+
+
+def toMarkings(shapes: List[Dict]) -> List[Dict]:
+    """
+    convert LabelMe shapes to markings used by PixelFactory. Keys other
+    than `points` and `shape_type` are kept
+    """
+    mk = []
+    for sh in shapes:
+        item = {k: v for k, v in sh.items() if k not in ('points', 'shape_type')}
+        param = numpy.array(sh['points'], dtype=float)
+        kind = sh.get('shape_type') or 'polygon'
+        if kind == 'rectangle':
+            (x0, y0), (x1, y1) = param[:2]
+            param = numpy.array([(x0, y0), (x1, y0), (x1, y1), (x0, y1)])
+            kind = 'polygon'
+        elif kind in ('line', 'linestrip') or (kind == 'polygon' and len(param) == 2):
+            kind = 'line'
+        if len(param) < 2 and kind != 'circle':
+            kind = 'point'
+            param = param[0]
+        item['param'] = param
+        item['type'] = kind
+        mk.append(item)
+    return mk
+
+
+def toShapes(mk: List[Dict]) -> List[Dict]:
+    """
+    reverse of `toMarkings`
+    """
+    shapes = []
+    for item in mk:
+        # LabelMe has no holes of polygon
+        sh = {k: v for k, v in item.items() if k not in ('param', 'type', 'holes')}
+        pts = numpy.reshape(item['param'], (-1, 2)).tolist()
+        kind = item['type']
+        if kind == 'line' and len(pts) > 2:
+            kind = 'linestrip'
+        sh['points'] = pts
+        sh['shape_type'] = kind
+        sh.setdefault('label', '')
+        sh.setdefault('group_id', None)
+        sh.setdefault('flags', {})
+        shapes.append(sh)
+    return shapes
+
+
+_EXIF_ROTATION = {3: 180, 6: 270, 8: 90}  # exif orientation -> degree of rotation
+
+
+def exifRotation(px: Image.Image) -> int:
+    """
+    degree that `exifTranspose` rotates the image by, mirrored orientations
+    are left as they are
+    """
+    try:
+        return _EXIF_ROTATION.get(px.getexif().get(0x0112), 0)
+    except Exception:
+        return 0
+
+
+def exifTranspose(px: Image.Image) -> Image.Image:
+    """
+    rotate image according to its exif orientation
+    """
+    deg = exifRotation(px)
+    return px.rotate(deg, expand=True) if deg else px
+
+
+class LabelMeFile:
+    """
+    LabelMe json whose `imageData` and image are only read when used.
+    The base64 `imageData` string is skipped while parsing, so reading
+    `shapes` costs about the same as a json without embedded image
+
+    Usage
+    -----
+        lf = LabelMeFile('a.json')
+        mk = lf.markings()          # imageData is never touched
+        px = lf.image((640, 480))   # decoded with jpeg draft reduction
+        mk = lf.markings()          # scaled to the size of px
+    """
+    def __init__(self, mkPath: str, pxPath: str = None):
+        """
+        Parameter
+        ---------
+        mkPath
+            path to the json
+        pxPath
+            path to the image, used when json has no `imageData`. Default to
+            `imagePath` relative to the json
+        """
+        self.mkPath = mkPath
+        self.pxPath = pxPath
+        self.scale = 1.0   # size of decoded image / size of original image
+        self._span = None  # byte range of imageData string in the file
+        self._imageData = None
+
+        with open(mkPath, 'rb') as f:
+            raw = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.data = self._parse(raw)
+            finally:
+                raw.close()
+        self.data['imageData'] = None
+
+    def _parse(self, raw) -> Dict:
+        # locate value of imageData, parse everything else
+        key = raw.find(b'"imageData"')
+        if key < 0:
+            return json.loads(raw[:])
+        beg = key + len(b'"imageData"')
+        while raw[beg: beg + 1] in (b' ', b'\t', b'\r', b'\n', b':'):
+            beg += 1
+        if raw[beg: beg + 1] != b'"':
+            return json.loads(raw[:])
+        end = raw.find(b'"', beg + 1)
+        while raw[end - 1: end] == b'\\':
+            end = raw.find(b'"', end + 1)
+        self._span = (beg + 1, end)
+        return json.loads(raw[:beg] + b'null' + raw[end + 1:])
+
+    @property
+    def shapes(self) -> List[Dict]:
+        return self.data.get('shapes', [])
+
+    @property
+    def imageData(self) -> str:
+        """
+        base64 string of the embedded image, None if not embedded
+        """
+        if self._imageData is None and self._span is not None:
+            with open(self.mkPath, 'rb') as f:
+                f.seek(self._span[0])
+                raw = f.read(self._span[1] - self._span[0])
+            self._imageData = raw.decode('ascii').replace('\\/', '/')
+        return self._imageData
+
+    @property
+    def imageFile(self) -> str:
+        """
+        path to the image file the pixels come from, None if the image is
+        embedded in the json
+        """
+        if self._span is not None:
+            return None
+        return self.pxPath or os.path.join(os.path.dirname(self.mkPath), self.data['imagePath'])
+
+    def markings(self) -> List[Dict]:
+        """
+        markings of `shapes`, scaled to the last image returned by `image`
+        """
+        mk = toMarkings(self.shapes)
+        if self.scale != 1.0:
+            for item in mk:
+                item['param'] *= self.scale
+        return mk
+
+    @instrument('decode')
+    def image(self, size: Tuple = None, mode='RGBA') -> Image.Image:
+        """
+        decode the image. If `size` is given, jpeg is decoded directly at
+        the smallest reduction that is not smaller than `size`, and `scale`
+        records the reduction
+
+        Parameter
+        ---------
+        size
+            requested working size (width, height)
+        """
+        src = self.imageFile
+        if src is None:
+            src = io.BytesIO(base64.b64decode(self.imageData))
+        px = Image.open(src)
+        orig = px.size
+        if size is not None:
+            px.draft('RGB', size)
+        self.scale = px.size[0] / orig[0]
+        return exifTranspose(px).convert(mode)
+
+
+def loadData(srcDir: str, pxExt=('jpg', 'jpeg', 'png', 'bmp'), mkExt=('json', )):
+    """
+        generator operation
+        yield (name, LabelMeFile) of every pair in `srcDir`, nothing but
+        `shapes` is read until it is used
+
+        Usage
+        -----
+            for name, lf in loadData(path):
+                px, mk = lf.image(), lf.markings()
+    """
+    for name, pxPath, mkPath in scanPairs(srcDir, pxExt, mkExt):
+        yield (name, LabelMeFile(mkPath, pxPath))
+
+
+@instrument('decode')
+def loadLabelMe(pxPath: str, mkPath: str) -> Tuple:
+    """
+    return a tuple contains image in RGBA mode, LabelMe json data, and
+    markings of its shapes. Embedded `imageData` is not parsed and is None
+    in the json data
+    """
+    lf = LabelMeFile(mkPath, pxPath)
+    px = exifTranspose(Image.open(pxPath)).convert('RGBA')
+    return (px, lf.data, lf.markings())
+
+
+@instrument('encode')
+def dumpLabelMe(px: Image.Image, jData: Dict, mk: List[Dict], dstDir: str, name: str,
+    pxExt='jpg', embed=True) -> Tuple:
+    """
+    save image and LabelMe json to `dstDir`. Return paths of the image and
+    the json. The image is encoded only once, the same bytes are written to
+    the image file and, if `embed`, to `imageData`
+
+    Parameter
+    ---------
+    jData
+        LabelMe json data of the source, will not be modified
+    mk
+        markings that replace `shapes`
+    embed
+        if false, `imageData` is null and the json refers to the image file
+        by `imagePath` only
+    """
+    if pxExt not in ('jpg', 'jpeg'):
+        raise Exception('Not implemented')
+    pxPath = os.path.join(dstDir, '{}.{}'.format(name, pxExt))
+    mkPath = os.path.join(dstDir, '{}.json'.format(name))
+
+    jData = dict(jData)
+    px = px.convert('RGB')
+    buf = io.BytesIO()
+    px.save(buf, format='JPEG')  # save as byte data
+    jData['shapes'] = toShapes(mk)
+    jData['imagePath'] = os.path.basename(pxPath)
+    jData['imageData'] = base64.b64encode(buf.getbuffer()).decode('ascii') if embed else None
+    jData['imageHeight'] = px.size[1]
+    jData['imageWidth'] = px.size[0]
+
+    with open(pxPath, 'wb') as f:
+        f.write(buf.getbuffer())
+    with open(mkPath, 'w') as f:
+        json.dump(jData, f, indent=2)
+    return (pxPath, mkPath)
@@ -0,0 +1,256 @@
+"""
+Index of every shape of folders of LabelMe files, kept in SQLite
+
+Every shape is recorded once with its file, label, trailing number of the
+label, group id, type, bounding box, area and number of vertices, so
+shapes are selected by a query instead of parsing every json again. Only
+files whose size or modification time changed are parsed again by `build`
+
+    index = ShapeIndex('shapes.db')
+    index.build('imgs')
+    for mkPath, idx, label in index.select('WeiLong.*', ['polygon'], (2000, 20000)):
+        px, mk = bank.get(mkPath, idx)
+
+    python pixelIndex.py build imgs --db shapes.db
+    python pixelIndex.py select --db shapes.db --label 'WeiLong.*' --area 2000 20000
+"""
+import argparse
+import os
+import re
+import sqlite3
+import numpy
+from typing import List, Dict, Tuple
+import pixelEllipse
+import pixelIO
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY, dir TEXT, name TEXT, mkPath TEXT UNIQUE, pxPath TEXT,
+    mtime INTEGER, size INTEGER, width INTEGER, height INTEGER);
+CREATE TABLE IF NOT EXISTS shapes (
+    file INTEGER, idx INTEGER, label TEXT, tail TEXT, groupId INTEGER, type TEXT,
+    x0 REAL, y0 REAL, x1 REAL, y1 REAL, area REAL, vertices INTEGER,
+    PRIMARY KEY (file, idx));
+CREATE INDEX IF NOT EXISTS shapes_label ON shapes (label);
+CREATE INDEX IF NOT EXISTS shapes_area ON shapes (type, area);
+"""
+_TAIL = re.compile(r'\d*$')  # digit string in the end of a label
+
+
+def _regexp(pattern: str, value: str) -> bool:
+    # same as labels matched by ops, `re.match`, patterns are cached by re
+    return value is not None and re.match(pattern, value) is not None
+
+
+def _prefix(pattern: str) -> str:
+    # literal start of a regular expression, every match begins with it
+    if '|' in pattern:
+        return ''
+    i = 0
+    while i < len(pattern) and pattern[i] not in '.^$*+?{}[]\\|()':
+        i += 1
+    if i < len(pattern) and pattern[i] in '*?{':
+        i -= 1  # last literal may be repeated zero times
+    return pattern[: max(i, 0)]
+
+
+def shapeGeometry(mk: Dict) -> Tuple:
+    """
+    (x0, y0, x1, y1, area, vertices) of a marking. Ellipse and circle are
+    measured by their outline, see `pixelEllipse`, point and line have no
+    area
+    """
+    pts = numpy.reshape(numpy.asarray(mk['param'], dtype=float), (-1, 2))
+    if mk['type'] in pixelEllipse.ELLIPSES:
+        x0, y0, x1, y1 = pixelEllipse.bounds(mk)
+        return (float(x0), float(y0), float(x1), float(y1), pixelEllipse.area(mk), len(pts))
+    x0, y0 = pts.min(axis=0)
+    x1, y1 = pts.max(axis=0)
+    area = 0.0
+    if mk['type'] == 'polygon' and len(pts) > 2:
+        x, y = pts[:, 0], pts[:, 1]
+        area = 0.5 * abs(float(numpy.dot(x, numpy.roll(y, -1)) - numpy.dot(y, numpy.roll(x, -1))))
+    return (float(x0), float(y0), float(x1), float(y1), area, len(pts))
+
+
+class ShapeIndex:
+    def __init__(self, path: str = ':memory:'):
+        """
+        Parameter
+        ---------
+        path
+            SQLite file of the index, kept in memory by default
+        """
+        self.path = path
+        # workers building the same file wait for each other
+        self._db = sqlite3.connect(path, timeout=60)
+        self._db.create_function('REGEXP', 2, _regexp, deterministic=True)
+        self._db.executescript(_SCHEMA)
+
+    def build(self, srcDir: str, pxExt=('jpg', 'jpeg', 'png', 'bmp'), mkExt=('json', )) -> int:
+        """
+        index every pair of `srcDir`. Files of `srcDir` not changed since
+        last build are skipped, removed files are dropped from the index.
+        Return number of files parsed
+        """
+        cnt = 0
+        with self._db:
+            # take the write lock before reading, a worker building the same
+            # file waits, then only sees files the other one did not add
+            self._db.execute('BEGIN IMMEDIATE')
+            known = {row[0]: row[1:] for row in self._db.execute(
+                'SELECT mkPath, id, mtime, size FROM files WHERE dir = ?', (srcDir, ))}
+            for name, pxPath, mkPath in pixelIO.scanPairs(srcDir, pxExt, mkExt):
+                st = os.stat(mkPath)
+                old = known.pop(mkPath, None)
+                if old is not None and old[1:] == (st.st_mtime_ns, st.st_size):
+                    continue
+                if old is not None:
+                    self._drop(old[0])
+                self._add(srcDir, name, pxPath, mkPath, st)
+                cnt += 1
+            for fid, _, _ in known.values():
+                self._drop(fid)
+        return cnt
+
+    def _add(self, srcDir: str, name: str, pxPath: str, mkPath: str, st):
+        lf = pixelIO.LabelMeFile(mkPath, pxPath)
+        fid = self._db.execute(
+            'INSERT INTO files (dir, name, mkPath, pxPath, mtime, size, width, height) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (srcDir, name, mkPath, pxPath, st.st_mtime_ns,
+                st.st_size, lf.data.get('imageWidth'), lf.data.get('imageHeight'))).lastrowid
+        rows = []
+        for idx, mk in enumerate(lf.markings()):
+            label = str(mk.get('label', ''))
+            rows.append((fid, idx, label, _TAIL.search(label).group(), mk.get('group_id'),
+                mk['type']) + shapeGeometry(mk))
+        self._db.executemany('INSERT INTO shapes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            rows)
+
+    def _drop(self, fid: int):
+        self._db.execute('DELETE FROM shapes WHERE file = ?', (fid, ))
+        self._db.execute('DELETE FROM files WHERE id = ?', (fid, ))
+
+    def select(self, label: str = None, types: List[str] = None, area: Tuple = None,
+        srcDir: str = None, groupId: int = None, minVertices=0, limit: int = None) -> List[Tuple]:
+        """
+        return (marking path, shape index, label) of shapes that match every
+        given condition, ordered by file name and shape index, the same
+        order as `ObjectBank.index`
+
+        Parameter
+        ---------
+        label
+            regular expression, matched from the start of the label
+        types
+            marking types, e.g. ['polygon']
+        area
+            (min, max) area in pixels, inclusive, either may be None
+        srcDir
+            only shapes of this folder, as given to `build`
+        """
+        cond, args = [], []
+        if label is not None:
+            pre = _prefix(label)
+            if pre:
+                # range of the label index, before matching every row
+                cond.append('s.label >= ? AND s.label < ?')
+                args.extend([pre, pre + '\U0010ffff'])
+            cond.append('s.label REGEXP ?')
+            args.append(label)
+        if types is not None:
+            cond.append('s.type IN ({})'.format(', '.join('?' * len(types))))
+            args.extend(types)
+        if area is not None and area[0] is not None:
+            cond.append('s.area >= ?')
+            args.append(area[0])
+        if area is not None and area[1] is not None:
+            cond.append('s.area <= ?')
+            args.append(area[1])
+        if srcDir is not None:
+            cond.append('f.dir = ?')
+            args.append(srcDir)
+        if groupId is not None:
+            cond.append('s.groupId = ?')
+            args.append(groupId)
+        if minVertices:
+            cond.append('s.vertices >= ?')
+            args.append(minVertices)
+        sql = 'SELECT f.mkPath, s.idx, s.label FROM shapes s JOIN files f ON s.file = f.id'
+        if cond:
+            sql += ' WHERE ' + ' AND '.join(cond)
+        sql += ' ORDER BY f.dir, f.name, s.idx'
+        if limit is not None:
+            sql += ' LIMIT {:d}'.format(limit)
+        return self._db.execute(sql, args).fetchall()
+
+    def groups(self, mkPath: str, mode='tail_num') -> Dict:
+        """
+        indices of shapes of one file grouped as `LabelMeHandler.retrive`
+        does, without parsing the file
+
+        Parameter
+        ---------
+        mode
+            `tail_num`, group by the non-negative integer at the end of label
+            `label`, group by label
+        """
+        key = {'tail_num': 's.tail', 'label': 's.label'}.get(mode)
+        if key is None:
+            raise Exception('Not implemented')
+        gp = {}
+        for k, idx in self._db.execute(
+                'SELECT {}, s.idx FROM shapes s JOIN files f ON s.file = f.id '
+                'WHERE f.mkPath = ? ORDER BY s.idx'.format(key), (mkPath, )):
+            gp.setdefault(k, []).append(idx)
+        return gp
+
+    def geometry(self, mkPath: str, idx: int) -> Tuple:
+        """
+        (type, x0, y0, x1, y1, area) of a shape, None if not indexed
+        """
+        return self._db.execute(
+            'SELECT s.type, s.x0, s.y0, s.x1, s.y1, s.area FROM shapes s JOIN files f '
+            'ON s.file = f.id WHERE f.mkPath = ? AND s.idx = ?', (mkPath, idx)).fetchone()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM shapes').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='index shapes of LabelMe files')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    bdp = sub.add_parser('build', help='index or update every pair of folders')
+    bdp.add_argument('src', nargs='+', help='source folders')
+    bdp.add_argument('--db', required=True, help='SQLite file of the index')
+    slp = sub.add_parser('select', help='print marking path, index and label of shapes')
+    slp.add_argument('--db', required=True, help='SQLite file of the index')
+    slp.add_argument('--label', default=None, help='regular expression of label')
+    slp.add_argument('--type', nargs='+', default=None, help='marking types')
+    slp.add_argument('--area', nargs=2, type=float, default=None, metavar=('MIN', 'MAX'))
+    slp.add_argument('--src', default=None, help='only shapes of this folder')
+    slp.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    with ShapeIndex(args.db) as index:
+        if args.cmd == 'build':
+            cnt = sum(index.build(src) for src in args.src)
+            print('{} files indexed, {} shapes'.format(cnt, len(index)))
+            return cnt
+        res = index.select(args.label, args.type, args.area, args.src, limit=args.limit)
+        for mkPath, idx, label in res:
+            print('{}\t{}\t{}'.format(mkPath, idx, label))
+        return len(res)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+import math
+import numpy
+from itertools import chain
+from typing import List, Dict, Tuple
+import pixelEllipse
+import pixelIO
+
+
+class MarkingSet:
+    """
+    markings stored in flat arrays instead of a list of dicts. Vertices of
+    all markings are kept in one (n, 2) array, marking i owns rows
+    `off[i]: off[i + 1]`. Vertices are read-only and shared between sets
+    derived from each other, translate and rotate only record an affine
+    transform, which is applied when vertices are used
+
+    Usage
+    -----
+        ms = MarkingSet.fromShapes(jData['shapes'])
+        ms2 = ms.translate(10, 20).rotate(30, (50, 50))   # O(1)
+        for item in ms2:                                  # marking dicts
+            print(item['type'], item['param'])
+    """
+    TYPES = ('point', 'line', 'polygon', 'ellipse', 'circle')
+
+    __slots__ = ('_vtx', '_mat', '_off', '_type', '_label', 'labels', '_extra')
+
+    def __init__(self, vtx: numpy.ndarray, off: numpy.ndarray, mkType: numpy.ndarray,
+        label: numpy.ndarray, labels: List[str], extra: Tuple = None, mat=None):
+        """
+        Parameter
+        ---------
+        vtx
+            (n, 2) vertices of all markings
+        off
+            (m + 1, ) offsets of markings in `vtx`
+        mkType
+            (m, ) index of marking type in `TYPES`
+        label
+            (m, ) index of marking label in `labels`, -1 if no label
+        extra
+            other keys of every marking, e.g. `group_id` and `flags`
+        mat
+            pending 2 x 3 affine transform of vertices
+        """
+        self._vtx = numpy.asarray(vtx, dtype=float).reshape(-1, 2)
+        self._vtx.flags.writeable = False
+        self._off = numpy.asarray(off, dtype=numpy.int64)
+        self._type = numpy.asarray(mkType, dtype=numpy.int8)
+        self._label = numpy.asarray(label, dtype=numpy.int32)
+        self.labels = labels
+        self._extra = extra
+        self._mat = mat
+
+    @classmethod
+    def fromMarkings(cls, mk: List[Dict]) -> 'MarkingSet':
+        """
+        build from markings used by PixelFactory
+        """
+        if isinstance(mk, dict):
+            mk = [mk]
+        pts = [numpy.reshape(item['param'], (-1, 2)) for item in mk]
+        vtx = numpy.concatenate(pts) if pts else numpy.empty((0, 2))
+        off = numpy.cumsum([0] + [len(p) for p in pts])
+        mkType = [cls.TYPES.index(item['type']) for item in mk]
+        lbMap = {}
+        label = [lbMap.setdefault(item['label'], len(lbMap)) if 'label' in item else -1
+            for item in mk]
+        extra = tuple({k: v for k, v in item.items() if k not in ('param', 'type', 'label')}
+            for item in mk)
+        return cls(vtx, off, mkType, label, list(lbMap), extra)
+
+    @classmethod
+    def fromShapes(cls, shapes: List[Dict]) -> 'MarkingSet':
+        """
+        build from LabelMe shapes, same conversion as `pixelIO.toMarkings`
+        """
+        mkType, cnt = [], []
+        for sh in shapes:
+            kind = sh.get('shape_type') or 'polygon'
+            n = len(sh['points'])
+            if kind == 'rectangle':
+                # corners have to be generated
+                return cls.fromMarkings(pixelIO.toMarkings(shapes))
+            elif kind in ('line', 'linestrip') or (kind == 'polygon' and n == 2):
+                kind = 'line'
+            if n < 2 and kind != 'circle':
+                kind = 'point'
+            mkType.append(cls.TYPES.index(kind))
+            cnt.append(n)
+        vtx = numpy.fromiter(
+            chain.from_iterable(chain.from_iterable(sh['points'] for sh in shapes)),
+            dtype=float, count=2 * sum(cnt))
+        lbMap = {}
+        label = [lbMap.setdefault(sh['label'], len(lbMap)) if 'label' in sh else -1
+            for sh in shapes]
+        extra = tuple({k: v for k, v in sh.items() if k not in ('points', 'shape_type', 'label')}
+            for sh in shapes)
+        return cls(vtx, numpy.cumsum([0] + cnt), mkType, label, list(lbMap), extra)
+
+    def _derive(self, vtx=None, mat=None, extra=None) -> 'MarkingSet':
+        # a new set sharing everything but vertices, and holes if `extra`
+        return MarkingSet(self._vtx if vtx is None else vtx, self._off, self._type,
+            self._label, self.labels, self._extra if extra is None else extra, mat)
+
+    def _withHoles(self, fn) -> Tuple:
+        # `extra` whose holes of polygons are (n, 2) vertices `fn` returns
+        # for the holes, None if no marking has a hole
+        if self._extra is None or not any('holes' in ex for ex in self._extra):
+            return None
+        return tuple(dict(ex, holes=fn([numpy.reshape(h, (-1, 2)) for h in ex['holes']]))
+            if 'holes' in ex else ex for ex in self._extra)
+
+    @property
+    def vertices(self) -> numpy.ndarray:
+        """
+        (n, 2) read-only vertices of all markings
+        """
+        if self._mat is not None:
+            vtx = numpy.dot(self._vtx, self._mat[:, :2].T) + self._mat[:, 2]
+            vtx.flags.writeable = False
+            self._vtx, self._mat = vtx, None
+        return self._vtx
+
+    @property
+    def offsets(self) -> numpy.ndarray:
+        return self._off
+
+    @property
+    def types(self) -> List[str]:
+        return [self.TYPES[t] for t in self._type]
+
+    def __len__(self):
+        return len(self._type)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i: int) -> Dict:
+        """
+        marking dict of the i-th marking, `param` is a view of vertices
+        """
+        vtx = self.vertices
+        item = dict(self._extra[i]) if self._extra is not None else {}
+        if self._label[i] >= 0:
+            item['label'] = self.labels[self._label[i]]
+        item['type'] = self.TYPES[self._type[i]]
+        item['param'] = vtx[self._off[i]: self._off[i + 1]]
+        if item['type'] == 'point':
+            item['param'] = item['param'][0]
+        return item
+
+    def toMarkings(self) -> List[Dict]:
+        """
+        list of marking dicts, `param` of each is a view of vertices
+        """
+        return list(self)
+
+    def toShapes(self) -> List[Dict]:
+        """
+        list of LabelMe shapes, same as `pixelIO.toShapes`
+        """
+        vtx = self.vertices
+        shapes = []
+        for i in range(len(self)):
+            sh = dict(self._extra[i]) if self._extra is not None else {}
+            sh['label'] = self.labels[self._label[i]] if self._label[i] >= 0 else ''
+            sh['points'] = vtx[self._off[i]: self._off[i + 1]].tolist()
+            kind = self.TYPES[self._type[i]]
+            if kind == 'line' and len(sh['points']) > 2:
+                kind = 'linestrip'
+            sh['shape_type'] = kind
+            sh.setdefault('group_id', None)
+            sh.setdefault('flags', {})
+            shapes.append(sh)
+        return shapes
+
+    def copy(self) -> 'MarkingSet':
+        """
+        shallow copy, vertices are only copied when written
+        """
+        return self._derive(mat=self._mat)
+
+    @property
+    def holes(self) -> List[numpy.ndarray]:
+        """
+        (k, 2) vertices of every hole of polygons, marking by marking
+        """
+        if self._extra is None:
+            return []
+        return [numpy.reshape(h, (-1, 2)) for ex in self._extra for h in ex.get('holes', ())]
+
+    def affine(self, mat: numpy.ndarray) -> 'MarkingSet':
+        """
+        return a set transformed by 2 x 3 affine matrix `mat`, O(1). Holes
+        of polygons are few, they are transformed at once
+        """
+        mat = numpy.asarray(mat, dtype=float)
+        extra = self._withHoles(
+            lambda holes: [numpy.dot(h, mat[:, :2].T) + mat[:, 2] for h in holes])
+        if self._mat is not None:
+            mat = numpy.concatenate([
+                numpy.dot(mat[:, :2], self._mat[:, :2]),
+                (numpy.dot(mat[:, :2], self._mat[:, 2]) + mat[:, 2])[:, None]], axis=1)
+        return self._derive(mat=mat, extra=extra)
+
+    def translate(self, dx: float, dy: float) -> 'MarkingSet':
+        return self.affine([[1, 0, dx], [0, 1, dy]])
+
+    def rotate(self, degree: float, center=(0, 0)) -> 'MarkingSet':
+        """
+        rotate around `center`, same direction as `PixelFactory.rotate`
+        """
+        r = math.radians(degree)
+        c, s = math.cos(r), math.sin(r)
+        cx, cy = center
+        return self.affine([
+            [c, s, cx - c * cx - s * cy],
+            [-s, c, cy + s * cx - c * cy]])
+
+    def withVertices(self, vtx: numpy.ndarray, holes: numpy.ndarray = None) -> 'MarkingSet':
+        """
+        return a set with same markings but new vertices. `holes` are new
+        vertices of all holes, in order of `holes`, holes are kept if None
+        """
+        extra = None
+        if holes is not None:
+            rings = iter(numpy.split(holes, numpy.cumsum([len(h) for h in self.holes])))
+            extra = self._withHoles(lambda old: [next(rings) for _ in old])
+        return self._derive(vtx=vtx, extra=extra)
+
+    def setParam(self, i: int, param: numpy.ndarray) -> 'MarkingSet':
+        """
+        return a set whose i-th marking has vertices `param`, other sets
+        sharing vertices with this one are not affected
+        """
+        vtx = self.vertices
+        pts = numpy.reshape(param, (-1, 2))
+        vtx = numpy.concatenate([vtx[: self._off[i]], pts, vtx[self._off[i + 1]:]])
+        off = self._off.copy()
+        off[i + 1:] += len(pts) - (self._off[i + 1] - self._off[i])
+        return MarkingSet(vtx, off, self._type, self._label, self.labels, self._extra)
+
+    def subset(self, idx) -> 'MarkingSet':
+        """
+        return a set of the markings at `idx`
+        """
+        idx = numpy.arange(len(self))[idx]
+        vtx = self.vertices
+        cnt = self._off[idx + 1] - self._off[idx]
+        rows = numpy.repeat(self._off[idx] - numpy.cumsum(cnt) + cnt, cnt) + numpy.arange(cnt.sum())
+        extra = tuple(self._extra[i] for i in idx) if self._extra is not None else None
+        return MarkingSet(vtx[rows], numpy.concatenate([[0], numpy.cumsum(cnt)]),
+            self._type[idx], self._label[idx], self.labels, extra)
+
+    def bounds(self) -> numpy.ndarray:
+        """
+        (m, 4) bounding box [x_min, y_min, x_max, y_max] of every marking
+        """
+        vtx = self.vertices
+        if not len(self):
+            return numpy.empty((0, 4))
+        beg = self._off[:-1]
+        bd = numpy.concatenate([
+            numpy.minimum.reduceat(vtx, beg, axis=0),
+            numpy.maximum.reduceat(vtx, beg, axis=0)], axis=1)
+        # ellipses and circles are bounded by their outline
+        for i in numpy.flatnonzero(self._type >= self.TYPES.index('ellipse')):
+            bd[i] = pixelEllipse.bounds(self[i])
+        return bd
+
+    def bound(self) -> Tuple:
+        """
+        bounding box of all markings, (x_min, y_min, x_max, y_max)
+        """
+        if (self._type >= self.TYPES.index('ellipse')).any():
+            bd = self.bounds()
+            return tuple(bd[:, :2].min(axis=0)) + tuple(bd[:, 2:].max(axis=0))
+        vtx = self.vertices
+        return tuple(vtx.min(axis=0)) + tuple(vtx.max(axis=0))
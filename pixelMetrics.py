@@ -0,0 +1,184 @@
+"""
+Opt-in instrumentation of PixelFactory
+
+Operations decorated by `instrument` record wall time, calls, pixels and
+vertices of their arguments into the active `Collector`, and hot spots
+count shapely calls by `count`. Nothing but a global lookup is done while
+no collector is enabled
+
+    col = pixelMetrics.enable()
+    ...
+    col.dump('metrics.prom')   # or metrics.json
+"""
+import functools
+import json
+import threading
+import time
+import numpy
+from itertools import chain
+from typing import Dict
+from PIL import Image
+from pixelTile import TiledImage
+
+_collector = None  # active collector, None if disabled
+
+
+class Collector:
+    def __init__(self):
+        self.ops = {}       # name -> [calls, seconds, pixels, vertices]
+        self.counters = {}  # name -> count
+        # ops run on threads of `pixelAsync` record into the same collector
+        self._lock = threading.Lock()
+
+    def record(self, name: str, sec: float, pixels=0, vertices=0):
+        with self._lock:
+            rec = self.ops.get(name)
+            if rec is None:
+                rec = self.ops[name] = [0, 0.0, 0, 0]
+            rec[0] += 1
+            rec[1] += sec
+            rec[2] += pixels
+            rec[3] += vertices
+
+    def count(self, name: str, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self) -> Dict:
+        """
+        json serializable summary
+        """
+        with self._lock:
+            return {
+                'ops': {k: {'calls': v[0], 'seconds': v[1], 'pixels': v[2], 'vertices': v[3]}
+                    for k, v in self.ops.items()},
+                'counters': dict(self.counters),
+            }
+
+    def merge(self, snap: Dict):
+        """
+        add a `snapshot` of another collector, e.g. of a worker process
+        """
+        with self._lock:
+            for k, v in snap['ops'].items():
+                rec = self.ops.setdefault(k, [0, 0.0, 0, 0])
+                rec[0] += v['calls']
+                rec[1] += v['seconds']
+                rec[2] += v['pixels']
+                rec[3] += v['vertices']
+            for k, v in snap['counters'].items():
+                self.counters[k] = self.counters.get(k, 0) + v
+
+    def toPrometheus(self) -> str:
+        """
+        summary in prometheus text exposition format
+        """
+        snap = self.snapshot()
+        lines = []
+        for metric, key, desc in (
+            ('pixel_op_calls_total', 'calls', 'Calls of op'),
+            ('pixel_op_seconds_total', 'seconds', 'Wall time spent in op'),
+            ('pixel_op_pixels_total', 'pixels', 'Pixels of images passed to op'),
+            ('pixel_op_vertices_total', 'vertices', 'Vertices of markings passed to op'),
+        ):
+            lines.append('# HELP {} {}'.format(metric, desc))
+            lines.append('# TYPE {} counter'.format(metric))
+            for k in sorted(snap['ops']):
+                lines.append('{}{{op="{}"}} {}'.format(metric, k, snap['ops'][k][key]))
+        lines.append('# HELP pixel_calls_total Calls counted in hot spots, e.g. shapely')
+        lines.append('# TYPE pixel_calls_total counter')
+        for k in sorted(snap['counters']):
+            lines.append('pixel_calls_total{{name="{}"}} {}'.format(k, snap['counters'][k]))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str):
+        """
+        write summary to `path`, prometheus text if it ends with `.prom`,
+        json otherwise
+        """
+        with open(path, 'w') as f:
+            if path.endswith('.prom'):
+                f.write(self.toPrometheus())
+            else:
+                json.dump(self.snapshot(), f, indent=2)
+
+
+def enable(collector: Collector = None) -> Collector:
+    """
+    start recording into `collector`, or a new one. Return the collector
+    """
+    global _collector
+    _collector = collector or Collector()
+    return _collector
+
+
+def disable() -> Collector:
+    """
+    stop recording. Return the collector that was active
+    """
+    global _collector
+    col, _collector = _collector, None
+    return col
+
+
+def active() -> Collector:
+    return _collector
+
+
+def count(name: str, n=1):
+    """
+    count `n` calls of `name` if recording
+    """
+    if _collector is not None:
+        _collector.count(name, n)
+
+
+def _size(arg):
+    # pixels and vertices of an argument
+    if isinstance(arg, (Image.Image, TiledImage)):
+        return (arg.size[0] * arg.size[1], 0)
+    if isinstance(arg, numpy.ndarray):
+        return (arg.shape[0] * arg.shape[1], 0) if arg.ndim == 3 else (0, 0)
+    if isinstance(arg, dict):
+        param = arg.get('param')
+        return (0, numpy.size(param) // 2 if param is not None else 0)
+    if isinstance(arg, (list, tuple)):
+        # e.g. (px, mk) or (fg, fgMk, pos) items
+        px, vt = 0, 0
+        for item in arg:
+            if isinstance(item, (dict, list, tuple, Image.Image, TiledImage, numpy.ndarray)):
+                p, v = _size(item)
+                px, vt = px + p, vt + v
+        return (px, vt)
+    off = getattr(arg, 'offsets', None)  # MarkingSet, no pending transform applied
+    if isinstance(off, numpy.ndarray) and len(off):
+        return (0, int(off[-1]))
+    return (0, 0)
+
+
+def instrument(name: str):
+    """
+    decorator recording wall time, calls, pixels and vertices of arguments
+    of the decorated function as op `name`. If arguments have neither, e.g.
+    paths to decode, those of the result are recorded
+    """
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            col = _collector
+            if col is None:
+                return fn(*args, **kwargs)
+            t = time.perf_counter()
+            res = fn(*args, **kwargs)
+            sec = time.perf_counter() - t
+            px, vt = 0, 0
+            for arg in chain(args, kwargs.values()):
+                p, v = _size(arg)
+                px, vt = px + p, vt + v
+            if not px and not vt:
+                px, vt = _size(res)
+            col.record(name, sec, px, vt)
+            return res
+        return inner
+    return wrap
+
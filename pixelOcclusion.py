@@ -0,0 +1,177 @@
+import copy
+import numpy
+from shapely.geometry import Polygon, box
+from typing import List, Dict, Tuple
+import pixelEllipse
+import pixelMetrics
+from pixelMetrics import instrument
+
+
+def _closed(param) -> numpy.ndarray:
+    # exterior of Polygon(param), the ring closed by its first point
+    param = numpy.array(param, dtype=float)
+    if len(param) and not numpy.array_equal(param[0], param[-1]):
+        param = numpy.concatenate([param, param[:1]])
+    return param
+
+
+def occluder(mk: Dict):
+    """
+    polygon that a pasted marking covers, None for lines and points
+    """
+    if mk['type'] == 'polygon':
+        return Polygon(mk['param'], mk.get('holes'))
+    elif mk['type'] in pixelEllipse.ELLIPSES:
+        return Polygon(pixelEllipse.polygon(mk))
+    return None
+
+
+def _polygon(mk: Dict, geo: Polygon) -> Dict:
+    # marking of polygon `geo`, with the rest of keys of `mk`
+    item = dict(mk, param=numpy.array(geo.exterior.coords), type='polygon')
+    item.pop('holes', None)
+    if len(geo.interiors) > 0:
+        item['holes'] = [numpy.array(ring.coords) for ring in geo.interiors]
+    return item
+
+
+class OcclusionEngine:
+    """
+    markings of one image that foreground polygons are pasted on, one at a
+    time, with same result as `PixelFactory._pastePolyToPoly`.
+
+    Bounding boxes of markings are kept in an array, so a paste only builds
+    shapely objects for markings whose box meets the foreground, and those
+    objects are kept for next paste on the same image
+
+    Usage
+    -----
+        occ = OcclusionEngine(bgMk, px.size)
+        for fgMk in fgs:
+            mk = occ.paste(fgMk)
+    """
+    def __init__(self, bgMk: List[Dict], frSize: Tuple):
+        """
+        Parameter
+        ---------
+        frSize
+            frame size of the image
+        """
+        self.frSize = tuple(frSize)
+        self.frPol = box(0, 0, frSize[0], frSize[1])   # image frame polygon
+        self.markings = bgMk
+        self._param = []  # param of every marking when cached
+        self._geo = []    # cached shapely object of every marking
+        self._bd = numpy.empty((0, 4))
+        if bgMk is not None:
+            self._param = [mk['param'] for mk in bgMk]
+            self._geo = [None] * len(bgMk)
+            self._bd = self._bounds(bgMk)
+
+    @staticmethod
+    def _bounds(mk: List[Dict]) -> numpy.ndarray:
+        # bounding box of polygons, nan for other markings
+        bd = numpy.full((len(mk), 4), numpy.nan)
+        for i, item in enumerate(mk):
+            if item['type'] == 'polygon':
+                pts = numpy.asarray(item['param'], dtype=float)
+                bd[i, :2] = pts.min(axis=0)
+                bd[i, 2:] = pts.max(axis=0)
+        return bd
+
+    def matches(self, bgMk: List[Dict]) -> bool:
+        """
+        true if `bgMk` is the marking list of this engine, unchanged
+        """
+        return bgMk is self.markings and len(bgMk) == len(self._param) and all(
+            mk['param'] is param for mk, param in zip(bgMk, self._param))
+
+    def _geometry(self, i: int) -> Polygon:
+        if self._geo[i] is None:
+            mk = self.markings[i]
+            self._geo[i] = Polygon(mk['param'], mk.get('holes'))
+        return self._geo[i]
+
+    @instrument('occlusion')
+    def paste(self, fgMk: Dict) -> List[Dict]:
+        """
+        paste foreground marking on markings. Return the new list of
+        markings, which also becomes markings of the engine. Polygons,
+        ellipses and circles cover markings below them, the foreground is
+        kept as it is
+        """
+        fgPol = occluder(fgMk)                    # foreground polygon
+        frPol = self.frPol
+        bgMk = self.markings
+
+        # ignore any foreground that is out side of image frame or
+        # background makring that is empty
+        if bgMk is None:
+            return []
+        if fgPol is None:
+            # lines and points cover nothing
+            self.markings = bgMk + [dict(fgMk)]
+            self._param = self._param + [fgMk['param']]
+            self._geo = self._geo + [None]
+            self._bd = numpy.concatenate([self._bd, self._bounds([fgMk])])
+            return self.markings
+        if frPol.disjoint(fgPol) or frPol.touches(fgPol):
+            # same shapes, cached objects and boxes are still valid
+            self.markings = copy.deepcopy(bgMk)
+            self._param = [mk['param'] for mk in self.markings]
+            return self.markings
+        if frPol.overlaps(fgPol):
+            # partial of foreground is outside of frame
+            fgPol = frPol.intersection(fgPol)
+
+        # only markings whose box meets foreground box can be covered
+        x0, y0, x1, y1 = fgPol.bounds
+        bd = self._bd
+        with numpy.errstate(invalid='ignore'):
+            near = (bd[:, 0] <= x1) & (bd[:, 2] >= x0) & (bd[:, 1] <= y1) & (bd[:, 3] >= y0)
+
+        resMk, resGeo, resBd = [], [], []
+        for i, mk in enumerate(bgMk):
+            if mk['type'] != 'polygon':
+                # only polygon can be covered
+                resMk.append(mk)
+                resGeo.append(None)
+                resBd.append(bd[i])
+                continue
+            if not near[i]:
+                # completely isolate
+                resMk.append(dict(mk, param=_closed(mk['param']), type='polygon'))
+                resGeo.append(self._geo[i])
+                resBd.append(bd[i])
+                continue
+
+            bgPol = self._geometry(i)
+            obj_cp = None  # object that needs copy
+            if fgPol.disjoint(bgPol) or fgPol.touches(bgPol):
+                # completely isolate or outer_cut
+                obj_cp = bgPol
+            elif fgPol.contains(bgPol):
+                # foreground cover background completely
+                obj_cp = fgPol
+            else:
+                obj_cp = bgPol.difference(fgPol)
+                pixelMetrics.count('shapely.difference')
+
+            if isinstance(obj_cp, Polygon):
+                obj_cp = [obj_cp]
+            for geo in getattr(obj_cp, 'geoms', obj_cp):
+                if not isinstance(geo, Polygon) or geo.is_empty:
+                    continue
+                item = _polygon(mk, geo)
+                resMk.append(item)
+                resGeo.append(bgPol if geo is bgPol else None)
+                resBd.append(bd[i] if geo is bgPol else self._bounds([item])[0])
+        resMk.append(dict(fgMk))
+        resGeo.append(None)
+        resBd.append(self._bounds([resMk[-1]])[0])
+
+        self.markings = resMk
+        self._param = [mk['param'] for mk in resMk]
+        self._geo = resGeo
+        self._bd = numpy.array(resBd).reshape(-1, 4)
+        return resMk
@@ -0,0 +1,344 @@
+"""
+Augment every LabelMe pair of a directory with a chain of PixelFactory ops
+
+An op is a dict with key `op`, the rest are its parameters
+
+    {'op': 'copyPaste', 'label': 'WeiLong.*', 'n': 10, 'overlap': 0.0,
+        'within': 1.0, 'degree': [-30, 30], 'exclusive': False, 'sampler': 'random'}
+        copy one polygon whose label matches `label`, mask it, rotate it by
+        a random degree in `degree` if given, and paste it `n` times at
+        positions that pass `constrainsCheck`, and also do not break
+        constrains of one another if `exclusive`. `sampler` of `raster`
+        takes positions from free space of an occupancy grid, for crowded
+        images
+    {'op': 'pasteBank', 'src': 'objs', 'label': 'WeiLong.*', 'n': 10,
+        'overlap': 0.0, 'within': 1.0, 'degree': [-30, 30], 'cacheDir': None,
+        'area': [2000, 20000], 'db': None}
+        same as `copyPaste`, but objects are drawn from the LabelMe files of
+        folder `src` through an `ObjectBank`, so each object is cut once per
+        worker, or once at all with `cacheDir`. With `area` or `db`, objects
+        are selected by a `pixelIndex.ShapeIndex` of `src`, only those whose
+        area is within `area`, and the index is kept in SQLite file `db`
+        between runs
+    {'op': 'noise', 'snr': 0.98, 'n_type': 'bw'}
+    {'op': 'masking', 'alpha': 0}
+        make pixels outside of markings transparent
+
+Every random choice of the ops is made first, as a plan of `pixelPlan`,
+then the plan is run, so a pair can be replayed from its plan alone.
+The image is embedded into the output json as `imageData` unless the
+pipeline runs with `embed=False`, then the json only refers to the jpg next
+to it. With `metrics`, every pair is instrumented by `pixelMetrics` and the
+summary of the run is written to that path, json or prometheus text.
+With `fmt='shard'`, samples are written as raw pixels and columnar markings
+in shards of `pixelShard` instead, every worker appends to its own shards.
+With `encoders`, writing runs in processes of its own, and pairs are handed
+to them in shared memory of `pixelShm` instead of being pickled
+"""
+import argparse
+import json
+import os
+import numpy
+from concurrent.futures import wait, FIRST_COMPLETED
+from typing import List, Dict, Tuple
+from PIL import Image
+from pixelFactory import PixelFactory
+import pixelIO
+import pixelPlan
+import pixelMetrics
+from pixelShard import ShardWriter
+from pixelShm import SharedSample
+
+
+_writer = None  # ShardWriter of a worker process
+
+
+def _writerOf(dstDir: str) -> ShardWriter:
+    global _writer
+    if _writer is None or _writer.dstDir != dstDir:
+        if _writer is not None:
+            _writer.close()
+        _writer = ShardWriter(dstDir)
+    return _writer
+
+
+def augment(px: Image.Image, mk: List[Dict], ops: List[Dict], rng=None,
+    pf: PixelFactory = None) -> Tuple:
+    """
+    apply chain of ops on image and markings. Return final image and markings
+
+    Parameter
+    ---------
+    ops
+        list of ops, see module document
+    rng
+        a numpy.random.Generator, or a seed
+    """
+    # markings of the plan are reused, pastes are not occluded twice
+    steps, planned = pixelPlan.makePlan(mk, px.size, ops, rng, pf, markings=True)
+    return pixelPlan.runPlan(px, mk, steps, pf, planned)
+
+
+def _measured(metrics: bool, fn, *args) -> Tuple:
+    # return result of `fn`, and metrics snapshot of it if instrumented
+    prev = pixelMetrics.active()
+    col = pixelMetrics.enable() if metrics else None
+    try:
+        res = fn(*args)
+    finally:
+        if col is not None and prev is not None:
+            pixelMetrics.enable(prev)
+        elif col is not None:
+            pixelMetrics.disable()
+    return (res, col.snapshot() if col is not None else None)
+
+
+def _process(job: Tuple):
+    # encoding job of `_encode` if the pair is handed over, otherwise None
+    name, pxPath, mkPath, dstDir, ops, seed, steps, embed, metrics, fmt, shared = job
+    px, jData, mk = pixelIO.loadLabelMe(pxPath, mkPath)
+    planned = None
+    if steps is None:
+        steps, planned = pixelPlan.makePlan(mk, px.size, ops, seed, markings=True)
+    if not shared:
+        px, mk = pixelPlan.runPlan(px, mk, steps, planned=planned)
+        if fmt == 'shard':
+            _writerOf(dstDir).add(name, px, mk)
+        else:
+            pixelIO.dumpLabelMe(px, jData, mk, dstDir, name, embed=embed)
+        return None
+
+    # ops write the shared pixels in place, the encoder reads them from there
+    sample = SharedSample.create(px.size)
+    try:
+        sample.array[...] = numpy.asarray(px)
+        px = None
+        mk = pixelPlan.runPlan(sample.array, mk, steps, planned=planned)[1]
+        handle = sample.share(mk)
+    except BaseException:
+        SharedSample.discard(sample.handle)
+        raise
+    sample.detach()
+    return (name, handle, jData, dstDir, embed, metrics, fmt)
+
+
+def _work(job: Tuple) -> Tuple:
+    # return name of the pair, metrics snapshot of it if instrumented, and
+    # encoding job if the pair is handed over in shared memory
+    enc, snap = _measured(job[8], _process, job)
+    return (job[0], snap, enc)
+
+
+def _write(job: Tuple):
+    name, handle, jData, dstDir, embed, metrics, fmt = job
+    with SharedSample.attach(handle) as sample:
+        mk = sample.markings()
+        if fmt == 'shard':
+            _writerOf(dstDir).add(name, sample.array, mk)
+        else:
+            px = Image.fromarray(sample.array, 'RGBA')
+            pixelIO.dumpLabelMe(px, jData, mk, dstDir, name, embed=embed)
+            px = None
+        mk = None
+
+
+def _encode(job: Tuple) -> Tuple:
+    # write a pair handed over by `_work`, its shared memory is released
+    # whether writing succeeds or not
+    return (job[0], _measured(job[5], _write, job)[1])
+
+
+class Pipeline:
+    def __init__(self, ops: List[Dict], workers=None, maxInFlight=None, seed=None,
+        embed=True, metrics: str = None, fmt='labelme', encoders=0):
+        """
+        Parameter
+        ---------
+        ops
+            list of ops, see module document
+        workers
+            number of worker processes, default to number of cpu. If 0,
+            pairs are processed in this process
+        maxInFlight
+            maximum pairs submitted but not finished, keeps memory flat on
+            large dataset. Default to 2 * workers
+        seed
+            seed of the run, each pair gets its own stream derived from it
+        embed
+            if false, output json has null `imageData` and refers to the
+            jpg written next to it
+        metrics
+            path of metrics summary of a run, prometheus text if it ends
+            with `.prom`, json otherwise. Summary of last run is also kept
+            in `collector`
+        fmt
+            `labelme` writes jpg and json of every pair, `shard` writes
+            shards readable by `pixelShard.ShardDataset`
+        encoders
+            number of processes writing outputs. If not 0, workers decode
+            and augment into shared memory of `pixelShm`, and only its
+            handle is passed to an encoder, so jpeg, json or shard writing
+            runs beside augmenting without copying pixels between
+            processes. Ignored if `workers` is 0
+        """
+        if fmt not in ('labelme', 'shard'):
+            raise Exception('Format {} not supported'.format(fmt))
+        self.ops = ops
+        self.workers = os.cpu_count() if workers is None else workers
+        self.maxInFlight = maxInFlight or 2 * max(1, self.workers)
+        self.seed = seed
+        self.embed = embed
+        self.metrics = metrics
+        self.collector = None
+        self.fmt = fmt
+        self.encoders = encoders if self.workers else 0
+
+    def _jobs(self, srcDir: str, dstDir: str, pxExt, mkExt):
+        seeds = numpy.random.SeedSequence(self.seed)
+        for name, pxPath, mkPath in pixelIO.scanPairs(srcDir, pxExt, mkExt):
+            yield (name, pxPath, mkPath, dstDir, self.ops, seeds.spawn(1)[0], None, self.embed,
+                self.metrics is not None, self.fmt, self.encoders > 0)
+
+    def _done(self, res: Tuple) -> str:
+        name, snap = res[:2]
+        if snap is not None:
+            self.collector.merge(snap)
+        return name
+
+    def run(self, srcDir: str, dstDir: str, pxExt=('jpg', 'jpeg', 'png', 'bmp'),
+        mkExt=('json', )):
+        """
+            generator operation
+            process every pair in `srcDir` and write result to `dstDir`,
+            yield name of every finished pair
+
+            Usage
+            -----
+                for name in Pipeline(ops).run(src, dst):
+                    print(name)
+        """
+        yield from self._runJobs(dstDir, self._jobs(srcDir, dstDir, pxExt, mkExt))
+
+    def runPlans(self, plans, dstDir: str):
+        """
+            generator operation
+            run plans of `pixelPlan` instead of `ops`, e.g. plans made
+            ahead by `pixelPlan.planDir`, yield name of every finished pair
+        """
+        jobs = ((plan['name'], plan['pxPath'], plan['mkPath'], dstDir, None, None,
+            plan['steps'], self.embed, self.metrics is not None, self.fmt, self.encoders > 0)
+            for plan in plans)
+        yield from self._runJobs(dstDir, jobs)
+
+    def _runJobs(self, dstDir: str, jobs):
+        os.makedirs(dstDir, exist_ok=True)
+        self.collector = pixelMetrics.Collector() if self.metrics is not None else None
+        yield from self._run(jobs)
+        if self.collector is not None:
+            self.collector.dump(self.metrics)
+
+    def _run(self, jobs):
+        if self.workers == 0:
+            for job in jobs:
+                yield self._done(_work(job))
+            return
+
+        # loaded here, in-process runs do not need multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        if self.encoders:
+            yield from self._runShared(jobs, ProcessPoolExecutor)
+            return
+        with ProcessPoolExecutor(self.workers) as ex:
+            pending = set()
+            for job in jobs:
+                if len(pending) >= self.maxInFlight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        yield self._done(fut.result())
+                pending.add(ex.submit(_work, job))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield self._done(fut.result())
+
+
+    def _runShared(self, jobs, Executor):
+        pending = set()
+        handles = {}  # encoding future -> handle of shared memory it releases
+        try:
+            with Executor(self.workers) as ex, Executor(self.encoders) as enc:
+                try:
+                    for job in jobs:
+                        while len(pending) >= self.maxInFlight:
+                            yield from self._collect(pending, handles, enc)
+                        pending.add(ex.submit(_work, job))
+                    while pending:
+                        yield from self._collect(pending, handles, enc)
+                except BaseException:
+                    for fut in pending:
+                        fut.cancel()
+                    raise
+        finally:
+            # every process has stopped, shared memory of pairs handed over
+            # but not written is removed
+            for fut in pending:
+                if fut in handles:
+                    SharedSample.discard(handles[fut])
+                elif not fut.cancelled() and fut.exception() is None and fut.result()[2]:
+                    SharedSample.discard(fut.result()[2][1])
+
+    def _collect(self, pending: set, handles: Dict, enc):
+        # hand augmented pairs over to encoders, yield names of written pairs
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            pending.discard(fut)
+            handle = handles.pop(fut, None)
+            if handle is not None and fut.exception() is not None:
+                # encoder died before releasing it
+                SharedSample.discard(handle)
+            res = fut.result()
+            if handle is not None or res[2] is None:
+                yield self._done(res)
+                continue
+            if res[1] is not None:
+                self.collector.merge(res[1])
+            try:
+                nxt = enc.submit(_encode, res[2])
+            except BaseException:
+                SharedSample.discard(res[2][1])
+                raise
+            handles[nxt] = res[2][1]
+            pending.add(nxt)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='augment a directory of LabelMe files')
+    parser.add_argument('src', help='source folder')
+    parser.add_argument('dst', help='output folder')
+    parser.add_argument('--ops', required=True, help='json file of op list')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--in-flight', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--sidecar', action='store_true',
+        help='do not embed image into json, refer to the jpg instead')
+    parser.add_argument('--format', default='labelme', choices=['labelme', 'shard'],
+        help='write jpg and json of every pair, or shards of raw pixels and markings')
+    parser.add_argument('--metrics', default=None,
+        help='write metrics summary of the run, .prom for prometheus text, json otherwise')
+    parser.add_argument('--encoders', type=int, default=0,
+        help='processes writing outputs, pairs are handed over in shared memory')
+    args = parser.parse_args(argv)
+
+    with open(args.ops) as f:
+        ops = json.load(f)
+    cnt = 0
+    for _ in Pipeline(
+        ops, args.workers, args.in_flight, args.seed, not args.sidecar,
+        args.metrics, args.format, args.encoders).run(args.src, args.dst):
+        cnt += 1
+    print('{} pairs processed'.format(cnt))
+    return cnt
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+import math
+import numpy
+from typing import Union, List, Dict, Tuple
+import pixelEllipse
+
+
+def markingBounds(mk: List[Dict]) -> numpy.ndarray:
+    """
+    bounding box of every marking, an array of [x_min, y_min, x_max, y_max]
+    """
+    return numpy.array([
+        pixelEllipse.bounds(item) if item['type'] in pixelEllipse.ELLIPSES else
+        numpy.concatenate([
+            numpy.min(numpy.reshape(item['param'], (-1, 2)), axis=0),
+            numpy.max(numpy.reshape(item['param'], (-1, 2)), axis=0)])
+        for item in mk
+    ], dtype=float).reshape(-1, 4)
+
+
+def _shoelace(pts: numpy.ndarray) -> float:
+    pts = numpy.reshape(pts, (-1, 2))
+    x, y = pts[:, 0], pts[:, 1]
+    return abs(numpy.dot(x, numpy.roll(y, -1)) - numpy.dot(y, numpy.roll(x, -1))) / 2.0
+
+
+def _dilate(occ: numpy.ndarray) -> numpy.ndarray:
+    # mark the 8 neighbours of every marked cell
+    res = occ.copy()
+    res[1:] |= occ[:-1]
+    res[:-1] |= occ[1:]
+    tmp = res.copy()
+    res[:, 1:] |= tmp[:, :-1]
+    res[:, :-1] |= tmp[:, 1:]
+    return res
+
+
+class FreeSpace:
+    """
+    occupancy grid of constrains, a cell of `cell` x `cell` pixels is marked
+    if any constrain may touch it. A foreground whose bounding box only
+    covers free cells meets no constrain at all, so it passes any `overlap`
+    without shapely. With a summed-area table of the grid, cells covered by
+    the bounding box are counted for every position at once, so all free
+    positions are found in one pass, however full the image is
+
+    Usage
+    -----
+        space = FreeSpace(csts)
+        pos = space.sample(markingBounds(fgMk), 10, rng)
+    """
+    _CELLS = 1 << 20  # cells of the grid when `cell` is not given
+
+    def __init__(self, csts: 'PreparedCsts', cell: int = None):
+        """
+        Parameter
+        ---------
+        csts
+            prepared constrains, see `PreparedCsts`
+        cell
+            size of a cell in pixels, default to the smallest that keeps
+            the grid within about a million cells
+        """
+        import shapely
+        from PIL import Image, ImageDraw
+        fx0, fy0, fx1, fy1 = csts.fram.bounds
+        if cell is None:
+            cell = max(1, int(math.ceil(math.sqrt((fx1 - fx0) * (fy1 - fy0) / self._CELLS))))
+        self.cell = cell
+        self.origin = numpy.array([fx0, fy0])
+        # cells partly out of frame are left out of the grid
+        w, h = max(int((fx1 - fx0) // cell), 0), max(int((fy1 - fy0) // cell), 0)
+        mask = Image.new('L', (w, h))
+        draw = ImageDraw.Draw(mask)
+        kind, geoms = csts.geometries()
+        for k, geo in zip(kind, geoms):
+            flat = ((shapely.get_coordinates(geo.exterior if k == csts.POLY else geo)
+                - self.origin) / cell).flatten().tolist()
+            if k == csts.POLY:
+                draw.polygon(flat, fill=1, outline=1)
+            elif k == csts.LINE:
+                draw.line(flat, fill=1)
+            else:
+                draw.point(flat, fill=1)
+        # PIL rounds vertices, a cell of margin keeps the grid conservative
+        self.occ = _dilate(numpy.asarray(mask, dtype=bool))
+        self._sat = None
+
+    def _table(self) -> numpy.ndarray:
+        # summed-area table, sat[i, j] is the number of marked cells above
+        # and left of cell (i, j)
+        if self._sat is None:
+            h, w = self.occ.shape
+            self._sat = numpy.zeros((h + 1, w + 1), dtype=numpy.int32)
+            numpy.cumsum(numpy.cumsum(self.occ, axis=0, dtype=numpy.int32), axis=1,
+                out=self._sat[1:, 1:])
+        return self._sat
+
+    def _span(self, bound: Tuple) -> Tuple:
+        # cells covered by a box of `bound` whose top left lies anywhere in
+        # a cell
+        return (int((bound[2] - bound[0]) // self.cell) + 2,
+            int((bound[3] - bound[1]) // self.cell) + 2)
+
+    def counts(self, bound: Tuple) -> numpy.ndarray:
+        """
+        number of marked cells covered by a foreground of `bound`, (x0, y0,
+        x1, y1) in its own coordinate, for every cell its top left corner
+        may lie in. Positions whose box leaves the grid are not included
+        """
+        kw, kh = self._span(bound)
+        h, w = self.occ.shape
+        if kw > w or kh > h:
+            return numpy.zeros((0, 0), dtype=numpy.int32)
+        sat = self._table()
+        return (sat[kh:, kw:] - sat[: h + 1 - kh, kw:] - sat[kh:, : w + 1 - kw]
+            + sat[: h + 1 - kh, : w + 1 - kw])
+
+    def position(self, bound: Tuple, i: int, j: int, rng) -> Tuple:
+        """
+        random integer position whose box of `bound` has its top left in
+        cell (i, j)
+        """
+        u = rng.integers(0, self.cell, 2)
+        return (int(math.ceil(self.origin[0] + j * self.cell - bound[0])) + int(u[0]),
+            int(math.ceil(self.origin[1] + i * self.cell - bound[1])) + int(u[1]))
+
+    def occupy(self, bound: Tuple):
+        """
+        mark cells of a box, (x0, y0, x1, y1) in image coordinate
+        """
+        a = numpy.floor((numpy.asarray(bound[:2]) - self.origin) / self.cell).astype(int)
+        b = numpy.floor((numpy.asarray(bound[2:]) - self.origin) / self.cell).astype(int)
+        self.occ[max(a[1], 0): max(b[1] + 1, 0), max(a[0], 0): max(b[0] + 1, 0)] = True
+        self._sat = None
+
+    def sample(self, bound: Tuple, n: int, rng=None, exclusive=False) -> List[Tuple]:
+        """
+        up to `n` random positions where a foreground of `bound` covers free
+        cells only. If `exclusive`, boxes of returned positions do not share
+        cells, and their cells are marked
+        """
+        rng = numpy.random.default_rng(rng)
+        free = self.counts(bound) == 0
+        if not exclusive:
+            cand = numpy.flatnonzero(free)
+            pick = rng.choice(cand, min(n, len(cand)), replace=False)
+            return [self.position(bound, *divmod(int(k), free.shape[1]), rng) for k in pick]
+
+        kw, kh = self._span(bound)
+        res = []
+        while len(res) < n:
+            cand = numpy.flatnonzero(free)
+            if not len(cand):
+                break
+            i, j = divmod(int(cand[rng.integers(len(cand))]), free.shape[1])
+            p = self.position(bound, i, j, rng)
+            res.append(p)
+            self.occupy((p[0] + bound[0], p[1] + bound[1], p[0] + bound[2], p[1] + bound[3]))
+            # boxes of positions that meet the marked cells are not free
+            a = numpy.floor((numpy.asarray(p) + bound[:2] - self.origin) / self.cell).astype(int)
+            b = numpy.floor((numpy.asarray(p) + bound[2:] - self.origin) / self.cell).astype(int)
+            free[max(a[1] - kh + 1, 0): b[1] + 1, max(a[0] - kw + 1, 0): b[0] + 1] = False
+        return res
+
+
+def findPlacements(fgMk: Union[Dict, List[Dict]], csts: 'PreparedCsts', n: int,
+    overlap=0.0, within=1.0, rng=None, batch=1024, maxTrials=None, exclusive=False,
+    sampler='random', cell: int = None) -> List[Tuple]:
+    """
+    search up to `n` positions where `fgMk` can be pasted without breaking
+    constrains. Return a list of (x, y) tuples accepted by `PixelFactory.pasteRegion`
+
+    Candidates are drawn in batches. Their bounding boxes are compared with
+    bounding boxes of all constrains and the frame at once, candidates that
+    clearly pass are accepted without touching shapely, the rest are
+    checked exactly by `csts`. Positions are checked independently of each
+    other, not against one another, unless `exclusive`.
+
+    Parameter
+    ---------
+    fgMk
+        one or a list of foreground markings, in coordinate of the foreground
+    csts
+        prepared constrains, see `PreparedCsts`
+    rng
+        a numpy.random.Generator, or a seed
+    batch
+        number of candidates evaluated at once
+    maxTrials
+        number of candidates drawn before giving up, default to 100 * n
+    exclusive
+        if true, markings at every accepted position are added to `csts`,
+        so later positions are also checked against them
+    sampler
+        `random` draws candidates uniformly from the range of positions.
+        `raster` takes positions from the free cells of a `FreeSpace`
+        first, which need no check, then checks the positions that cover
+        fewest marked cells exactly, so a nearly full image is still fast
+    cell
+        cell size of the `FreeSpace` of `raster`
+    """
+    if isinstance(fgMk, dict):
+        fgMk = [fgMk]
+    rng = numpy.random.default_rng(rng)
+    if maxTrials is None:
+        maxTrials = max(1000, 100 * n)
+
+    mkBd = markingBounds(fgMk)                     # m x 4
+    mkArea = numpy.array([
+        _shoelace(item['param']) if item['type'] == 'polygon' else
+        pixelEllipse.area(item) if item['type'] in pixelEllipse.ELLIPSES else 0.0
+        for item in fgMk])
+    x0, y0 = mkBd[:, :2].min(axis=0)
+    x1, y1 = mkBd[:, 2:].max(axis=0)
+    fx0, fy0, fx1, fy1 = csts.fram.bounds
+
+    # range of positions, the whole foreground in frame when `within` is 1
+    if within >= 1:
+        lo = numpy.ceil([fx0 - x0, fy0 - y0])
+        hi = numpy.floor([fx1 - x1, fy1 - y1])
+    else:
+        lo = numpy.ceil([fx0 - x1, fy0 - y1])
+        hi = numpy.floor([fx1 - x0, fy1 - y0])
+    if (hi < lo).any():
+        return []
+
+    res = []
+    trials = 0
+    if sampler == 'raster':
+        res, trials = _rasterPlacements(fgMk, csts, n, overlap, within, rng, maxTrials,
+            exclusive, cell, (x0, y0, x1, y1))
+        if within >= 1:
+            # positions out of the grid are out of frame
+            return res
+    elif sampler != 'random':
+        raise Exception('Sampler {} not supported'.format(sampler))
+    while len(res) < n and trials < maxTrials:
+        k = min(batch, maxTrials - trials)
+        trials += k
+        pos = rng.integers(lo, hi, size=(k, 2), endpoint=True)
+        cstBd = csts.bounds
+        # limit memory of candidate-constrain matrix
+        step = max(1, (1 << 22) // max(1, len(cstBd)))
+
+        # bounding box of every marking at every candidate, k x m x 4
+        bd = mkBd[None, :, :] + numpy.tile(pos, 2)[:, None, :]
+
+        # area of marking bounding box inside frame is an upper bound of
+        # marking area inside frame
+        iw = numpy.clip(numpy.minimum(bd[..., 2], fx1) - numpy.maximum(bd[..., 0], fx0), 0, None)
+        ih = numpy.clip(numpy.minimum(bd[..., 3], fy1) - numpy.maximum(bd[..., 1], fy0), 0, None)
+        keep = ~(iw * ih < within * mkArea[None, :]).any(axis=1)
+        inFrame = ((bd[..., 0] >= fx0) & (bd[..., 1] >= fy0)
+            & (bd[..., 2] <= fx1) & (bd[..., 3] <= fy1)).all(axis=1)
+
+        # candidates whose union bounding box meets no constrain
+        clear = numpy.ones(k, dtype=bool)
+        ub = numpy.concatenate([bd[..., :2].min(axis=1), bd[..., 2:].max(axis=1)], axis=1)
+        for i in range(0, len(cstBd), step):
+            c = cstBd[i: i + step]
+            clear &= ~((ub[:, None, 0] <= c[None, :, 2]) & (ub[:, None, 2] >= c[None, :, 0])
+                & (ub[:, None, 1] <= c[None, :, 3]) & (ub[:, None, 3] >= c[None, :, 1])).any(axis=1)
+
+        for j in numpy.flatnonzero(keep):
+            p = pos[j]
+            if not (clear[j] and inFrame[j]):
+                if not all(csts.check(
+                    {'param': numpy.asarray(item['param']) + p, 'type': item['type']},
+                    overlap, within) for item in fgMk
+                ):
+                    continue
+            res.append((int(p[0]), int(p[1])))
+            if exclusive:
+                for item in fgMk:
+                    csts.add({'param': numpy.asarray(item['param']) + p, 'type': item['type']})
+                # later candidates of the batch may meet the added markings
+                clear &= ~((ub[:, 0] <= ub[j, 2]) & (ub[:, 2] >= ub[j, 0])
+                    & (ub[:, 1] <= ub[j, 3]) & (ub[:, 3] >= ub[j, 1]))
+            if len(res) == n:
+                break
+    return res
+
+
+def _rasterPlacements(fgMk: List[Dict], csts: 'PreparedCsts', n: int, overlap, within, rng,
+    maxTrials: int, exclusive: bool, cell: int, bound: Tuple) -> Tuple:
+    # positions of the `raster` sampler, and number of exact checks done
+    space = FreeSpace(csts, cell)
+    res = space.sample(bound, n, rng, exclusive)
+    if exclusive:
+        for p in res:
+            for item in fgMk:
+                csts.add({'param': numpy.asarray(item['param']) + p, 'type': item['type']})
+    if len(res) == n:
+        return (res, 0)
+
+    # the grid is conservative, boxes on few marked cells may still pass,
+    # fewest first, ties in random order
+    cnt = space.counts(bound)
+    order = rng.permutation(cnt.size)
+    order = order[numpy.argsort(cnt.ravel()[order], kind='stable')]
+    order = order[cnt.ravel()[order] > 0][: maxTrials]
+    trials = 0
+    for k in order:
+        if len(res) == n:
+            break
+        trials += 1
+        i, j = divmod(int(k), cnt.shape[1])
+        p = numpy.array(space.position(bound, i, j, rng))
+        # positions taken meanwhile are in `csts`, the exact check sees them
+        mk =[{'param': numpy.asarray(item['param']) + p, 'type': item['type']} for item in fgMk]
+        if not all(csts.check(item, overlap, within) for item in mk):
+            continue
+        res.append((int(p[0]), int(p[1])))
+        if exclusive:
+            for item in mk:
+                csts.add(item)
+    return (res, trials)
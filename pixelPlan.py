@@ -0,0 +1,288 @@
+"""
+Augmentation plans, every random choice of a chain of ops made up front
+
+A plan of a sample is a list of steps, one per op, with everything random
+resolved, e.g.
+
+    {'op': 'copyPaste', 'index': 3, 'degree': 12.5, 'pos': [[40, 17], [90, 60]]}
+    {'op': 'pasteBank', 'mkPath': 'objs/a.json', 'idx': 0, 'degree': None,
+        'pos': [[5, 8]], 'cacheDir': None}
+    {'op': 'noise', 'snr': 0.98, 'n_type': 'bw', 'seed': 8149021}
+    {'op': 'masking', 'alpha': 0}
+
+Plans are made from markings and image size only, no image is decoded, so
+plans of a whole dataset are cheap to make in bulk and to store. Running a
+plan, on any worker and at any time, gives the same image and markings
+
+    python pixelPlan.py plan imgs --ops ops.json --seed 1 -o plans.jsonl
+    python pixelPlan.py run plans.jsonl out --name img0
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import numpy
+from typing import List, Dict, Tuple
+from PIL import Image
+from pixelFactory import PixelFactory
+from pixelBank import ObjectBank
+from pixelIndex import ShapeIndex
+import pixelIO
+
+# PixelFactory, ObjectBank and ShapeIndex of every worker. `pixelAsync`
+# runs plans on a thread pool, none of them is thread safe, and a sqlite
+# connection can only be used by the thread that opened it
+_local = threading.local()
+
+
+def _factory() -> PixelFactory:
+    pf = getattr(_local, 'pf', None)
+    if pf is None:
+        pf = _local.pf = PixelFactory()
+    return pf
+
+
+def _bankOf(cacheDir: str = None) -> ObjectBank:
+    bank = getattr(_local, 'bank', None)
+    if bank is None or bank.cacheDir != cacheDir:
+        bank = _local.bank = ObjectBank(cacheDir, pf=_factory())
+    return bank
+
+
+def _indexOf(src: str, db: str = None) -> ShapeIndex:
+    # built once per thread, a persistent `db` only parses changed files
+    indexes = getattr(_local, 'indexes', None)
+    if indexes is None:
+        indexes = _local.indexes = {}  # (db, folder) -> ShapeIndex
+    index = indexes.get((db, src))
+    if index is None:
+        index = indexes[(db, src)] = ShapeIndex(db or ':memory:')
+        index.build(src)
+    return index
+
+
+def _placements(pf: PixelFactory, mk: List[Dict], cutMk: Dict, imgSize: Tuple, rng, n,
+    overlap, within, degree, exclusive, sampler) -> Tuple:
+    # rotation degree, positions, and markings after pasting
+    deg = None
+    if degree is not None:
+        deg = float(rng.uniform(degree[0], degree[1]))
+        cutMk = pf._algo.rotateMarkings([cutMk], deg)[3][0]
+    csts = pf.prepareCsts(mk, (0, 0, imgSize[0], imgSize[1]))
+    pos = pf.findPlacements(cutMk, csts, None, n, overlap, within, rng, exclusive, sampler)
+    fgMk = [[pf._algo.translate(cutMk, p)] for p in pos]
+    return (deg, [list(p) for p in pos], pf._pasteManyPolys(mk or [], fgMk, imgSize))
+
+
+def _planCopyPaste(pf: PixelFactory, mk: List[Dict], imgSize: Tuple, rng, label='.*', n=1,
+    overlap=0.0, within=1.0, degree=None, exclusive=False, sampler='random') -> Tuple:
+    pat = re.compile(label)
+    src = [i for i, item in enumerate(mk)
+        if item['type'] == 'polygon' and pat.match(str(item.get('label', '')))]
+    if not src:
+        return (None, mk)
+    i = int(src[rng.integers(len(src))])
+    # markings of `copyRegion`, without cutting
+    shf = numpy.array(pf._algo.getBound([mk[i]])[:2])
+    cutMk = pf._algo.translate(mk[i], -shf)
+    deg, pos, mk = _placements(pf, mk, cutMk, imgSize, rng, n, overlap, within, degree,
+        exclusive, sampler)
+    return ({'op': 'copyPaste', 'index': i, 'degree': deg, 'pos': pos}, mk)
+
+
+def _planPasteBank(pf: PixelFactory, mk: List[Dict], imgSize: Tuple, rng, src: str,
+    label='.*', n=1, overlap=0.0, within=1.0, degree=None, cacheDir=None,
+    exclusive=False, area=None, db=None, sampler='random') -> Tuple:
+    bank = _bankOf(cacheDir)
+    if area is not None or db is not None:
+        # polygons the bank can cut, selected by the shape index
+        objs = _indexOf(src, db).select(label, ['polygon'], area, src, minVertices=3)
+    else:
+        pat = re.compile(label)
+        objs = [obj for obj in bank.index(src) if pat.match(str(obj[2]))]
+    if not objs:
+        return (None, mk)
+    mkPath, idx, _ = objs[rng.integers(len(objs))]
+    cutMk = bank.marking(mkPath, idx)
+    deg, pos, mk = _placements(pf, mk, cutMk, imgSize, rng, n, overlap, within, degree,
+        exclusive, sampler)
+    return ({'op': 'pasteBank', 'mkPath': mkPath, 'idx': idx, 'degree': deg, 'pos': pos,
+        'cacheDir': cacheDir}, mk)
+
+
+def makePlan(mk: List[Dict], imgSize: Tuple, ops: List[Dict], rng=None,
+    pf: PixelFactory = None, markings=False):
+    """
+    resolve every random choice of `ops` on an image of `imgSize` with
+    markings `mk`. Return the list of steps
+
+    Parameter
+    ---------
+    ops
+        list of ops, see `pixelPipeline`
+    rng
+        a numpy.random.Generator, or a seed
+    markings
+        if true, return a tuple of steps and markings after every step,
+        which `runPlan` takes as `planned`
+    """
+    pf = pf or _factory()
+    rng = numpy.random.default_rng(rng)
+    imgSize = tuple(imgSize)
+    steps, planned = [], []
+    for op in ops:
+        kw = {k: v for k, v in op.items() if k != 'op'}
+        if op['op'] == 'copyPaste':
+            step, mk = _planCopyPaste(pf, mk, imgSize, rng, **kw)
+        elif op['op'] == 'pasteBank':
+            step, mk = _planPasteBank(pf, mk, imgSize, rng, **kw)
+        elif op['op'] == 'noise':
+            step = dict(op, seed=int(rng.integers(1 << 63)))
+        elif op['op'] == 'masking':
+            step = dict(op)
+        else:
+            raise Exception('Op {} not supported'.format(op['op']))
+        if step is not None:
+            steps.append(step)
+            planned.append(mk)
+    return (steps, planned) if markings else steps
+
+
+def _paste(pf: PixelFactory, px: Image.Image, mk: List[Dict], cutPx: Image.Image,
+    cutMk: Dict, step: Dict, pixelsOnly=False) -> Tuple:
+    if step['degree'] is not None:
+        cutPx, cutMk = pf.rotate(cutPx, [cutMk], step['degree'])
+        cutMk = cutMk[0]
+    if pixelsOnly:
+        return pf.pasteMany(px, None, [(cutPx, None, tuple(p)) for p in step['pos']])
+    return pf.pasteMany(px, mk, [(cutPx, cutMk, tuple(p)) for p in step['pos']])
+
+
+def runPlan(px: Image.Image, mk: List[Dict], steps: List[Dict],
+    pf: PixelFactory = None, planned: List[List[Dict]] = None) -> Tuple:
+    """
+    apply steps of a plan on image and markings. Return final image and
+    markings
+
+    Parameter
+    ---------
+    planned
+        markings after every step, made by `makePlan` with `markings`.
+        Pastes then only touch pixels, markings are not occluded again
+    """
+    pf = pf or _factory()
+    for k, step in enumerate(steps):
+        if step['op'] == 'copyPaste':
+            cutPx, cutMk = pf.copyRegion(px, mk[step['index']])
+            cutPx = pf.masking(cutPx, [cutMk])
+            px, mk = _paste(pf, px, mk, cutPx, cutMk, step, planned is not None)
+        elif step['op'] == 'pasteBank':
+            cutPx, cutMk = _bankOf(step.get('cacheDir')).get(step['mkPath'], step['idx'])
+            px, mk = _paste(pf, px, mk, cutPx, cutMk, step, planned is not None)
+        elif step['op'] == 'noise':
+            px = pf.noise(px, step['snr'], step.get('n_type', 'bw'), step['seed'])
+        elif step['op'] == 'masking':
+            px = pf.masking(px, mk, step.get('alpha', 0))
+        else:
+            raise Exception('Op {} not supported'.format(step['op']))
+        if planned is not None:
+            mk = planned[k]
+    return (px, mk)
+
+
+def imageSize(pxPath: str) -> Tuple:
+    """
+    size of the image after exif orientation, only the header is read
+    """
+    with Image.open(pxPath) as px:
+        size = px.size
+        # same orientations as `pixelIO.exifTranspose` turns
+        if pixelIO.exifRotation(px) in (90, 270):
+            size = size[::-1]
+    return size
+
+
+def planDir(srcDir: str, ops: List[Dict], seed=None, pxExt=('jpg', 'jpeg', 'png', 'bmp'),
+    mkExt=('json', )):
+    """
+        generator operation
+        yield plan of every pair in `srcDir`, a dict of `name`, `pxPath`,
+        `mkPath` and `steps`. Every pair gets its own random stream derived
+        from `seed`, same as `pixelPipeline.Pipeline`
+    """
+    seeds = numpy.random.SeedSequence(seed)
+    for name, pxPath, mkPath in pixelIO.scanPairs(srcDir, pxExt, mkExt):
+        mk = pixelIO.LabelMeFile(mkPath, pxPath).markings()
+        steps = makePlan(mk, imageSize(pxPath), ops, seeds.spawn(1)[0])
+        yield {'name': name, 'pxPath': pxPath, 'mkPath': mkPath, 'steps': steps}
+
+
+def replay(plan: Dict, pf: PixelFactory = None) -> Tuple:
+    """
+    image, LabelMe json data and markings of the sample of `plan`
+    """
+    px, jData, mk = pixelIO.loadLabelMe(plan['pxPath'], plan['mkPath'])
+    px, mk = runPlan(px, mk, plan['steps'], pf)
+    return (px, jData, mk)
+
+
+def savePlans(plans, path: str) -> int:
+    """
+    write plans as json lines. Return number of plans
+    """
+    cnt = 0
+    with open(path, 'w') as f:
+        for plan in plans:
+            f.write(json.dumps(plan) + '\n')
+            cnt += 1
+    return cnt
+
+
+def loadPlans(path: str):
+    """
+        generator operation
+        yield every plan of a json lines file
+    """
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='make or run augmentation plans')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    mkp = sub.add_parser('plan', help='plan every pair of a folder')
+    mkp.add_argument('src', help='source folder')
+    mkp.add_argument('--ops', required=True, help='json file of op list')
+    mkp.add_argument('--seed', type=int, default=None)
+    mkp.add_argument('-o', '--out', required=True, help='json lines file of plans')
+    rnp = sub.add_parser('run', help='run plans, all or only given samples')
+    rnp.add_argument('plans', help='json lines file of plans')
+    rnp.add_argument('dst', help='output folder')
+    rnp.add_argument('--name', nargs='*', default=None, help='names of samples to run')
+    rnp.add_argument('--sidecar', action='store_true',
+        help='do not embed image into json, refer to the jpg instead')
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'plan':
+        with open(args.ops) as f:
+            ops = json.load(f)
+        cnt = savePlans(planDir(args.src, ops, args.seed), args.out)
+        print('{} pairs planned'.format(cnt))
+        return cnt
+    os.makedirs(args.dst, exist_ok=True)
+    cnt = 0
+    for plan in loadPlans(args.plans):
+        if args.name is not None and plan['name'] not in args.name:
+            continue
+        px, jData, mk = replay(plan)
+        pixelIO.dumpLabelMe(px, jData, mk, args.dst, plan['name'], embed=not args.sidecar)
+        cnt += 1
+    print('{} pairs processed'.format(cnt))
+    return cnt
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""
+Sharded raw format of augmented samples, read without decoding
+
+A dataset is a folder of shards, every shard is a folder of append-only
+files
+
+    pixels.bin      uint8, raw pixels of every sample, row by row
+    index.bin       int64 (n, 6), pixel offset, height, width, channels,
+                    first and end marking of every sample
+    vertices.bin    float64 (v, 2), vertices of every marking
+    markings.bin    int64 (m, 5), first and end vertex, index of type in
+                    `MarkingSet.TYPES`, index of label, index of the
+                    marking a hole belongs to or -1
+    labels.txt      label of every label index, one per line
+    names.txt       name of every sample, one per line
+
+A sample is written to the index last, so a shard cut by a crash still
+reads as its complete samples, and a writer reopening it cuts what is
+beyond them. Workers write their own shards, there is no shard shared
+between processes
+
+    w = ShardWriter('out')
+    w.add('img0', px, mk)
+    ds = ShardDataset('out')
+    arr, mk = ds[0]     # numpy.memmap views
+"""
+import os
+import numpy
+from typing import List, Dict, Tuple
+from PIL import Image
+from pixelMarking import MarkingSet
+
+_INDEX = 6
+_MARKING = 5
+
+
+class ShardWriter:
+    def __init__(self, dstDir: str, prefix: str = None, maxBytes=1 << 30):
+        """
+        Parameter
+        ---------
+        prefix
+            name prefix of shards of this writer, default to the process id
+        maxBytes
+            pixel bytes of a shard before a new shard is started
+        """
+        self.dstDir = dstDir
+        self.prefix = prefix if prefix is not None else str(os.getpid())
+        self.maxBytes = maxBytes
+        self._shard = -1
+        self._files = None
+        os.makedirs(dstDir, exist_ok=True)
+
+    def _open(self):
+        # start next shard of this writer
+        self.close()
+        self._shard += 1
+        path = os.path.join(self.dstDir, '{}-{:05d}'.format(self.prefix, self._shard))
+        os.makedirs(path, exist_ok=True)
+        self._repair(path)
+        self._files = {k: open(os.path.join(path, k), 'ab') for k in (
+            'pixels.bin', 'index.bin', 'vertices.bin', 'markings.bin', 'labels.txt', 'names.txt')}
+        self._nPx = self._files['pixels.bin'].tell()
+        self._nVtx = self._files['vertices.bin'].tell() // 16
+        self._nMk = self._files['markings.bin'].tell() // (8 * _MARKING)
+        self._labels = {}
+        with open(os.path.join(path, 'labels.txt')) as f:
+            for lb in f.read().split('\n')[:-1]:
+                self._labels[lb] = len(self._labels)
+
+    @staticmethod
+    def _repair(path: str):
+        # a crash may leave part of an index row, or the name of a sample
+        # not in the index, cut them so samples appended line up with names
+        idx, names = os.path.join(path, 'index.bin'), os.path.join(path, 'names.txt')
+        if not os.path.exists(idx):
+            return
+        n = os.path.getsize(idx) // (8 * _INDEX)
+        with open(idx, 'r+b') as f:
+            f.truncate(n * 8 * _INDEX)
+        if os.path.exists(names):
+            with open(names, 'r+b') as f:
+                for _ in range(n):
+                    f.readline()
+                f.truncate(f.tell())
+
+    def add(self, name: str, px, mk: List[Dict]):
+        """
+        append a sample
+
+        Parameter
+        ---------
+        px
+            a PIL image or a (h, w, c) uint8 numpy array
+        mk
+            markings of the sample, `holes` of polygons are kept
+        """
+        if self._files is None or (self._nPx and self._nPx >= self.maxBytes):
+            self._open()
+        arr = numpy.ascontiguousarray(px if isinstance(px, numpy.ndarray) else numpy.asarray(px))
+        if arr.ndim == 2:
+            arr = arr[:, :, None]
+        f = self._files
+
+        rows, pts = [], []
+        for item in mk:
+            parent = self._nMk + len(rows)
+            for ring, kind, owner in [(item['param'], item['type'], -1)] + [
+                    (hole, 'polygon', parent) for hole in item.get('holes', ())]:
+                ring = numpy.reshape(numpy.asarray(ring, dtype=numpy.float64), (-1, 2))
+                lb = str(item.get('label', ''))
+                if lb not in self._labels:
+                    self._labels[lb] = len(self._labels)
+                    f['labels.txt'].write((lb.replace('\n', ' ') + '\n').encode('utf-8'))
+                rows.append((self._nVtx, self._nVtx + len(ring), MarkingSet.TYPES.index(kind),
+                    self._labels[lb], owner))
+                pts.append(ring)
+                self._nVtx += len(ring)
+
+        f['pixels.bin'].write(arr.data)
+        if pts:
+            f['vertices.bin'].write(numpy.concatenate(pts).tobytes())
+            f['markings.bin'].write(numpy.array(rows, dtype=numpy.int64).tobytes())
+        f['names.txt'].write((name.replace('\n', ' ') + '\n').encode('utf-8'))
+        f['index.bin'].write(numpy.array(
+            [self._nPx, arr.shape[0], arr.shape[1], arr.shape[2], self._nMk, self._nMk + len(rows)],
+            dtype=numpy.int64).tobytes())
+        self._nPx += arr.nbytes
+        self._nMk += len(rows)
+        for k in ('pixels.bin', 'vertices.bin', 'markings.bin', 'labels.txt', 'names.txt',
+                'index.bin'):
+            f[k].flush()
+
+    def close(self):
+        if self._files is not None:
+            for fp in self._files.values():
+                fp.close()
+            self._files = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _map(path: str, dtype, cols: int = None) -> numpy.ndarray:
+    # read-only memmap of a raw file, empty array if the file is empty
+    n = os.path.getsize(path) if os.path.exists(path) else 0
+    width = numpy.dtype(dtype).itemsize * (cols or 1)
+    n -= n % width
+    if not n:
+        return numpy.empty((0, cols) if cols else 0, dtype=dtype)
+    arr = numpy.memmap(path, dtype=dtype, mode='r', shape=(n // width, cols) if cols else n)
+    return arr
+
+
+class Shard:
+    """
+    one shard, every array is a read-only `numpy.memmap`
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.index = _map(os.path.join(path, 'index.bin'), numpy.int64, _INDEX)
+        self.pixels = _map(os.path.join(path, 'pixels.bin'), numpy.uint8)
+        self.vertices = _map(os.path.join(path, 'vertices.bin'), numpy.float64, 2)
+        self.markingTable = _map(os.path.join(path, 'markings.bin'), numpy.int64, _MARKING)
+        with open(os.path.join(path, 'labels.txt'), encoding='utf-8') as f:
+            self.labels = f.read().split('\n')[:-1]
+        with open(os.path.join(path, 'names.txt'), encoding='utf-8') as f:
+            self.names = f.read().split('\n')[: len(self.index)]
+
+    def __len__(self):
+        return len(self.index)
+
+    def image(self, i: int) -> numpy.ndarray:
+        """
+        (h, w, c) pixels of sample i, a view of the shard
+        """
+        off, h, w, c = self.index[i, :4]
+        return self.pixels[off: off + h * w * c].reshape(h, w, c)
+
+    def markings(self, i: int) -> List[Dict]:
+        """
+        markings of sample i, `param` of each is a view of the shard
+        """
+        beg, end = self.index[i, 4:]
+        tab = self.markingTable[beg: end]
+        res, own = [], {}
+        for j, (v0, v1, kind, lb, parent) in enumerate(tab.tolist()):
+            param = self.vertices[v0: v1]
+            if parent >= 0:
+                own[parent].setdefault('holes', []).append(param)
+                continue
+            item = {'param': param[0] if MarkingSet.TYPES[kind] == 'point' else param,
+                'type': MarkingSet.TYPES[kind], 'label': self.labels[lb]}
+            own[beg + j] = item
+            res.append(item)
+        return res
+
+    def markingSet(self, i: int) -> MarkingSet:
+        """
+        markings of sample i as a `MarkingSet` sharing vertices of the
+        shard. Holes are not included
+        """
+        beg, end = self.index[i, 4:]
+        tab = self.markingTable[beg: end]
+        tab = tab[tab[:, 4] < 0]
+        if not len(tab):
+            return MarkingSet(numpy.empty((0, 2)), [0], [], [], self.labels)
+        v0 = tab[0, 0]
+        vtx = self.vertices[v0: tab[-1, 1]]
+        if (tab[1:, 0] != tab[:-1, 1]).any():
+            # holes in between, vertices are no longer contiguous
+            vtx = numpy.concatenate([self.vertices[a: b] for a, b in tab[:, :2]])
+        off = numpy.concatenate([[0], numpy.cumsum(tab[:, 1] - tab[:, 0])])
+        return MarkingSet(vtx, off, tab[:, 2], tab[:, 3], self.labels)
+
+
+class ShardDataset:
+    """
+    all shards of a folder as one sequence of (pixels, markings)
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self.shards = [Shard(os.path.join(root, d)) for d in sorted(os.listdir(root))
+            if os.path.exists(os.path.join(root, d, 'index.bin'))]
+        self._end = numpy.cumsum([len(sh) for sh in self.shards])
+
+    def __len__(self):
+        return int(self._end[-1]) if len(self._end) else 0
+
+    def locate(self, i: int) -> Tuple:
+        """
+        return (shard, index in shard) of sample i
+        """
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        s = int(numpy.searchsorted(self._end, i, side='right'))
+        return (self.shards[s], i - (int(self._end[s - 1]) if s else 0))
+
+    def __getitem__(self, i: int) -> Tuple:
+        sh, j = self.locate(i)
+        return (sh.image(j), sh.markings(j))
+
+    def name(self, i: int) -> str:
+        sh, j = self.locate(i)
+        return sh.names[j]
+
+    def toImage(self, i: int) -> Image.Image:
+        """
+        sample i as a PIL image, copies pixels
+        """
+        arr = self[i][0]
+        return Image.fromarray(arr[:, :, 0] if arr.shape[2] == 1 else numpy.array(arr))
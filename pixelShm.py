@@ -0,0 +1,234 @@
+"""
+Images and markings in shared memory, handed between processes by handle
+
+A `SharedSample` keeps the RGBA pixels of a sample in one block of
+`multiprocessing.shared_memory` and all vertices of its markings in
+another. Its `handle` is a small picklable tuple, so passing a sample to
+another process costs no copy of pixels or vertices, only the names of the
+blocks. PixelFactory ops accept the numpy view `array` directly, and
+`pasteRegion`, `pasteMany`, `noise` and `masking` write it in place
+
+Blocks live until they are unlinked, whichever process does it. The
+process that creates a sample hands it over with `detach`, the process
+that consumes it calls `release`, and `discard` removes the blocks of a
+handle whose consumer never ran
+
+    # producer
+    sample = SharedSample.create(px.size)
+    sample.array[...] = numpy.asarray(px)
+    handle = sample.share(mk)
+    sample.detach()
+    # consumer
+    with SharedSample.attach(handle) as sample:
+        px, mk = sample.array, sample.markings()
+        ...
+"""
+import numpy
+from multiprocessing import shared_memory, resource_tracker
+from typing import List, Dict, Tuple
+
+
+class SharedArray:
+    """
+    numpy array over a block of shared memory
+    """
+    def __init__(self, shape: Tuple, dtype, name: str = None):
+        """
+        Parameter
+        ---------
+        name
+            name of the block to attach, a new block is created if None
+        """
+        self.shape = tuple(int(v) for v in shape)
+        self.dtype = numpy.dtype(dtype)
+        nbytes = int(numpy.prod(self.shape)) * self.dtype.itemsize
+        if name is None:
+            # a block can not be empty
+            self._shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        else:
+            self._shm = shared_memory.SharedMemory(name)
+        self._owner = name is None
+        # the resource tracker of this process unlinks blocks it created or
+        # attached when the process exits, unless they are unlinked before
+        self._tracked = True
+        self.array = numpy.ndarray(self.shape, self.dtype, self._shm.buf[: nbytes])
+
+    @property
+    def handle(self) -> Tuple:
+        return (self._shm.name, self.shape, self.dtype.str)
+
+    @classmethod
+    def attach(cls, handle: Tuple) -> 'SharedArray':
+        name, shape, dtype = handle
+        return cls(shape, dtype, name)
+
+    def close(self):
+        """
+        release the mapping of this process, every view of `array` must be
+        gone by then
+        """
+        if self.array is None:
+            return
+        self.array = None
+        self._shm.close()
+        if self._tracked and not self._owner:
+            # attached block belongs to its owner
+            self._untrack()
+
+    def unlink(self):
+        """
+        remove the block, the memory is freed once every process closed it
+        """
+        self._shm.unlink()  # also untracked
+        self._tracked = False
+
+    def detach(self):
+        """
+        close without unlinking, the block is owned by whoever gets the
+        handle
+        """
+        if self._tracked:
+            self._untrack()
+        self.close()
+
+    def _untrack(self):
+        resource_tracker.unregister(self._shm._name, 'shared_memory')
+        self._tracked = False
+
+    @staticmethod
+    def discard(handle: Tuple):
+        """
+        remove the block of `handle` if it still exists
+        """
+        try:
+            shm = shared_memory.SharedMemory(handle[0])
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
+
+
+class SharedSample:
+    """
+    pixels and markings of one sample in shared memory
+    """
+    def __init__(self, image: SharedArray, vertices: SharedArray = None, meta: List = None):
+        self.image = image
+        self.vertices = vertices
+        self._meta = meta  # markings with vertex ranges in place of arrays
+
+    @property
+    def array(self) -> numpy.ndarray:
+        """
+        (h, w, 4) uint8 pixels
+        """
+        return self.image.array
+
+    @classmethod
+    def create(cls, size: Tuple) -> 'SharedSample':
+        """
+        new sample of RGBA pixels of `size`, (width, height), no markings
+        """
+        return cls(SharedArray((size[1], size[0], 4), numpy.uint8))
+
+    def share(self, mk: List[Dict]) -> Tuple:
+        """
+        copy markings into shared memory, `holes` and other keys are kept.
+        Return the handle of the sample
+        """
+        rings, meta, n = [], [], 0
+        for item in mk:
+            entry = {k: v for k, v in item.items() if k not in ('param', 'holes')}
+            param = numpy.asarray(item['param'], dtype=numpy.float64)
+            entry['param'] = (n, n + len(param.reshape(-1, 2)), param.ndim == 1)
+            n = entry['param'][1]
+            rings.append(param.reshape(-1, 2))
+            if 'holes' in item:
+                entry['holes'] = []
+                for hole in item['holes']:
+                    hole = numpy.asarray(hole, dtype=numpy.float64).reshape(-1, 2)
+                    entry['holes'].append((n, n + len(hole)))
+                    n += len(hole)
+                    rings.append(hole)
+            meta.append(entry)
+        if self.vertices is not None:
+            self.vertices.unlink()
+            self.vertices.close()
+        self.vertices = SharedArray((n, 2), numpy.float64)
+        if rings:
+            numpy.concatenate(rings, out=self.vertices.array)
+        self._meta = meta
+        return self.handle
+
+    @property
+    def handle(self) -> Tuple:
+        return (self.image.handle, self.vertices.handle if self.vertices is not None else None,
+            self._meta)
+
+    @classmethod
+    def attach(cls, handle: Tuple) -> 'SharedSample':
+        image, vertices, meta = handle
+        return cls(SharedArray.attach(image),
+            SharedArray.attach(vertices) if vertices is not None else None, meta)
+
+    def markings(self) -> List[Dict]:
+        """
+        markings of the sample, `param` and `holes` are views of the shared
+        vertices
+        """
+        if self._meta is None:
+            return []
+        vtx = self.vertices.array
+        res = []
+        for entry in self._meta:
+            item = dict(entry)
+            v0, v1, point = entry['param']
+            item['param'] = vtx[v0] if point else vtx[v0: v1]
+            if 'holes' in entry:
+                item['holes'] = [vtx[a: b] for a, b in entry['holes']]
+            res.append(item)
+        return res
+
+    def _blocks(self) -> List[SharedArray]:
+        return [b for b in (self.image, self.vertices) if b is not None]
+
+    def close(self):
+        for b in self._blocks():
+            b.close()
+
+    def detach(self):
+        """
+        hand the sample over to the process that gets `handle`
+        """
+        for b in self._blocks():
+            b.detach()
+
+    def release(self):
+        """
+        unlink and close every block, the sample is gone for all processes
+        """
+        for b in self._blocks():
+            b.unlink()
+        for b in self._blocks():
+            try:
+                b.close()
+            except BufferError:
+                # views still referenced, e.g. by a traceback, the mapping
+                # goes with them
+                pass
+
+    @staticmethod
+    def discard(handle: Tuple):
+        """
+        remove blocks of `handle` that still exist, e.g. of a sample whose
+        consumer failed or never ran
+        """
+        for h in handle[:2]:
+            if h is not None:
+                SharedArray.discard(h)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
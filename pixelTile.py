@@ -0,0 +1,161 @@
+import os
+import tempfile
+import numpy
+from typing import Tuple
+from PIL import Image
+
+
+class TiledImage:
+    """
+    RGBA image stored as raw bytes in a memory mapped file, processed as a
+    grid of `tile` x `tile` tiles. Operations only read and write the tiles
+    that meet the region they affect, so memory in use is bounded by tile
+    size instead of image size. It has `size` and `crop` of a PIL image, so
+    `copyRegion` and `rotate` of PixelFactory accept it as is, while
+    `pasteRegion`, `pasteMany`, `noise` and `masking` write it in place
+
+    Usage
+    -----
+        with TiledImage.fromImage(Image.open('scan.jpg')) as ti:
+            ti, mk = pf.pasteRegion(ti, mk, fg, fgMk, (x, y))
+            ti.toImage().save('out.png')
+    """
+    def __init__(self, path: str, size: Tuple, tile=1024, mode='r+'):
+        """
+        Parameter
+        ---------
+        path
+            raw RGBA file of `size`, row by row
+        size
+            (width, height) of the image
+        mode
+            mode of `numpy.memmap`, `w+` creates the file
+        """
+        self.path = path
+        self.size = (int(size[0]), int(size[1]))
+        self.tile = tile
+        self.mode = 'RGBA'
+        self.array = numpy.memmap(path, dtype=numpy.uint8, mode=mode,
+            shape=(self.size[1], self.size[0], 4))
+        self._own = False  # remove file on close
+
+    @classmethod
+    def create(cls, size: Tuple, path: str = None, tile=1024, color=(0, 0, 0, 0)) -> 'TiledImage':
+        """
+        new image filled with `color`. If `path` is None, the backing file is
+        a temporary file removed on `close`
+        """
+        own = path is None
+        if own:
+            fd, path = tempfile.mkstemp(suffix='.rgba')
+            os.close(fd)
+        ti = cls(path, size, tile, 'w+')
+        ti._own = own
+        if tuple(color) != (0, 0, 0, 0):
+            # new file is zero, fill only if needed
+            for x0, y0, x1, y1 in ti.tiles():
+                ti.array[y0: y1, x0: x1] = color
+        return ti
+
+    @classmethod
+    def fromImage(cls, px: Image.Image, path: str = None, tile=1024) -> 'TiledImage':
+        """
+        copy a PIL image into a new tiled image, one strip of tile rows at a
+        time, so no RGBA copy of the whole image is made
+        """
+        ti = cls.create(px.size, path, tile)
+        for y in range(0, px.size[1], tile):
+            y1 = min(y + tile, px.size[1])
+            ti.array[y: y1] = numpy.asarray(px.crop((0, y, px.size[0], y1)).convert('RGBA'))
+        return ti
+
+    @classmethod
+    def fromArray(cls, arr: numpy.ndarray, tile=1024) -> 'TiledImage':
+        """
+        tiled view of a (h, w, 4) uint8 array, e.g. a block of shared
+        memory. Nothing is copied, there is no backing file
+        """
+        assert arr.ndim == 3 and arr.shape[2] == 4 and arr.dtype == numpy.uint8, \
+            "Array should be (h, w, 4) uint8"
+        ti = cls.__new__(cls)
+        ti.path = None
+        ti.size = (arr.shape[1], arr.shape[0])
+        ti.tile = tile
+        ti.mode = 'RGBA'
+        ti.array = arr
+        ti._own = False
+        return ti
+
+    def tiles(self, bound: Tuple = None):
+        """
+            generator operation
+            yield (x0, y0, x1, y1) of every tile that meets `bound`, default
+            to the whole image
+        """
+        w, h = self.size
+        x0, y0, x1, y1 = bound if bound is not None else (0, 0, w, h)
+        x0, y0 = max(int(x0), 0), max(int(y0), 0)
+        x1, y1 = min(int(numpy.ceil(x1)), w), min(int(numpy.ceil(y1)), h)
+        t = self.tile
+        for ty in range(y0 // t * t, y1, t):
+            for tx in range(x0 // t * t, x1, t):
+                yield (tx, ty, min(tx + t, w), min(ty + t, h))
+
+    def region(self, bound: Tuple) -> numpy.ndarray:
+        """
+        writable (h, w, 4) view of `bound` inside the image
+        """
+        x0, y0, x1, y1 = bound
+        return self.array[y0: y1, x0: x1]
+
+    def crop(self, bound: Tuple) -> Image.Image:
+        """
+        same as `PIL.Image.crop`, area outside of the image is transparent
+        black
+        """
+        x0, y0, x1, y1 = (int(v) for v in bound)
+        out = numpy.zeros((max(y1 - y0, 0), max(x1 - x0, 0), 4), dtype=numpy.uint8)
+        w, h = self.size
+        cx0, cy0, cx1, cy1 = max(x0, 0), max(y0, 0), min(x1, w), min(y1, h)
+        if cx0 < cx1 and cy0 < cy1:
+            out[cy0 - y0: cy1 - y0, cx0 - x0: cx1 - x0] = self.array[cy0: cy1, cx0: cx1]
+        return Image.fromarray(out, 'RGBA')
+
+    def paste(self, fg: Image.Image, pos: Tuple):
+        """
+        paste RGBA `fg` at `pos` using its alpha as mask, tile by tile, same
+        result as `PIL.Image.paste(fg, pos, fg)`
+        """
+        px, py = int(pos[0]), int(pos[1])
+        for x0, y0, x1, y1 in self.tiles((px, py, px + fg.size[0], py + fg.size[1])):
+            view = self.array[y0: y1, x0: x1]
+            sub = Image.fromarray(numpy.array(view), 'RGBA')
+            sub.paste(fg, (px - x0, py - y0), fg)
+            view[...] = numpy.asarray(sub)
+
+    def toImage(self) -> Image.Image:
+        """
+        whole image as a PIL image, for encoding
+        """
+        return Image.fromarray(numpy.array(self.array), 'RGBA')
+
+    def flush(self):
+        if isinstance(self.array, numpy.memmap):
+            self.array.flush()
+
+    def close(self):
+        """
+        release the mapping, and the backing file if it is temporary
+        """
+        if self.array is None:
+            return
+        self.flush()
+        self.array = None  # mapping is released with the last view
+        if self._own:
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,5 +1,6 @@
 import numpy as np
 from pixelFactory import PixelFactory
+from shapely.geometry import Polygon
 from matplotlib import pyplot
 
 # poly = [
@@ -104,6 +105,887 @@ def _pastePolyToPoly_test():
     # pyplot.plot([p[0] for p in f?g.exterior.coords], [p[1] for p in fg.exterior.coords], 'b-')
 
 
+def _preparedCsts_test():
+    rng = np.random.default_rng(0)
+
+    def poly(r):
+        t = np.sort(rng.uniform(0, 2 * np.pi, 6))
+        c = rng.uniform(-20, 520, 2)
+        return {'param': np.c_[c[0] + r * np.cos(t), c[1] + r * np.sin(t)], 'type': 'polygon'}
+
+    bgMk = [poly(rng.uniform(5, 40)) for _ in range(200)]
+    csts = pf.parseToCsts(bgMk, (0, 0, 500, 500))
+    prep = pf.prepareCsts(csts)
+    for overlap in (0, 0.1, 0.5):
+        for _ in range(200):
+            mk = poly(rng.uniform(5, 40))
+            # within < 1 avoids float error of a full intersection
+            assert pf.constrainsCheck(mk, csts, overlap=overlap, within=0.5) == \
+                pf.constrainsCheck(mk, prep, overlap=overlap, within=0.5)
+
+    # completely inside the frame
+    mk = {'param': np.array([(1, 1), (1, 3), (3, 3), (3, 1)]), 'type': 'polygon'}
+    assert pf.constrainsCheck(mk, pf.prepareCsts([], (0, 0, 20, 20)))
+
+    # lines and points, against polygons, lines and points
+    bgMk = [{'param': np.array([(0, 0), (0, 10), (10, 10), (10, 0)]), 'type': 'polygon'},
+        {'param': np.array([(30, 0), (30, 20)]), 'type': 'line'},
+        {'param': np.array([40, 40]), 'type': 'point'}]
+    csts = pf.parseToCsts(bgMk, (0, 0, 50, 50))
+    for mk, kw, ans in [
+            ({'param': np.array([(20, 20), (25, 25)]), 'type': 'line'}, {}, True),
+            ({'param': np.array([(5, 5), (20, 5)]), 'type': 'line'}, {}, False),
+            ({'param': np.array([(5, 5), (20, 5)]), 'type': 'line'}, {'overlap': 0.5}, True),
+            ({'param': np.array([(25, 10), (35, 10)]), 'type': 'line'}, {}, False),
+            ({'param': np.array([(45, 20), (55, 20)]), 'type': 'line'}, {}, False),
+            ({'param': np.array([(45, 20), (55, 20)]), 'type': 'line'}, {'within': 0.5}, True),
+            ({'param': np.array([20, 20]), 'type': 'point'}, {}, True),
+            ({'param': np.array([5, 5]), 'type': 'point'}, {}, False),
+            ({'param': np.array([30, 10]), 'type': 'point'}, {}, False),
+            ({'param': np.array([40, 40]), 'type': 'point'}, {}, False),
+            ({'param': np.array([60, 20]), 'type': 'point'}, {}, False),
+            ({'param': np.array([60, 20]), 'type': 'point'}, {'within': 0}, True)]:
+        assert pf.constrainsCheck(mk, csts, **kw) == ans
+        assert pf.constrainsCheck(mk, bgMk, (0, 0, 50, 50), **kw) == ans
+        assert pf.constrainsCheck(mk, pf.prepareCsts(csts), **kw) == ans
+
+
+def _findPlacements_test():
+    bgMk = [
+        {'param': np.array([(0, 0), (0, 50), (50, 50), (50, 0)]), 'type': 'polygon'},
+        {'param': np.array([(60, 60), (60, 100), (100, 100), (100, 60)]), 'type': 'polygon'},
+    ]
+    fgMk = {'param': np.array([(0, 0), (0, 10), (10, 10), (10, 0)]), 'type': 'polygon'}
+    csts = pf.prepareCsts(bgMk, (0, 0, 100, 100))
+    pos = pf.findPlacements(fgMk, csts, None, 50, rng=0)
+    assert len(pos) == 50
+    for p in pos:
+        assert pf.constrainsCheck({'param': fgMk['param'] + p, 'type': 'polygon'}, csts)
+
+    # nowhere to place
+    assert pf.findPlacements(fgMk, [], (0, 0, 5, 5), 1, rng=0) == []
+
+
+def _augment_test():
+    from PIL import Image
+    from pixelPipeline import augment
+
+    px = Image.new('RGBA', (200, 200), color=(0, 128, 0, 255))
+    mk = [{'param': np.array([(10, 10), (10, 40), (40, 40), (40, 10)], dtype=float),
+        'type': 'polygon', 'label': 'WeiLong1'}]
+    ops = [{'op': 'copyPaste', 'label': 'WeiLong', 'n': 3}, {'op': 'noise', 'snr': 0.9}]
+    res_px, res_mk = augment(px, mk, ops, 0, pf)
+    assert res_px.size == px.size
+    assert len(res_mk) == 4 and all(item['label'] == 'WeiLong1' for item in res_mk)
+
+
+def _labelMeFile_test():
+    import base64
+    import io
+    import json
+    import os
+    import tempfile
+    from PIL import Image
+    import pixelIO
+
+    rng = np.random.default_rng(0)
+    arr = rng.integers(0, 255, (300, 400, 3), dtype=np.uint8)
+    arr[100: 200, 120: 280] = 255  # white box of the marking
+    buf = io.BytesIO()
+    Image.fromarray(arr).save(buf, 'JPEG', quality=95)
+    b64 = base64.b64encode(buf.getvalue()).decode('ascii')
+    assert '/' in b64
+    shapes = [{'label': 'box', 'points': [[120, 100], [280, 100], [280, 200], [120, 200]],
+        'shape_type': 'polygon'}]
+    with tempfile.TemporaryDirectory() as tmp:
+        pxPath = os.path.join(tmp, 'a.jpg')
+        with open(pxPath, 'wb') as f:
+            f.write(buf.getvalue())
+        for name, data in [('embed', b64), ('escaped', b64), ('null', None)]:
+            mkPath = os.path.join(tmp, name + '.json')
+            text = json.dumps({'shapes': shapes, 'imageData': data, 'imagePath': 'a.jpg'})
+            if name == 'escaped':
+                text = text.replace('/', '\\/')
+            with open(mkPath, 'w') as f:
+                f.write(text)
+            lf = pixelIO.LabelMeFile(mkPath)
+            assert lf.data['imageData'] is None and lf.shapes == shapes
+            assert lf.imageData == data
+            assert np.array_equal(np.asarray(lf.image()), np.asarray(Image.open(pxPath).convert('RGBA')))
+
+            # jpeg draft decode at a quarter, markings scaled with it
+            px, _, mk = pixelIO.loadLabelMe(pxPath, mkPath)
+            small = lf.image((100, 75))
+            assert small.size == (100, 75) and lf.scale == 0.25
+            scale = np.array(small.size) / np.array(px.size)
+            assert np.abs(lf.markings()[0]['param'] - mk[0]['param'] * scale).max() < 1
+            x, y = lf.markings()[0]['param'].mean(axis=0).astype(int)
+            assert (np.asarray(small)[y, x, :3] > 200).all()
+
+
+def _dumpLabelMe_test():
+    import base64
+    import json
+    import os
+    import tempfile
+    from PIL import Image
+    import pixelIO
+
+    px = Image.fromarray(np.random.default_rng(0).integers(0, 255, (40, 60, 4), dtype=np.uint8))
+    mk = [{'param': np.array([(1, 1), (20, 1), (20, 30)], dtype=float), 'type': 'polygon', 'label': 'a'}]
+    with tempfile.TemporaryDirectory() as tmp:
+        for sub, embed in (('embed', True), ('sidecar', False)):
+            os.makedirs(os.path.join(tmp, sub))
+            pxPath, mkPath = pixelIO.dumpLabelMe(px, {'version': '5'}, mk, os.path.join(tmp, sub),
+                'a', embed=embed)
+            with open(mkPath) as f:
+                data = json.load(f)
+            assert data['imagePath'] == os.path.basename(pxPath) == 'a.jpg'
+            assert data['shapes'][0]['points'] == mk[0]['param'].tolist()
+            if embed:
+                payload = base64.b64decode(data['imageData'])
+            else:
+                assert data['imageData'] is None
+                with open(os.path.join(os.path.dirname(mkPath), data['imagePath']), 'rb') as f:
+                    assert f.read() == payload
+
+
+def _noise_test():
+    from PIL import Image
+
+    px = Image.fromarray(np.full((50, 60, 4), 128, dtype=np.uint8))
+    for n_type in ('bw', 'gaussian', 'poisson', 'speckle'):
+        res = np.array(pf.noise(px, 0.9, n_type, rng=0))
+        assert np.array_equal(res, np.array(pf.noise(px, 0.9, n_type, rng=0)))
+        assert (res[:, :, 3] == 128).all()
+        assert abs(res[:, :, :3].mean() - 128) < 5
+    res = np.array(pf.noise(px, 0.5, 'bw', rng=0))
+    noisy = res[:, :, 0] != 128
+    assert set(np.unique(res[:, :, :3][noisy])) <= {0, 255}
+    assert (res[:, :, 0] == res[:, :, 2]).all()
+    assert np.array_equal(np.array(pf.noise(px, 1.0, 'gaussian')), np.array(px))
+    # no photon at all
+    res = np.array(pf.noise(px, 0.0, 'poisson', rng=0))
+    assert (res[:, :, :3] == 0).all() and (res[:, :, 3] == 128).all()
+    arr = np.array(px)
+    assert pf.noise(arr, 0.0, 'poisson') is arr and (arr[:, :, :3] == 0).all()
+
+
+def _rotate_test():
+    from PIL import Image
+
+    px = Image.fromarray(np.random.default_rng(0).integers(0, 255, (60, 100, 4), dtype=np.uint8))
+    mk = [
+        {'param': np.array([(0, 0), (100, 10), (80, 60), (10, 50)], dtype=float), 'type': 'polygon'},
+        {'param': np.array([50, 30], dtype=float), 'type': 'point'},
+    ]
+    res_px, res_mk = pf.rotate(px, mk, 180)
+    assert res_px.size == (100, 60)
+    assert np.array_equal(np.array(res_px), np.array(px)[::-1, ::-1])
+    assert np.allclose(res_mk[0]['param'], [(100, 60), (0, 50), (20, 0), (90, 10)])
+    assert res_mk[1]['param'].shape == (2, ) and np.allclose(res_mk[1]['param'], [50, 30])
+
+    res_px, res_mk = pf.rotate(px, mk[0], 90)
+    assert res_px.size == (60, 100)
+    assert np.allclose(res_mk['param'], [(0, 100), (10, 0), (60, 20), (50, 90)])
+
+
+def _markingSet_test():
+    from pixelMarking import MarkingSet
+
+    shapes = [
+        {'label': 'WeiLong1', 'points': [[0, 0], [0, 5], [5, 5], [5, 0]], 'shape_type': 'polygon',
+            'group_id': None, 'flags': {}},
+        {'label': 'WeiLong2', 'points': [[6, 6]], 'shape_type': 'point',
+            'group_id': 2, 'flags': {}},
+    ]
+    ms = MarkingSet.fromShapes(shapes)
+    assert len(ms) == 2 and ms.types == ['polygon', 'point']
+    assert ms.toShapes() == shapes
+    assert ms[1]['param'].shape == (2, ) and ms[1]['group_id'] == 2
+
+    moved = ms.translate(1, 2)
+    assert np.array_equal(moved[1]['param'], [7, 8])
+    assert np.array_equal(ms[1]['param'], [6, 6])
+    assert np.array_equal(moved.bounds(), [[1, 2, 6, 7], [7, 8, 7, 8]])
+    assert np.allclose(ms.rotate(180, (3, 3))[1]['param'], [0, 0])
+
+    px = np.zeros((10, 10, 4), dtype=np.uint8)
+    from PIL import Image
+    cut, cutMk = pf.copyRegion(Image.fromarray(px), ms.subset([0]))
+    assert cut.size == (5, 5) and cutMk.bound() == (0, 0, 5, 5)
+
+    # holes of polygons move with vertices
+    hole = np.array([(1, 1), (1, 2), (2, 2), (2, 1)], dtype=float)
+    ms = MarkingSet.fromMarkings([dict(ms[0], holes=[hole]), ms[1]])
+    assert np.array_equal(ms.translate(1, 2)[0]['holes'][0], hole + [1, 2])
+    assert np.allclose(ms.rotate(180, (3, 3))[0]['holes'][0], 6 - hole)
+    assert np.array_equal(ms[0]['holes'][0], hole)
+    _, cutMk = pf.copyRegion(Image.fromarray(px), ms.translate(3, 3).subset([0]))
+    assert np.array_equal(cutMk[0]['holes'][0], hole)
+    _, rotMk = pf.rotate(Image.fromarray(px), ms, 90)
+    _, lstMk = pf.rotate(Image.fromarray(px), ms.toMarkings(), 90)
+    assert np.allclose(rotMk[0]['holes'][0], lstMk[0]['holes'][0])
+    assert Polygon(rotMk[0]['param']).contains(Polygon(rotMk[0]['holes'][0]))
+
+
+def _pasteMany_test():
+    from PIL import Image
+
+    def square(x, y, w):
+        return np.array([(x, y), (x, y + w), (x + w, y + w), (x + w, y)], dtype=float)
+
+    bg = Image.new('RGBA', (100, 100), color=(0, 0, 0, 255))
+    fg = Image.new('RGBA', (10, 10), color=(255, 0, 0, 255))
+    bgMk = [{'param': square(0, 0, 20), 'type': 'polygon', 'label': 'bg'}]
+    fgMk = {'param': square(0, 0, 10), 'type': 'polygon', 'label': 'fg'}
+    items = [(fg, fgMk, (15, 5)), (fg, fgMk, (20, 5)), (fg, fgMk, (50, 50)), (fg, fgMk, (200, 200))]
+
+    res_px, res_mk = pf.pasteMany(bg, bgMk, items)
+    seq_px, seq_mk = bg, bgMk
+    for item in items:
+        seq_px, seq_mk = pf.pasteRegion(seq_px, seq_mk, *item)
+    assert np.array_equal(np.array(res_px), np.array(seq_px))
+    assert [mk['label'] for mk in res_mk] == ['bg', 'fg', 'fg', 'fg']
+    area = lambda mk: sum(Polygon(item['param']).area for item in mk)
+    assert area(res_mk) == area(seq_mk) == 350 + 50 + 100 + 100
+
+    # foregrounds across the image edge are kept whole, same shapes as pasting one by one
+    big = Image.new('RGBA', (20, 20), color=(255, 0, 0, 255))
+    bigMk = {'param': square(0, 0, 20), 'type': 'polygon', 'label': 'fg'}
+    bgMk = [{'param': square(70, 70, 40), 'type': 'polygon', 'label': 'bg'}]
+    items = [(big, bigMk, (85, 85)), (big, bigMk, (90, 90)), (big, bigMk, (60, 95))]
+    res_px, res_mk = pf.pasteMany(bg, bgMk, items)
+    seq_px, seq_mk = bg, bgMk
+    for item in items:
+        seq_px, seq_mk = pf.pasteRegion(seq_px, seq_mk, *item)
+    def rings(item):
+        # closed rings, `pasteRegion` closes polygons it does not cut
+        geo = Polygon(item['param'], item.get('holes'))
+        return [np.array(ring.coords) for ring in [geo.exterior] + list(geo.interiors)]
+
+    assert len(res_mk) == len(seq_mk) and all(
+        a['label'] == b['label'] and len(rings(a)) == len(rings(b))
+        and all(np.array_equal(x, y) for x, y in zip(rings(a), rings(b)))
+        for a, b in zip(res_mk, seq_mk))
+    assert np.array_equal(np.min(res_mk[1]['param'], axis=0), [85, 85])
+    assert np.array_equal(np.max(res_mk[1]['param'], axis=0), [105, 105])
+
+    # holes of foregrounds move with them
+    hole = {'param': square(0, 0, 20), 'type': 'polygon', 'holes': [square(5, 5, 5)]}
+    res_px, res_mk = pf.pasteMany(bg, [], [(fg, hole, (30, 40))])
+    assert np.array_equal(res_mk[0]['holes'][0], square(35, 45, 5))
+
+    res_px, res_mk = pf.pasteMany(bg, [], [])
+    assert res_mk == []
+
+
+def _objectBank_test():
+    import json, os, tempfile
+    from PIL import Image
+    from pixelBank import ObjectBank
+
+    with tempfile.TemporaryDirectory() as tmp:
+        Image.new('RGB', (50, 50), color=(255, 0, 0)).save(os.path.join(tmp, 'a.jpg'))
+        shapes = [{'label': 'WeiLong1', 'points': [[10, 10], [10, 30], [30, 30]],
+            'shape_type': 'polygon', 'group_id': None, 'flags': {}}]
+        with open(os.path.join(tmp, 'a.json'), 'w') as f:
+            json.dump({'shapes': shapes, 'imagePath': 'a.jpg', 'imageData': None}, f)
+
+        cache = os.path.join(tmp, 'cache')
+        bank = ObjectBank(cache, pf=pf)
+        assert bank.index(tmp) == [(os.path.join(tmp, 'a.json'), 0, 'WeiLong1')]
+        px, mk = bank.get(os.path.join(tmp, 'a.json'), 0)
+        assert px.size == (20, 20) and px.mode == 'RGBA'
+        assert np.array_equal(mk['param'], [(0, 0), (0, 20), (20, 20)])
+        assert bank.get(os.path.join(tmp, 'a.json'), 0)[0] is px
+
+        # second bank reads cutout from disk
+        px2, mk2 = ObjectBank(cache, pf=pf).get(os.path.join(tmp, 'a.json'), 0)
+        assert np.array_equal(np.array(px2), np.array(px)) and mk2['label'] == 'WeiLong1'
+
+        # threads saving the same entry do not share a temporary file
+        from concurrent.futures import ThreadPoolExecutor
+        for name in os.listdir(cache):
+            os.remove(os.path.join(cache, name))
+        with ThreadPoolExecutor(8) as ex:
+            res = list(ex.map(lambda _: ObjectBank(cache).get(
+                os.path.join(tmp, 'a.json'), 0), range(8)))
+        assert all(np.array_equal(np.array(p), np.array(px)) for p, _ in res)
+        assert [os.path.splitext(name)[1] for name in sorted(os.listdir(cache))] == ['.json', '.png']
+        px2, _ = ObjectBank(cache, pf=pf).get(os.path.join(tmp, 'a.json'), 0)
+        assert np.array_equal(np.array(px2), np.array(px))
+
+        # replaced image of the json is cut again, in memory and on disk
+        Image.new('RGB', (50, 50), color=(0, 0, 255)).save(os.path.join(tmp, 'a.jpg'))
+        for b in (bank, ObjectBank(cache, pf=pf)):
+            px2, _ = b.get(os.path.join(tmp, 'a.json'), 0)
+            r, _, b, a = px2.getpixel((5, 15))
+            assert r < 50 and b > 200 and a == 255
+
+
+def _masking_test():
+    from PIL import Image
+
+    px = Image.new('RGBA', (30, 30), color=(1, 2, 3, 255))
+    gp = [
+        {'param': np.array([(0, 0), (0, 20), (20, 20), (20, 0)], dtype=float), 'type': 'polygon',
+            'holes': [np.array([(5, 5), (5, 15), (15, 15), (15, 5)], dtype=float)]},
+        {'param': np.array([25, 25], dtype=float), 'type': 'point'},
+    ]
+    res = np.array(pf.masking(px, gp, alpha=7))
+    assert res[2, 2, 3] == 255 and res[10, 10, 3] == 7 and res[25, 25, 3] == 7
+    assert (res[:, :, :3] == (1, 2, 3)).all()
+    assert np.array_equal(res, np.array(pf.masking(px, gp, alpha=7, bounded=False)))
+
+    arr = np.array(px)
+    assert pf.masking(arr, gp, alpha=7) is arr
+    assert np.array_equal(arr, res)
+
+
+def _occlusionEngine_test():
+    from pixelOcclusion import OcclusionEngine
+
+    rng = np.random.default_rng(0)
+
+    def poly(c, r):
+        t = np.sort(rng.uniform(0, 2 * np.pi, 6))
+        return np.c_[c[0] + r * np.cos(t), c[1] + r * np.sin(t)]
+
+    mk = [{'param': poly(rng.uniform(0, 100, 2), 10), 'type': 'polygon'} for _ in range(30)]
+    mk.append({'param': np.array([5.0, 5.0]), 'type': 'point'})
+    occ = OcclusionEngine(mk, (100, 100))
+    for _ in range(20):
+        fgMk = {'param': poly(rng.uniform(-10, 110, 2), 15), 'type': 'polygon'}
+        mk = pf._pastePolyToPoly(mk, fgMk, (100, 100))
+        res = occ.paste(fgMk)
+        assert len(res) == len(mk) and all(
+            np.array_equal(a['param'], b['param']) and a['type'] == b['type']
+            for a, b in zip(res, mk))
+        assert occ.matches(res)
+    assert pf._occlusion(res, (100, 100)).matches(res)
+
+    # holes cut by an earlier paste still count at the next one
+    from PIL import Image
+    px, sq = Image.new('RGBA', (60, 60)), Image.new('RGBA', (10, 10))
+    bgMk = [{'param': np.array([(0, 0), (60, 0), (60, 60), (0, 60)], dtype=float), 'type': 'polygon'}]
+    fgMk = {'param': np.array([(0, 0), (10, 0), (10, 10), (0, 10)], dtype=float), 'type': 'polygon'}
+    _, mk = pf.pasteRegion(px, bgMk, sq, fgMk, (20, 20))
+    _, mk = pf.pasteRegion(px, mk, sq, fgMk, (25, 25))
+    assert Polygon(mk[0]['param'], mk[0]['holes']).area == 3425
+    assert [len(item.get('holes', ())) for item in mk] == [1, 0, 0]
+
+    # holes move with the marking when it is cut, pasted and rotated
+    px = Image.new('RGBA', (200, 200), (255, 0, 0, 255))
+    sqMk = {'param': np.array([(100, 100), (150, 100), (150, 150), (100, 150)], dtype=float),
+        'type': 'polygon'}
+    px, mk = pf.pasteRegion(px, [sqMk], sq, fgMk, (110, 125))
+    cut, cutMk = pf.copyRegion(px, mk[0])
+    assert np.array_equal(np.min(cutMk['holes'][0], axis=0), [10, 25])
+    cut = pf.masking(cut, [cutMk])
+    assert cut.getpixel((15, 30))[3] == 0 and cut.getpixel((5, 5))[3] == 255
+    res, resMk = pf.pasteRegion(Image.new('RGBA', (100, 100)), [], cut, cutMk, (20, 30))
+    assert np.array_equal(np.min(resMk[-1]['holes'][0], axis=0), [30, 55])
+    assert res.getpixel((35, 60))[3] == 0 and res.getpixel((25, 35))[3] == 255
+    _, res = pf.pasteRegion(Image.new('RGBA', (100, 100)), resMk, sq, fgMk, (60, 30))
+    assert Polygon(res[0]['param'], res[0]['holes']).area == 2500 - 100 - 100
+    rot, rotMk = pf.rotate(cut, cutMk, 90)
+    hole = Polygon(rotMk['holes'][0])
+    assert Polygon(rotMk['param']).contains(hole) and abs(hole.area - 100) < 1e-6
+    c = hole.centroid
+    assert pf.masking(rot, [rotMk]).getpixel((int(c.x), int(c.y)))[3] == 0
+
+    # ellipse and circle cover the background but stay whole, a line covers nothing
+    import pixelEllipse
+    for fgMk in [{'param': np.array([(10, 10), (20, 10), (10, 5)], dtype=float), 'type': 'ellipse'},
+            {'param': np.array([(10, 10), (20, 10)], dtype=float), 'type': 'circle'},
+            {'param': np.array([(0, 0), (20, 0), (20, 20)], dtype=float), 'type': 'line'}]:
+        _, mk = pf.pasteRegion(px, bgMk, sq, fgMk, (20, 20))
+        _, many = pf.pasteMany(px, bgMk, [(sq, fgMk, (20, 20))])
+        assert mk[-1]['type'] == fgMk['type'] and np.array_equal(mk[-1]['param'], fgMk['param'] + 20)
+        area = 3600 if fgMk['type'] == 'line' else \
+            3600 - Polygon(pixelEllipse.polygon(dict(fgMk, param=fgMk['param'] + 20))).area
+        for res in (mk, many):
+            assert len(res) == 2 and res[-1]['type'] == fgMk['type']
+            assert abs(Polygon(res[0]['param'], res[0].get('holes')).area - area) < 1e-6
+
+
+def _metrics_test():
+    import pixelMetrics
+    from PIL import Image
+
+    px = Image.new('RGBA', (100, 80), (200, 100, 50, 255))
+    mk = [{'param': np.array([[10.0, 10.0], [50.0, 10.0], [50.0, 40.0]]), 'type': 'polygon'}]
+    pf.masking(px, mk)  # disabled, nothing recorded
+    col = pixelMetrics.enable()
+    try:
+        pf.masking(px, mk)
+        pf.masking(px, mk)
+        pf.constrainsCheck(dict(mk[0], param=mk[0]['param'] + 30),
+            pf.prepareCsts(mk, (0, 0, 100, 80)))
+    finally:
+        assert pixelMetrics.disable() is col
+    pf.masking(px, mk)
+
+    snap = col.snapshot()
+    assert snap['ops']['masking']['calls'] == 2
+    assert snap['ops']['masking']['pixels'] == 2 * 100 * 80
+    assert snap['ops']['masking']['vertices'] == 2 * 3
+    assert snap['counters']['shapely.query'] == 1
+    other = pixelMetrics.Collector()
+    other.merge(snap)
+    other.merge(snap)
+    assert other.ops['masking'][0] == 4
+    assert 'pixel_op_calls_total{op="masking"} 4' in other.toPrometheus()
+
+    # ops on threads of one collector, tiled images and arrays have pixels
+    from concurrent.futures import ThreadPoolExecutor
+    from pixelTile import TiledImage
+    col = pixelMetrics.enable()
+    try:
+        with ThreadPoolExecutor(8) as ex:
+            list(ex.map(lambda i: [pixelMetrics.count('n') for _ in range(2000)], range(8)))
+        with TiledImage.fromImage(px, tile=32) as ti:
+            pf.masking(ti, mk)
+        pf.pasteMany(np.zeros((80, 100, 4), dtype=np.uint8), mk,
+            [(px.crop((0, 0, 20, 10)), None, (5, 5))])
+    finally:
+        pixelMetrics.disable()
+    assert col.counters['n'] == 8 * 2000
+    assert col.ops['masking'][2] == 100 * 80 and col.ops['pasteMany'][2] == 100 * 80 + 20 * 10
+
+
+def _tiledImage_test():
+    from PIL import Image
+    from pixelTile import TiledImage
+
+    rng = np.random.default_rng(0)
+    arr = rng.integers(0, 255, (300, 400, 4), dtype=np.uint8)
+    arr[:, :, 3] = 255
+    px = Image.fromarray(arr, 'RGBA')
+    mk = [{'param': np.array([[30.5, 20.2], [210.7, 60.1], [120.3, 250.9]]), 'type': 'polygon'},
+        {'param': np.array([[250.0, 100.0], [390.0, 120.0], [300.0, 290.0]]), 'type': 'polygon'}]
+    fg, fgMk = pf.copyRegion(px, mk[0])
+    fg = pf.masking(fg, [fgMk])
+
+    with TiledImage.fromImage(px, tile=64) as ti:
+        assert np.array_equal(np.asarray(ti.crop((10, 10, 100, 90))), arr[10: 90, 10: 100])
+        res, resMk = pf.pasteRegion(px, mk, fg, fgMk, (-20, 200))
+        tiRes, tiMk = pf.pasteRegion(ti, mk, fg, fgMk, (-20, 200))
+        assert tiRes is ti and np.array_equal(np.asarray(res), ti.array)
+        assert _oneToOneMatch(resMk, tiMk)
+        res = pf.noise(res, 0.9, 'gaussian', rng=1)
+        pf.noise(ti, 0.9, 'gaussian', rng=1)
+        assert np.array_equal(np.asarray(res), ti.array)
+        assert np.array_equal(np.asarray(pf.rotate(res, mk[1], 30)[0]),
+            np.asarray(pf.rotate(ti, mk[1], 30)[0]))
+        res = pf.masking(res, mk)
+        pf.masking(ti, mk)
+        assert np.array_equal(np.asarray(res), ti.array)
+
+    # tiles rasterize the same vertices as the whole image, also out of
+    # frame. PIL does not fill a self-intersecting polygon alike once it is
+    # shifted, vertices are on a circle so that every polygon is simple
+    def star(c, r, n):
+        t = np.sort(rng.uniform(0, 2 * np.pi, n))
+        return np.c_[c[0] + r * np.cos(t), c[1] + r * np.sin(t)]
+
+    for _ in range(20):
+        ctr = rng.uniform(-30, 430, (3, 2))
+        mk = [{'param': star(c, rng.uniform(20, 150), 7), 'type': 'polygon',
+            'holes': [star(c, 15, 4)]} for c in ctr]
+        for bounded in (True, False):
+            res = pf.masking(px, mk, 10, bounded)
+            with TiledImage.fromImage(px, tile=64) as ti:
+                pf.masking(ti, mk, 10, bounded)
+                assert np.array_equal(np.asarray(res), ti.array)
+
+
+def _shard_test():
+    import os
+    import tempfile
+    from pixelShard import ShardWriter, ShardDataset
+
+    rng = np.random.default_rng(0)
+    mk = [{'param': np.array([[0.0, 0.0], [10.0, 0.0], [10.0, 10.0], [0.0, 0.0]]),
+            'type': 'polygon', 'label': 'a',
+            'holes': [np.array([[2.0, 2.0], [4.0, 2.0], [4.0, 4.0], [2.0, 2.0]])]},
+        {'param': np.array([3.0, 4.0]), 'type': 'point', 'label': 'b'},
+        {'param': np.array([[1.0, 1.0], [5.0, 7.0]]), 'type': 'line', 'label': 'a'}]
+    arrs = [rng.integers(0, 255, (5 + i, 7, 4), dtype=np.uint8) for i in range(5)]
+    with tempfile.TemporaryDirectory() as tmp:
+        with ShardWriter(tmp, prefix='t', maxBytes=300) as w:
+            for i, arr in enumerate(arrs):
+                w.add('s{}'.format(i), arr, mk[i % 2:])
+        ds = ShardDataset(tmp)
+        assert len(ds) == 5 and len(ds.shards) > 1
+        for i, arr in enumerate(arrs):
+            px, res = ds[i]
+            assert ds.name(i) == 's{}'.format(i) and np.array_equal(px, arr)
+            assert [m['label'] for m in res] == [m['label'] for m in mk[i % 2:]]
+            assert all(np.array_equal(a['param'], b['param']) and a['type'] == b['type']
+                for a, b in zip(res, mk[i % 2:]))
+        assert np.array_equal(ds[0][1][0]['holes'][0], mk[0]['holes'][0])
+        sh, j = ds.locate(0)
+        assert sh.markingSet(j).types == ['polygon', 'point', 'line']
+
+        # a crash after the name of a sample, reopened shard appends after the index
+        with ShardWriter(tmp, prefix='u') as w:
+            w.add('u0', arrs[0], mk)
+        path = os.path.join(tmp, 'u-00000')
+        with open(os.path.join(path, 'names.txt'), 'a') as f:
+            f.write('lost\n')
+        with open(os.path.join(path, 'index.bin'), 'ab') as f:
+            f.write(b'\0' * 20)
+        with ShardWriter(tmp, prefix='u') as w:
+            w.add('u1', arrs[1], mk[1:])
+        ds = ShardDataset(tmp)
+        assert len(ds) == 7 and [ds.name(i) for i in (5, 6)] == ['u0', 'u1']
+        assert np.array_equal(ds[6][0], arrs[1]) and len(ds[6][1]) == 2
+
+
+def _asyncPipeline_test():
+    import asyncio
+    import json
+    import os
+    import tempfile
+    from PIL import Image
+    from pixelAsync import AsyncPipeline
+    from pixelPipeline import Pipeline
+
+    ops = [{'op': 'copyPaste', 'label': 'WeiLong', 'n': 3}, {'op': 'noise', 'snr': 0.9}]
+    shape = {'label': 'WeiLong1', 'points': [[10, 10], [10, 40], [40, 40], [40, 10]],
+        'shape_type': 'polygon', 'group_id': None, 'flags': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'src')
+        os.makedirs(src)
+        for i in range(5):
+            Image.new('RGB', (120, 100), color=(0, 40 * i, 0)).save(os.path.join(src, 'p{}.jpg'.format(i)))
+            with open(os.path.join(src, 'p{}.json'.format(i)), 'w') as f:
+                json.dump({'shapes': [shape], 'imagePath': 'p{}.jpg'.format(i), 'imageData': None}, f)
+
+        async def run():
+            return [name async for name in AsyncPipeline(
+                ops, 1, 2, 2, 2, queueSize=1, seed=7).run(src, os.path.join(tmp, 'a'))]
+
+        assert sorted(asyncio.run(run())) == ['p{}'.format(i) for i in range(5)]
+        list(Pipeline(ops, workers=0, seed=7).run(src, os.path.join(tmp, 'b')))
+        for name in os.listdir(os.path.join(tmp, 'b')):
+            with open(os.path.join(tmp, 'a', name), 'rb') as a, open(os.path.join(tmp, 'b', name), 'rb') as b:
+                assert a.read() == b.read()
+
+        # shape index of pasteBank is opened by every compute thread
+        bank = [{'op': 'pasteBank', 'src': src, 'label': 'WeiLong', 'area': [100, None]}]
+
+        async def runBank():
+            return [name async for name in AsyncPipeline(
+                bank, 1, 2, 3, 2, queueSize=1, seed=7).run(src, os.path.join(tmp, 'c'))]
+
+        assert sorted(asyncio.run(runBank())) == ['p{}'.format(i) for i in range(5)]
+        list(Pipeline(bank, workers=0, seed=7).run(src, os.path.join(tmp, 'd')))
+        for name in os.listdir(os.path.join(tmp, 'd')):
+            with open(os.path.join(tmp, 'c', name), 'rb') as a, open(os.path.join(tmp, 'd', name), 'rb') as b:
+                assert a.read() == b.read()
+
+
+def _incrementalCsts_test():
+    from pixelCsts import PreparedCsts
+    from shapely.geometry import box
+
+    rng = np.random.default_rng(0)
+
+    def square(x, y, r=5.0):
+        return {'param': np.array([[x, y], [x + r, y], [x + r, y + r], [x, y + r]]), 'type': 'polygon'}
+
+    mk = [square(*rng.uniform(0, 190, 2)) for _ in range(50)]
+    csts = pf.prepareCsts(mk, (0, 0, 200, 200))
+    keys = list(range(len(mk)))
+    for step in range(300):
+        # random edits, then compare with constrains built from scratch
+        op = rng.integers(3)
+        if op == 0 or not keys:
+            mk.append(square(*rng.uniform(0, 190, 2)))
+            keys.append(csts.add(mk[-1]))
+        elif op == 1:
+            i = rng.integers(len(keys))
+            csts.remove(keys.pop(i))
+            mk.pop(i)
+        else:
+            i = rng.integers(len(keys))
+            mk[i] = square(*rng.uniform(0, 190, 2))
+            keys[i] = csts.replace(keys[i], mk[i])
+        ref = pf.prepareCsts(mk, (0, 0, 200, 200))
+        assert len(csts) == len(ref) == len(mk)
+        for _ in range(5):
+            new = square(*rng.uniform(-5, 195, 2), r=8.0)
+            assert csts.check(new, 0.2, 0.5) == ref.check(new, 0.2, 0.5)
+    assert np.array_equal(np.sort(csts.bounds, axis=0), np.sort(ref.bounds, axis=0))
+
+    csts = pf.prepareCsts([], (0, 0, 100, 100))
+    pos = pf.findPlacements(square(0, 0, 10.0), csts, None, 20, rng=0, exclusive=True)
+    assert len(pos) == 20 and len(csts) == 20
+    boxes = [box(x, y, x + 10, y + 10) for x, y in pos]
+    assert all(a.intersection(b).area == 0 for i, a in enumerate(boxes) for b in boxes[i + 1:])
+
+
+def _plan_test():
+    import json
+    from PIL import Image
+    from pixelPlan import makePlan, runPlan
+
+    px = Image.new('RGBA', (200, 200), color=(0, 128, 0, 255))
+    px.paste((200, 0, 0, 255), (10, 10, 40, 40))
+    mk = [{'param': np.array([(10, 10), (10, 40), (40, 40), (40, 10)], dtype=float),
+        'type': 'polygon', 'label': 'WeiLong1'}]
+    ops = [{'op': 'copyPaste', 'label': 'WeiLong', 'n': 3, 'degree': [-30, 30]},
+        {'op': 'noise', 'snr': 0.9, 'n_type': 'gaussian'}]
+    steps = makePlan(mk, px.size, ops, 5, pf)
+    assert steps == json.loads(json.dumps(steps)) and steps == makePlan(mk, px.size, ops, 5, pf)
+    assert len(steps[0]['pos']) == 3 and 'seed' in steps[1]
+    res_px, res_mk = runPlan(px, mk, steps, pf)
+    again_px, again_mk = runPlan(px, mk, json.loads(json.dumps(steps)), pf)
+    assert np.array_equal(np.asarray(res_px), np.asarray(again_px))
+    assert len(res_mk) == len(again_mk) == 4 and all(
+        np.array_equal(a['param'], b['param']) for a, b in zip(res_mk, again_mk))
+    # markings of planning are reused, each paste is occluded once
+    import pixelMetrics
+    from pixelPipeline import augment
+    steps, planned = makePlan(mk, px.size, ops, 5, pf, markings=True)
+    plan_px, plan_mk = runPlan(px, mk, steps, pf, planned)
+    assert np.array_equal(np.asarray(res_px), np.asarray(plan_px)) and all(
+        np.array_equal(a['param'], b['param']) for a, b in zip(res_mk, plan_mk))
+    col = pixelMetrics.enable()
+    try:
+        augment(px, mk, ops, 5, pf)
+    finally:
+        pixelMetrics.disable()
+    assert col.ops['occlusion'][0] == col.ops['pasteMany'][0] == 1
+
+    # second paste op occludes the background with the hole of the first
+    px = Image.new('RGBA', (60, 60), color=(0, 128, 0, 255))
+    mk = [{'param': np.array([(0, 0), (60, 0), (60, 60), (0, 60)], dtype=float), 'type': 'polygon'},
+        {'param': np.array([(0, 0), (10, 0), (10, 10), (0, 10)], dtype=float), 'type': 'polygon'}]
+    steps = [{'op': 'copyPaste', 'index': 1, 'degree': None, 'pos': [[20, 20]]},
+        {'op': 'copyPaste', 'index': 1, 'degree': None, 'pos': [[25, 25]]}]
+    res_px, res_mk = runPlan(px, mk, steps, pf)
+    assert Polygon(res_mk[0]['param'], res_mk[0]['holes']).area == 3425
+    alpha = np.asarray(pf.masking(res_px, res_mk[:1]))[:, :, 3]
+    assert alpha[22, 22] == alpha[32, 32] == 0 and alpha[50, 50] == 255
+
+    # a hole of the copied polygon moves with it, in plan and in pixels
+    px = Image.new('RGBA', (200, 200), color=(0, 128, 0, 255))
+    mk = [{'param': np.array([(10, 10), (70, 10), (70, 70), (10, 70)], dtype=float),
+        'type': 'polygon', 'label': 'A',
+        'holes': [np.array([(30, 30), (40, 30), (40, 40), (30, 40)], dtype=float)]}]
+    ops = [{'op': 'copyPaste', 'label': 'A'}]
+    steps = makePlan(mk, px.size, ops, 3, pf)
+    res_px, res_mk = runPlan(px, mk, steps, pf)
+    pos = np.array(steps[0]['pos'][0])
+    assert np.array_equal(np.min(res_mk[-1]['holes'][0], axis=0), pos + 20)
+    rings = lambda item: [item['param']] + list(item.get('holes', ()))
+    ops = [{'op': 'copyPaste', 'label': 'A', 'degree': [-30, 30]}] * 2
+    steps, planned = makePlan(mk, px.size, ops, 3, pf, markings=True)
+    res_px, res_mk = runPlan(px, mk, steps, pf)
+    assert len(res_mk) == len(planned[-1]) and all(
+        len(rings(a)) == len(rings(b)) and all(np.allclose(x, y) for x, y in zip(rings(a), rings(b)))
+        for a, b in zip(res_mk, planned[-1]))
+    for item in res_mk[1:]:
+        assert Polygon(item['param']).contains(Polygon(item['holes'][0]))
+
+    # planned frame size is the size of the loaded image for every orientation
+    import os
+    import tempfile
+    import pixelIO
+    from pixelPlan import imageSize
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'a.jpg')
+        for orient in range(1, 9):
+            exif = Image.Exif()
+            exif[0x0112] = orient
+            Image.new('RGB', (30, 20)).save(path, exif=exif)
+            assert imageSize(path) == pixelIO.exifTranspose(Image.open(path)).size
+
+
+def _rotateMany_test():
+    from PIL import Image
+    from pixelMarking import MarkingSet
+
+    rng = np.random.default_rng(0)
+    px = Image.fromarray(rng.integers(0, 255, (120, 160, 4), dtype=np.uint8), 'RGBA')
+    mk = [{'param': np.array([[10.5, 20.2], [90.7, 30.1], [60.3, 110.9]]), 'type': 'polygon'},
+        {'param': np.array([[100.0, 10.0], [150.0, 20.0], [120.0, 90.0]]), 'type': 'polygon'}]
+    items = [(px, mk[0]), (px, mk), (px, MarkingSet.fromMarkings(mk[1:]))]
+    degrees = [0, 30, 90, -135]
+    rot = pf.rotateMany(items, degrees)
+    assert len(rot) == 12
+    for i, j, res_px, res_mk in rot:
+        px2, mk2 = pf.rotate(items[i][0], items[i][1], degrees[j])
+        assert np.array_equal(np.asarray(res_px), np.asarray(px2))
+        if isinstance(mk2, MarkingSet):
+            mk2, res_mk = mk2.toMarkings(), res_mk.toMarkings()
+        elif isinstance(mk2, dict):
+            mk2, res_mk = [mk2], [res_mk]
+        assert all(np.array_equal(a['param'], b['param']) for a, b in zip(res_mk, mk2))
+    assert rot.markings(0, 2)['param'].shape == (3, 2)
+
+
+def _sharedSample_test():
+    import os
+    from PIL import Image
+    from pixelShm import SharedSample
+
+    rng = np.random.default_rng(1)
+    px = Image.fromarray(rng.integers(0, 255, (60, 80, 4), dtype=np.uint8), 'RGBA')
+    mk = [{'param': np.array([[5.0, 5.0], [30.0, 8.0], [20.0, 40.0]]), 'type': 'polygon',
+        'label': 'a', 'holes': [np.array([[15.0, 12.0], [20.0, 12.0], [18.0, 18.0]])]},
+        {'param': np.array([70.0, 50.0]), 'type': 'point', 'label': 'b'}]
+    cut, cutMk = pf.copyRegion(px, mk[0])
+    sample = SharedSample.create(px.size)
+    sample.array[...] = np.asarray(px)
+    # ops on the shared view write in place, same result as on the image
+    res_px, res_mk = pf.pasteMany(px, mk, [(cut, cutMk, (40, 10))])
+    arr, arr_mk = pf.pasteMany(sample.array, mk, [(cut, cutMk, (40, 10))])
+    assert arr is sample.array and np.array_equal(arr, np.asarray(res_px))
+    assert np.array_equal(pf.copyRegion(arr, mk[0])[0], pf.copyRegion(res_px, mk[0])[0])
+    assert np.array_equal(pf.noise(arr, 0.9, 'gaussian', 3), np.asarray(pf.noise(res_px, 0.9, 'gaussian', 3)))
+
+    handle = sample.share(arr_mk)
+    sample.detach()
+    arr = None
+    with SharedSample.attach(handle) as other:
+        got = other.markings()
+        assert [m['label'] for m in got] == [m['label'] for m in res_mk]
+        assert all(np.array_equal(a['param'], b['param']) for a, b in zip(got, res_mk))
+        assert np.array_equal(got[0]['holes'][0], res_mk[0]['holes'][0])
+        got = None
+    assert not os.path.exists('/dev/shm/' + handle[0][0].lstrip('/'))
+
+
+def _shapeIndex_test():
+    import json, os, tempfile
+    from PIL import Image
+    from pixelIndex import ShapeIndex
+
+    with tempfile.TemporaryDirectory() as tmp:
+        Image.new('RGB', (100, 100)).save(os.path.join(tmp, 'a.jpg'))
+        shapes = [{'label': 'WeiLong1', 'points': [[0, 0], [0, 10], [10, 10], [10, 0]]},
+            {'label': 'WeiLong2', 'points': [[0, 0], [50, 50]], 'shape_type': 'rectangle'},
+            {'label': 'Bottle1', 'points': [[5, 5]], 'shape_type': 'point'}]
+        mkPath = os.path.join(tmp, 'a.json')
+        with open(mkPath, 'w') as f:
+            json.dump({'shapes': shapes, 'imagePath': 'a.jpg', 'imageData': None}, f)
+
+        db = os.path.join(tmp, 'shapes.db')
+        with ShapeIndex(db) as index:
+            assert index.build(tmp) == 1 and len(index) == 3
+            assert index.select('WeiLong', ['polygon']) == [
+                (mkPath, 0, 'WeiLong1'), (mkPath, 1, 'WeiLong2')]
+            assert index.select(area=(1000, None)) == [(mkPath, 1, 'WeiLong2')]
+            assert index.groups(mkPath) == {'1': [0, 2], '2': [1]}
+            assert index.geometry(mkPath, 1) == ('polygon', 0, 0, 50, 50, 2500)
+        # unchanged files are not parsed again, removed files are dropped
+        with ShapeIndex(db) as index:
+            assert index.build(tmp) == 0 and len(index) == 3
+            os.remove(mkPath)
+            assert index.build(tmp) == 0 and len(index) == 0
+
+        # workers sharing one file parse every file once
+        from concurrent.futures import ThreadPoolExecutor
+        for i in range(20):
+            Image.new('RGB', (100, 100)).save(os.path.join(tmp, 'b{}.jpg'.format(i)))
+            with open(os.path.join(tmp, 'b{}.json'.format(i)), 'w') as f:
+                json.dump({'shapes': shapes, 'imagePath': 'a.jpg', 'imageData': None}, f)
+        db = os.path.join(tmp, 'shared.db')
+
+        def build(_):
+            with ShapeIndex(db) as index:
+                return index.build(tmp)
+
+        with ThreadPoolExecutor(4) as ex:
+            cnt = list(ex.map(build, range(4)))
+        with ShapeIndex(db) as index:
+            assert sum(cnt) == 20 and len(index) == 60
+
+
+def _freeSpace_test():
+    import pixelPlace
+
+    # 20 x 20 px blocks fill the image but a 40 x 40 px hole
+    mk = [{'param': np.array([(x, y), (x + 20, y), (x + 20, y + 20), (x, y + 20)], dtype=float),
+        'type': 'polygon'} for x in range(0, 200, 20) for y in range(0, 200, 20)
+        if not (100 <= x < 140 and 60 <= y < 100)]
+    fgMk = {'param': np.array([(0, 0), (10, 0), (10, 10), (0, 10)], dtype=float), 'type': 'polygon'}
+    space = pixelPlace.FreeSpace(pf.prepareCsts(mk, (0, 0, 200, 200)), cell=1)
+    free = space.counts((0, 0, 10, 10)) == 0
+    assert free.any() and free.sum() < 40 * 40
+    for ex in (False, True):
+        csts = pf.prepareCsts(mk, (0, 0, 200, 200))
+        pos = pf.findPlacements(fgMk, csts, None, 4, rng=0, exclusive=ex, sampler='raster')
+        assert len(pos) == 4
+        assert all(100 <= x and x + 10 <= 140 and 60 <= y and y + 10 <= 100 for x, y in pos)
+    # exclusive positions are apart, so the hole takes 4 squares at most
+    csts = pf.prepareCsts(mk, (0, 0, 200, 200))
+    pos = pf.findPlacements(fgMk, csts, None, 6, rng=0, exclusive=True, sampler='raster')
+    assert 0 < len(pos) <= 9 and len(set(pos)) == len(pos)
+    assert all(pf.prepareCsts(mk + [dict(fgMk, param=fgMk['param'] + q) for q in pos if q != p],
+        (0, 0, 200, 200)).check(dict(fgMk, param=fgMk['param'] + p)) for p in pos)
+
+
+def _ellipse_test():
+    import math
+    import pixelEllipse
+    from PIL import Image
+
+    # semi-axes of 30 and 12 px, rotated by 30 degrees
+    r = math.radians(30)
+    e = {'type': 'ellipse', 'param': np.array([(60, 50), (60 + 30 * math.cos(r), 50 + 30 * math.sin(r)),
+        (60 - 12 * math.sin(r), 50 + 12 * math.cos(r))])}
+    dense = Polygon(pixelEllipse.polygon(e, 1e-3))
+    assert np.allclose(pixelEllipse.bounds(e), dense.bounds, atol=1e-2)
+    assert abs(pixelEllipse.area(e) - dense.area) < 0.1
+    assert len(pixelEllipse.polygon(e)) < 64 and pixelEllipse.contains(e, [(60, 50), (0, 0)]).tolist() == [True, False]
+    # sure answers of the analytic overlap agree with shapely
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        c, u, v = rng.uniform(0, 120, 2), rng.uniform(-25, 25, 2), rng.uniform(-25, 25, 2)
+        f = {'type': 'ellipse', 'param': np.array([c, c + u, c + v])}
+        rel = pixelEllipse.relation(e, f)
+        if rel:
+            assert (rel > 0) == (dense.intersection(Polygon(pixelEllipse.polygon(f, 1e-3))).area > 0)
+
+    mk = [e, {'type': 'circle', 'param': np.array([(150, 150), (170, 150)], dtype=float)},
+        {'type': 'point', 'param': np.array([100, 150], dtype=float)}]
+    csts = pf.prepareCsts(mk, (0, 0, 200, 200))
+    raw = pf.parseToCsts(mk, (0, 0, 200, 200))
+    fgMk = {'type': 'circle', 'param': np.array([(0, 0), (10, 0)], dtype=float)}
+    assert csts.check(dict(fgMk, param=fgMk['param'] + (10, 10)))
+    assert not csts.check(dict(fgMk, param=fgMk['param'] + (60, 50)))
+    assert not csts.check(dict(fgMk, param=fgMk['param'] + (95, 150)))
+    assert not pf.constrainsCheck(dict(fgMk, param=fgMk['param'] + (150, 150)), raw)
+    for p in pf.findPlacements(fgMk, csts, None, 5, rng=0):
+        assert pf.constrainsCheck(dict(fgMk, param=fgMk['param'] + p), pf.prepareCsts(raw))
+
+    # cut, mask and rotate keep the whole outline in the image
+    px = Image.new('RGBA', (200, 200), (255, 0, 0, 255))
+    cutPx, cutMk = pf.copyRegion(px, e)
+    x0, y0, x1, y1 = pixelEllipse.bounds(e)
+    assert cutPx.size == (math.ceil(x1) - math.floor(x0), math.ceil(y1) - math.floor(y0))
+    cutPx = pf.masking(cutPx, [cutMk])
+    assert abs(np.count_nonzero(np.asarray(cutPx)[:, :, 3]) - pixelEllipse.area(e)) < 60
+    rotPx, rotMk = pf.rotate(cutPx, cutMk, 37)
+    x0, y0, x1, y1 = pixelEllipse.bounds(rotMk)
+    assert 0 <= x0 and 0 <= y0 and x1 <= rotPx.size[0] and y1 <= rotPx.size[1]
+    assert np.allclose(pixelEllipse.area(rotMk), pixelEllipse.area(e))
+
+
+def _startup_test():
+    import benchmark
+
+    # an import alone loads neither shapely nor matplotlib, budgets aside
+    for r in benchmark.startup({'main': 10.0, 'pixelFactory': 10.0, 'pixelPipeline': 10.0}, 1):
+        assert not r['heavy'] and not r['over'], r
+
+
 def _oneToOneMatch(obj1, obj2):
     return len(obj1) == len(obj2) and all([
         np.array_equal(a.pop('param'), b.pop('param')) for a, b in zip(obj1, obj2)
@@ -111,6 +993,30 @@ def _oneToOneMatch(obj1, obj2):
 
 if __name__ == '__main__':
     pf = PixelFactory()
+    _preparedCsts_test()
+    _findPlacements_test()
+    _augment_test()
+    _labelMeFile_test()
+    _dumpLabelMe_test()
+    _noise_test()
+    _rotate_test()
+    _markingSet_test()
+    _pasteMany_test()
+    _objectBank_test()
+    _masking_test()
+    _occlusionEngine_test()
+    _metrics_test()
+    _tiledImage_test()
+    _shard_test()
+    _asyncPipeline_test()
+    _incrementalCsts_test()
+    _plan_test()
+    _rotateMany_test()
+    _sharedSample_test()
+    _shapeIndex_test()
+    _freeSpace_test()
+    _ellipse_test()
+    _startup_test()
     _pastePolyToPoly_test()
 
 